@@ -1,2 +1,8 @@
 from .betweenness import *
 from .paths import *
+from .scheduler import *
+from .checkpoint import *
+from .instrumentation import *
+from .path_records import *
+from .sweep import *
+from .contributions import *
@@ -1,31 +1,35 @@
 # this lets geopandas exclusively use shapely (not pygeos) silences a warning about depreciating pygeos out of geopandas. This is not needed when geopandas 1.0 is released in the future
+from __future__ import annotations
 import os
 os.environ['USE_PYGEOS'] = '0'
 
 import time
-import concurrent
-from concurrent import futures
-
-import multiprocessing as mp
+import tempfile
+import traceback
+import contextlib
+import concurrent.futures
 
 import networkx as nx  ## when one_betweenness_2 is deleted, this import is no longer needed. 
 import pandas as pd
-import geopandas as gpd
-import psutil
 
 import math
 import numpy as np
 import random
-
-import os
-from sys import getsizeof
+from collections import defaultdict
 
 
 
 
 from ..zonal import Zonal
 from ..zonal import Network
-from .paths import path_generator, turn_o_scope, bfs_subgraph_generation, wandering_messenger
+from ..zonal import SharedZonal, ComputePool
+from ..zonal.shared import WORKER_NODE_COLUMNS
+from .paths import path_generator, turn_o_scope, bfs_subgraph_generation, ScopeGraph, wandering_messenger, stream_path_contributions, shortest_path_dependencies
+from .scheduler import OriginScheduler, estimate_origin_costs
+from .checkpoint import Checkpoint, sparse_delta, add_sparse_delta
+from .instrumentation import Instrumentation
+from .path_records import PathRecordWriter, read_path_records, _import_pyarrow
+from .contributions import ContributionRows, ContributionMatrix, CONTRIBUTION_MATRIX_PARAMETERS
 
 def parallel_betweenness(
     network: Network,
@@ -151,8 +155,7 @@ def parallel_betweenness(
         #print(f"All cores done in {round(end - start, 2)}")
         #print("-------------------------------------------")
 
-    for idx in edge_gdf.index:
-        edge_gdf.at[idx, "betweenness"] = sum([batch[idx] for batch in batch_results])
+    edge_gdf["betweenness"] = np.sum(batch_results, axis=0)
 
     # not sure if this assignment is necessary,
     network.nodes = node_gdf
@@ -195,7 +198,9 @@ def one_betweenness_2(
 
     # graph = self.G.copy()
 
-    batch_betweenness_tracker = {edge_id: 0 for edge_id in list(edge_gdf.index)}
+    # betweenness of each edge, aligned with the rows of edge_gdf.
+    batch_betweenness_tracker = np.zeros(edge_gdf.shape[0], dtype=np.float64)
+    edge_positions = network.edge_positions()
 
     counter = 0
     retain_paths = {}
@@ -384,8 +389,7 @@ def one_betweenness_2(
                             trip_probability = this_d_gravity / od_sum_gravities
                         betweennes_contribution *= trip_probability
 
-                    for edge_id in this_od_paths["path_edges"][seq]:
-                        batch_betweenness_tracker[edge_id] += betweennes_contribution
+                    np.add.at(batch_betweenness_tracker, edge_positions[np.asarray(this_od_paths["path_edges"][seq], dtype=np.int64)], betweennes_contribution)
             except Exception as e:
                 print(f"................o: {origin_idx}\td: {destination_idx} faced an error........")
                 print(path)
@@ -428,6 +432,219 @@ def clockwiseangle_and_distance(origin, point):
     return angle
 
 
+def stream_path_betweenness(
+    network: Network,
+    o_graph,
+    o_idx,
+    d_idxs,
+    distance_matrix,
+    od_scope,
+    destination_probabilities,
+    origin_weight,
+    batch_betweenness_tracker,
+    edge_positions,
+    turn_penalty=False,
+    beta=0.003,
+    decay=True,
+    decay_method="exponent",
+    path_detour_penalty="equal",
+    closest_destination_distance=0,
+):
+    """
+    Adds the betweenness of paths from `o_idx` to `d_idxs` ({d_idx: allowed distance}) to `batch_betweenness_tracker`,
+    an array aligned with the network edges (see `Network.edge_positions`), without keeping the paths, in two passes of `stream_path_contributions`: the first sums path detour penalties
+    per destination, the second adds each path's share of its destination probability to the path's edges.
+    Returns path counts and origin stats of the destinations in the same form as `betweenness_exposure` keeps them.
+    """
+    if path_detour_penalty not in ["equal", "power", "exponent"]:
+        raise ValueError(
+            f"parameter 'path_detour_penalty' should be one of ['equal', 'power', 'exponent'], '{path_detour_penalty}' was given")
+    if decay and (decay_method not in ["exponent", "power"]):
+        raise ValueError(
+            f"parameter 'decay_method' should be one of ['exponent', 'power'], '{decay_method}' was given")
+
+    # exponent decay only depends on the closest destination, the same for all paths.
+    closest_destination_decay = 1.0 / pow(math.e, beta * closest_destination_distance)
+
+    def detour_penalty_and_decay(path_weight):
+        # This fixes numerical issues  when path length = 0
+        path_weight = max(path_weight, 0.01)
+        if path_detour_penalty == "exponent":
+            penalty = 1.0 / pow(math.e, beta * path_weight)
+        elif path_detour_penalty == "power":
+            penalty = 1.0 / (path_weight ** 2.0)
+        else:
+            penalty = 1.0
+        if not decay:
+            path_decay = 1.0
+        elif decay_method == "exponent":
+            path_decay = closest_destination_decay
+        else:
+            path_decay = 1.0 / (path_weight ** 2.0)
+        return path_weight, penalty, path_decay
+
+    # first pass: per destination, the sum of penalties and of penalty weighted lengths.
+    penalty_sums = {d_idx: 0.0 for d_idx in d_idxs}
+    length_sums = {d_idx: 0.0 for d_idx in d_idxs}
+    decayed_length_sums = {d_idx: 0.0 for d_idx in d_idxs}
+    path_counts = [0, 0]
+
+    def count_path(d_idx, path_weight, segment_count):
+        path_weight, penalty, path_decay = detour_penalty_and_decay(path_weight)
+        penalty_sums[d_idx] += penalty
+        length_sums[d_idx] += penalty * path_weight
+        decayed_length_sums[d_idx] += penalty * path_decay * path_weight
+        path_counts[0] += 1
+        path_counts[1] += segment_count
+        return 0
+
+    pruned_branches = stream_path_contributions(
+        network=network,
+        o_graph=o_graph,
+        o_idx=o_idx,
+        d_idxs=d_idxs,
+        distance_matrix=distance_matrix,
+        turn_penalty=turn_penalty,
+        od_scope=od_scope,
+        path_contribution=count_path,
+    )
+
+    # second pass: path betweenness, now that path probabilities can be normalized per destination.
+    destination_weights = {
+        d_idx: destination_probability * origin_weight / penalty_sums[d_idx]
+        for d_idx, destination_probability in zip(d_idxs, destination_probabilities)
+        if penalty_sums[d_idx] > 0
+    }
+
+    def path_betweenness(d_idx, path_weight, segment_count):
+        _, penalty, path_decay = detour_penalty_and_decay(path_weight)
+        return penalty * path_decay * destination_weights[d_idx]
+
+    if path_counts[0] > 0:
+        edge_betweenness = defaultdict(float)
+        stream_path_contributions(
+            network=network,
+            o_graph=o_graph,
+            o_idx=o_idx,
+            d_idxs=d_idxs,
+            distance_matrix=distance_matrix,
+            turn_penalty=turn_penalty,
+            od_scope=od_scope,
+            path_contribution=path_betweenness,
+            edge_accumulator=edge_betweenness,
+        )
+        edge_ids = np.fromiter(edge_betweenness.keys(), dtype=np.int64, count=len(edge_betweenness))
+        np.add.at(batch_betweenness_tracker, edge_positions[edge_ids], np.fromiter(edge_betweenness.values(), dtype=np.float64, count=len(edge_betweenness)))
+
+    mean_path_length = 0
+    probable_travel_distance = 0
+    for d_idx, destination_probability in zip(d_idxs, destination_probabilities):
+        if penalty_sums[d_idx] > 0:
+            mean_path_length += destination_probability * length_sums[d_idx] / penalty_sums[d_idx]
+            probable_travel_distance += destination_probability * decayed_length_sums[d_idx] / penalty_sums[d_idx]
+
+    return {
+        "path_count": path_counts[0],
+        "segment_count": path_counts[1],
+        "pruned_branches": pruned_branches,
+        "mean_path_length": mean_path_length,
+        "probable_travel_distance": probable_travel_distance,
+    }
+
+
+def shortest_path_betweenness(
+    o_graph,
+    o_idx,
+    o_scope,
+    d_idxs,
+    destination_probabilities,
+    beta=0.003,
+    decay=True,
+    decay_method="exponent",
+    path_detour_penalty="equal",
+    closest_destination_distance=0,
+):
+    """
+    Betweenness of trips from `o_idx` to `d_idxs` ({d_idx: shortest distance}) for a unit origin weight, when trips
+    only use shortest paths (`detour_ratio=1`), accumulated over the shortest path DAG by `shortest_path_dependencies`
+    instead of enumerating paths. Shortest paths to a destination have the same length, so every detour penalty
+    gives them equal probabilities, and decay is the same for all of them.
+    Returns edge ids, their betweenness, path counts and origin stats in the same form as `betweenness_exposure`
+    keeps them.
+    """
+    if path_detour_penalty not in ["equal", "power", "exponent"]:
+        raise ValueError(
+            f"parameter 'path_detour_penalty' should be one of ['equal', 'power', 'exponent'], '{path_detour_penalty}' was given")
+    if decay and (decay_method not in ["exponent", "power"]):
+        raise ValueError(
+            f"parameter 'decay_method' should be one of ['exponent', 'power'], '{decay_method}' was given")
+
+    # This fixes numerical issues  when path length = 0
+    path_weights = np.maximum(np.array(list(d_idxs.values()), dtype=np.float64), 0.01)
+    if not decay:
+        path_decays = np.ones(path_weights.shape[0])
+    elif decay_method == "exponent":
+        # exponent decay only depends on the closest destination, the same for all paths.
+        path_decays = np.full(path_weights.shape[0], 1.0 / pow(math.e, beta * closest_destination_distance))
+    else:
+        path_decays = 1.0 / (path_weights ** 2.0)
+
+    destination_probabilities = np.asarray(destination_probabilities, dtype=np.float64)
+    edge_ids, edge_betweenness, path_counts = shortest_path_dependencies(
+        o_graph=o_graph,
+        o_idx=o_idx,
+        o_scope=o_scope,
+        destination_values=dict(zip(d_idxs, destination_probabilities * path_decays)),
+    )
+    return {
+        "edge_ids": edge_ids,
+        "edge_betweenness": edge_betweenness,
+        "path_count": int(sum(path_counts.values())),
+        "mean_path_length": (destination_probabilities * path_weights).sum(),
+        "probable_travel_distance": (destination_probabilities * path_decays * path_weights).sum(),
+    }
+
+
+def origin_statistics(node_gdf, origin_ids, columns):
+    """
+    Returns the statistics `columns` of `origin_ids` in `node_gdf`, as a dict of arrays with their "origin_ids", to
+    save in a part or return from a worker instead of node rows. Columns that are not in `node_gdf` are left out.
+    """
+    positions = node_gdf.index.get_indexer(origin_ids)
+    statistics = {"origin_ids": np.asarray(origin_ids, dtype=np.int64)}
+    for column in columns:
+        if column in node_gdf.columns:
+            statistics[column] = node_gdf[column].values[positions]
+    return statistics
+
+
+def origin_statistics_frame(node_gdf, statistics_parts):
+    """
+    Returns the rows of `node_gdf` of the origins in `statistics_parts`, made by `origin_statistics()`, with the
+    node columns workers read and the statistics from the parts.
+    """
+    node_columns = [column for column in node_gdf.columns if (column in WORKER_NODE_COLUMNS) or (column == "geometry")]
+    if len(statistics_parts) == 0:
+        return node_gdf.iloc[:0][node_columns].copy()
+    statistics = pd.concat([pd.DataFrame(part) for part in statistics_parts], ignore_index=True)
+    origin_gdf = node_gdf.loc[statistics["origin_ids"].values, node_columns].copy()
+    for column in statistics.columns.drop("origin_ids"):
+        origin_gdf[column] = statistics[column].values
+    return origin_gdf
+
+
+def destination_chunk_size(memory_budget, scope_node_count, path_bytes_per_destination, max_chunk_size=None):
+    """
+    Returns how many destinations fit in the next chunk of an origin within `memory_budget` bytes. Each destination
+    in a chunk takes a column of the dense distance matrix, 8 bytes per scope node, and its paths, estimated by
+    `path_bytes_per_destination` from chunks already done.
+    """
+    destination_bytes = 8 * scope_node_count + path_bytes_per_destination
+    chunk_size = max(int(memory_budget // max(destination_bytes, 1)), 1)
+    if max_chunk_size is not None:
+        chunk_size = min(chunk_size, max_chunk_size)
+    return chunk_size
+
 def betweenness_exposure(
         self: Zonal,
         core_index=None,
@@ -443,41 +660,74 @@ def betweenness_exposure(
         turn_penalty=False,
         path_exposure_attribute=None,
         return_path_record=False, 
-        destniation_cap=None
+        destniation_cap=None,
+        stream_paths=False,
+        chunking_method="concentric",  # "concentric" | "random" | "pizza" | "none"
+        worker_memory_budget=512,
+        checkpoint: Checkpoint = None,
+        instrument=False,
+        path_record_directory=None,
+        path_record_run_id=None,
+        collect_contributions=False,
 ):
     edge_gdf = self.network.edges
     node_gdf = self.network.nodes
     origin_gdf=node_gdf[node_gdf['type'] == 'origin']
-    node_gdf['chunck_time'] = pd.Series(dtype=object)
-    node_gdf['chunck_path_count'] = pd.Series(dtype=object)
-    node_gdf['chunck_path_segment_count'] = pd.Series(dtype=object)
-    node_gdf['chunck_path_segment_memory'] = pd.Series(dtype=object)
-    node_gdf['chunk_scope_node_count'] = pd.Series(dtype=object)
-
 
 
-    # TODO: convert this to a numby array to simplify calculations.
-    batch_betweenness_tracker = {edge_id: 0.0 for edge_id in list(edge_gdf.index)}
+    # betweenness of each edge, aligned with the rows of edge_gdf.
+    batch_betweenness_tracker = np.zeros(edge_gdf.shape[0], dtype=np.float64)
+    edge_positions = self.network.edge_positions()
     
 
-    if return_path_record:
-        path_record = {
-            'origin_id': [],
-            'destination_id': [],
-            'destination_probability': [],
-            'path_id': [],
-            'path_weight': [],
-            'path_decay': [],
-            'path_probability': [],
-            'path_betweenness': [],
-            'geometry': [],
-        }
-        if path_exposure_attribute is not None:
-            path_record['mean_path_exposure'] = []
+    # path records are streamed to files as chunks are done, instead of being kept until the worker is done.
+    path_writer = PathRecordWriter(path_record_directory, path_record_run_id) if return_path_record else None
 
+    # edge betweenness of each origin for a unit origin weight, see `ContributionMatrix`.
+    contribution_rows = ContributionRows() if collect_contributions else None
+
+    # when trips only use shortest paths, and paths are not needed one by one, betweenness is accumulated over the
+    # shortest path DAG of each origin instead of enumerating paths, see `shortest_path_betweenness`.
+    shortest_paths_only = (detour_ratio == 1) and (not turn_penalty) and (path_exposure_attribute is None) and (not return_path_record)
+
+    if path_exposure_attribute is not None:
+        # weight, and weight x exposure of every edge for each exposure attribute, aligned with edge positions, so the
+        # exposure of all paths of a chunk is one sum over the path trie.
+        exposure_attributes = [path_exposure_attribute] if isinstance(path_exposure_attribute, str) else list(path_exposure_attribute)
+        exposure_suffixes = [""] if isinstance(path_exposure_attribute, str) else [f"_{attribute}" for attribute in exposure_attributes]
+        edge_weights = edge_gdf['weight'].to_numpy(dtype=np.float64)
+        edge_exposures = self[self.network.edge_source_layer].gdf[exposure_attributes].reindex(edge_gdf['parent_street_id'].values).to_numpy(dtype=np.float64)
+        edge_exposure_weights = np.column_stack([edge_weights, edge_weights[:, None] * edge_exposures])
+
+    # destinations of an origin are searched in chunks that fit the memory budget. chunk sizes follow the path memory
+    # measured in previous chunks, per destination and scope node, as the first chunk of an origin has no measure yet.
+    memory_budget = worker_memory_budget * 1024 ** 2
+    initial_chunk_size = 100
+    path_bytes_per_scope_node = None
+
+    # counters and timers of each origin, see `Instrumentation`. only kept when `instrument` is set.
+    origin_records = []
+
+    # origin statistics set by this worker, parts and results only keep these of the node frame.
+    statistic_columns = ["knn_weight", "knn_access", "reach", "gravity"]
+    if path_exposure_attribute is not None:
+        statistic_columns += [column + suffix for suffix in exposure_suffixes for column in ["mean_hazzard", "decayed_mean_hazzad", "expected_hazzard_meters", "probable_travel_distance_weighted_hazzard"]]
+    statistic_columns += ["closest_destination_distance", "furthest_destination_distance", "mean_path_length", "probable_travel_distance"]
 
     processed_origins = []
     while True:
+        # saving finished origins and what they added to edges, so they are not lost if this worker dies.
+        if (checkpoint is not None) and (len(processed_origins) > 0) and checkpoint.due():
+            part = {"origin_ids": processed_origins, "edge_betweenness": sparse_delta(batch_betweenness_tracker), "origins": origin_statistics(node_gdf, processed_origins, statistic_columns), "instrumentation": origin_records}
+            if return_path_record:
+                part["path_record_files"] = path_writer.commit()
+            if collect_contributions:
+                part["contributions"] = contribution_rows.take()
+            checkpoint.save(part)
+            batch_betweenness_tracker[:] = 0
+            processed_origins = []
+            origin_records = []
+
         try: 
             origin_idx = origin_queue.get()
             start = time.time()
@@ -485,26 +735,35 @@ def betweenness_exposure(
                 origin_queue.task_done()
                 break
             processed_origins.append(origin_idx)
+            if instrument:
+                record = Instrumentation.origin_record(origin_idx)
+                origin_records.append(record)
 
             #if len(processed_origins)%100 == 0:
                 #print (f'DOne {len(processed_origins)}')
                 
-            if origin_gdf.at[origin_idx, "weight"] == 0:
+            # origins with no weight add nothing to betweenness, but their contributions are kept to reweigh them.
+            if (origin_gdf.at[origin_idx, "weight"] == 0) and (not collect_contributions):
                 continue
 
             #origin_edge = node_gdf.at[origin_idx, "nearest_edge_id"]
             if path_exposure_attribute is not None:
-                origin_mean_hazzard = 0
-                origin_decayed_mean_hazzard = 0
-                expected_hazzard_meters = 0
-                probable_travel_distance_weighted_hazzard = 0
+                origin_mean_hazzard = np.zeros(len(exposure_attributes))
+                origin_decayed_mean_hazzard = np.zeros(len(exposure_attributes))
+                expected_hazzard_meters = np.zeros(len(exposure_attributes))
+                probable_travel_distance_weighted_hazzard = np.zeros(len(exposure_attributes))
 
             #origin stats
             origin_mean_path_length = 0
             probable_travel_distance = 0
         except Exception as ex:
             print (f"CORE: {core_index}: [betweenness_exposure]: error aquiring new origin, returning what was processed so far {len(processed_origins) = }")
-            return {"batch_betweenness_tracker": batch_betweenness_tracker, 'origins': origin_gdf.loc[processed_origins]}
+            return_dict = {"batch_betweenness_tracker": batch_betweenness_tracker, 'origins': origin_gdf.loc[processed_origins], "instrumentation": origin_records}
+            if return_path_record:
+                return_dict["path_record_files"] = path_writer.commit()
+            if collect_contributions:
+                return_dict["contributions"] = contribution_rows.take()
+            return return_dict
 
 
 
@@ -520,8 +779,7 @@ def betweenness_exposure(
             #    detour_ratio=detour_ratio,
             #    turn_penalty=turn_penalty
             #)
-            o_graph = self.network.d_graph
-            self.network.add_node_to_graph(o_graph, origin_idx)
+            o_graph = self.network.virtual_node_graph(self.network.d_graph, origin_idx)
 
             d_idxs, o_scope, o_scope_paths = turn_o_scope(
                 network=self.network,
@@ -532,14 +790,19 @@ def betweenness_exposure(
                 o_graph=o_graph,
                 return_paths=True
             )
-            destination_discovery_time = time.time() - start
+            if instrument:
+                record["destination_discovery_time"] = time.time() - start
+                record["scope_nodes"] = len(o_scope)
+                record["heap_pushes"] = len(o_scope_paths.label_nodes) - 1
+                record["reachable_destinations"] = len(d_idxs)
+            if collect_contributions:
+                contribution_rows.add_scope(origin_idx, o_scope)
             start = time.time()
         except Exception as ex:
             print (f"CORE: {core_index}: [betweenness_exposure]: error generating path for origin {origin_idx = }, {len(processed_origins) = }")
             print(str(ex))
             print(ex.__doc__)
             print (ex.__traceback__)
-            import traceback
             traceback.print_exc()
             print (f"CORE: {core_index}: [betweenness_exposure]: skipping origin: {origin_idx = }, {len(processed_origins) = }")
             continue
@@ -549,7 +812,6 @@ def betweenness_exposure(
         try:
             # skip this origin if cannot reach any destination
             if len(d_idxs) == 0:
-                self.network.remove_node_to_graph(o_graph, origin_idx)
                 origin_queue.task_done()
                 continue
             
@@ -571,42 +833,36 @@ def betweenness_exposure(
                 #TODO: because node_gdf is modified internally, need to update the copy origin_gdf as it doesn't see the new updates. Consider alternatives.
                 origin_gdf=node_gdf[node_gdf['type'] == 'origin']
             origin_weight = origin_gdf.at[origin_idx, origin_weight_attribute]
+            # betweenness is linear in the origin's weight, elastic weights scale it by the origin's knn access.
+            origin_unit_weight = origin_gdf.at[origin_idx, 'knn_access'] if elastic_weight else 1.0
+            origin_contribution_positions = []
+            origin_contribution_values = []
 
         except Exception as ex:
             print (f"CORE: {core_index}: [betweenness_exposure]: error generating weight for origin {origin_idx = }, {len(processed_origins) = }, skipping origin.")
             traceback.print_exc()
             continue
         try:
-            max_chunck_size = 100 
-            chunking_method = 'cocentric-chunks'
             if closest_destination:
                 # just use the closest destination.
-                destination_probabilities = [1]
+                destination_probabilities = np.array([1.0])
                 destination_ids = [min(d_idxs, key=d_idxs.get)]
                 eligible_destinations = {destination_ids[0]:d_idxs[destination_ids[0]]}
             else:
                 # probability of choosing a destination using the huff model
                 eligible_destinations = d_idxs if destniation_cap   is None else dict(list(d_idxs.items())[:destniation_cap])
                 destination_ids = list(eligible_destinations.keys())
-                #max_chunck_size = 100
-                #chunking_method = self.network.chunking_method
-                #max_chunck_size = self.network.max_chunck_size
-                if len(destination_ids) > max_chunck_size:
-                    if chunking_method == 'no_chunking':
-                        pass # do nothing
-                    elif chunking_method == 'cocentric-chunks':
-                        pass # do nothing
-                    elif chunking_method == 'random_chunks':
-                        random.shuffle(destination_ids)  # shuffled in place..
-                        eligible_destinations = {destination:eligible_destinations[destination] for destination in destination_ids}
-                        pass
-                    elif chunking_method == 'pizza_chunks':
-                        destinations = node_gdf.loc[destination_ids]
-                        origin_geom = node_gdf.at[origin_idx,'geometry'].coords
-                        destinations['angle'] = destinations['geometry'].apply(lambda x: clockwiseangle_and_distance([origin_geom[0][0], origin_geom[0][1]], [x.coords[0][0], x.coords[0][1]]))
-
-                        destination_ids = list(destinations.sort_values('angle').index)
-                        eligible_destinations = {destination:eligible_destinations[destination] for destination in destination_ids}
+                # destinations are already sorted by distance for concentric chunks.
+                if chunking_method == 'random':
+                    random.shuffle(destination_ids)  # shuffled in place..
+                    eligible_destinations = {destination:eligible_destinations[destination] for destination in destination_ids}
+                elif chunking_method == 'pizza':
+                    destinations = node_gdf.loc[destination_ids]
+                    origin_geom = node_gdf.at[origin_idx,'geometry'].coords
+                    destinations['angle'] = destinations['geometry'].apply(lambda x: clockwiseangle_and_distance([origin_geom[0][0], origin_geom[0][1]], [x.coords[0][0], x.coords[0][1]]))
+
+                    destination_ids = list(destinations.sort_values('angle').index)
+                    eligible_destinations = {destination:eligible_destinations[destination] for destination in destination_ids}
 
                 eligible_destinations_weight = np.array([float(node_gdf.at[idx, 'weight']) for idx in destination_ids], dtype=np.float64)
                 eligible_destinations_shortest_distance = np.array(list(eligible_destinations.values()))
@@ -618,48 +874,69 @@ def betweenness_exposure(
                 destination_probabilities = np.array(destination_gravities) / sum(destination_gravities)
         except Exception as ex:
             print (f"CORE: {core_index}: [betweenness_exposure]: error generating destination probabilities for origin {origin_idx = }, {len(processed_origins) = }, {eligible_destinations_weight = }, {eligible_destinations_shortest_distance = },  {destination_gravities = }, skipping origin")
-            import traceback
             traceback.print_exc()
             continue
         
-        if (len(destination_ids) > max_chunck_size) and (chunking_method in ['cocentric-chunks', 'random_chunks', 'pizza_chunks']):
-            num_chunks = np.ceil(len(destination_ids)/max_chunck_size)
-            d_chuncks = np.array_split(destination_ids, num_chunks)
-            d_idx_chuncks = [{destination:eligible_destinations[destination] for destination in destination_chunck} for destination_chunck in d_chuncks]
-            destination_probabilities_ckuncks = np.array_split(destination_probabilities, num_chunks)
-        else:
-            d_idx_chuncks =  [eligible_destinations]
-            destination_probabilities_ckuncks = [destination_probabilities]
-
-        #print (f"after chuncks {d_idx_chuncks = }\t{destination_probabilities_ckuncks  =}")
-        destination_prep_time = time.time() - start
-        memory_stalls = 0
-        chunck_time = []
-        chunck_path_count = []
-        chunck_segment_count = []
-        chunck_path_segment_memory = []
-        chunk_scope_node_count = []
+        if instrument:
+            record["destination_prep_time"] = time.time() - start
+            record["eligible_destinations"] = len(destination_ids)
 
 
 
-        for chunck_num, (d_idx_chunck, destination_probabilities_ckunck) in enumerate(zip(d_idx_chuncks, destination_probabilities_ckuncks)): 
+        if shortest_paths_only:
+            start = time.time()
             try:
-                start = time.time()
-                # force to wait for at least 2.4GB of available memory, and %15 of memory is available so processes don't cause memory clogging
-                memory_data = psutil.virtual_memory()
-                available_gb_memory = memory_data[1] /(1024 ** 3)
-                available_memory_pct = 100-memory_data[2]
-
-                while (available_gb_memory < 2.4) or (available_memory_pct < 15.0):
-                    memory_stalls +=1
-                    time.sleep(30)
-                    memory_data = psutil.virtual_memory()
-                    available_gb_memory = memory_data[1] /(1024 ** 3)
-                    available_memory_pct = 100-memory_data[2]
+                origin_stats = shortest_path_betweenness(
+                    o_graph=o_graph,
+                    o_idx=origin_idx,
+                    o_scope=o_scope,
+                    d_idxs=eligible_destinations,
+                    destination_probabilities=destination_probabilities,
+                    beta=beta,
+                    decay=decay,
+                    decay_method=decay_method,
+                    path_detour_penalty=path_detour_penalty,
+                    closest_destination_distance=min(list(d_idxs.values())),
+                )
+                origin_edge_positions = edge_positions[origin_stats["edge_ids"]]
+                batch_betweenness_tracker += np.bincount(origin_edge_positions, weights=origin_stats["edge_betweenness"] * origin_weight, minlength=batch_betweenness_tracker.shape[0])
+                if collect_contributions:
+                    origin_contribution_positions.append(origin_edge_positions)
+                    origin_contribution_values.append(origin_stats["edge_betweenness"] * origin_unit_weight)
+                origin_mean_path_length += origin_stats["mean_path_length"]
+                probable_travel_distance += origin_stats["probable_travel_distance"]
+                if instrument:
+                    record["chunks"] += 1
+                    record["paths"] += origin_stats["path_count"]
+                    record["betweenness_time"] += time.time() - start
             except Exception as ex:
-                print (f"CORE: {core_index}: [betweenness_exposure]: error with memory management mechanisim, skipping memory management and getting a new task")
+                print (f"CORE: {core_index}: [betweenness_exposure]: error assigning shortest path betweenness for origin {origin_idx = }, {len(processed_origins) = }, skipping origin")
+                traceback.print_exc()
 
+        chunk_start = 0
+        chunck_num = -1
+        chunk_size = None
+        path_bytes_per_destination = None
+        # the scope's edges, shared by the searches of all chunks
+        scope_graph = None
+        while (not shortest_paths_only) and (chunk_start < len(destination_ids)):
+            start = time.time()
+            chunck_num += 1
+            if chunking_method == 'none':
+                chunk_size = len(destination_ids)
+            elif path_bytes_per_destination is not None:
+                # further destinations tend to have more paths, so chunks grow at most twofold.
+                chunk_size = destination_chunk_size(memory_budget, len(o_scope), path_bytes_per_destination, max_chunk_size=2 * chunk_size)
+            elif path_bytes_per_scope_node is not None:
+                chunk_size = destination_chunk_size(memory_budget, len(o_scope), path_bytes_per_scope_node * len(o_scope))
+            else:
+                chunk_size = destination_chunk_size(memory_budget, len(o_scope), 0, max_chunk_size=initial_chunk_size)
+            d_idx_chunck = {destination:eligible_destinations[destination] for destination in destination_ids[chunk_start:chunk_start + chunk_size]}
+            destination_probabilities_ckunck = destination_probabilities[chunk_start:chunk_start + chunk_size]
+            chunk_start += chunk_size
             try:
+                if scope_graph is None:
+                    scope_graph = ScopeGraph(origin_idx, o_graph, o_scope)
                 ## get subgraph and and path..
                 scope_nodes, distance_matrix, _ = bfs_subgraph_generation(
                     o_idx=origin_idx,
@@ -669,13 +946,47 @@ def betweenness_exposure(
                     #d_idxs=d_idx_chunck,
                     o_scope=o_scope,
                     o_scope_paths=o_scope_paths,
+                    scope_graph=scope_graph,
                 )
 
                 d_allowed_distances = {}
                 for d_idx in d_idx_chunck.keys():
                     d_allowed_distances[d_idx] =  d_idx_chunck[d_idx] * detour_ratio
 
-                path_edges, weights = wandering_messenger(
+                if stream_paths and (path_exposure_attribute is None) and (not return_path_record) and (not collect_contributions):
+                    chunck_stats = stream_path_betweenness(
+                        network=self.network,
+                        o_graph=o_graph,
+                        o_idx=origin_idx,
+                        d_idxs=d_allowed_distances,
+                        distance_matrix=distance_matrix,
+                        od_scope=scope_nodes,
+                        destination_probabilities=destination_probabilities_ckunck,
+                        origin_weight=origin_weight,
+                        batch_betweenness_tracker=batch_betweenness_tracker,
+                        edge_positions=edge_positions,
+                        turn_penalty=turn_penalty,
+                        beta=beta,
+                        decay=decay,
+                        decay_method=decay_method,
+                        path_detour_penalty=path_detour_penalty,
+                        closest_destination_distance=min(list(d_idxs.values())),
+                    )
+                    origin_mean_path_length += chunck_stats["mean_path_length"]
+                    probable_travel_distance += chunck_stats["probable_travel_distance"]
+
+                    # paths are not kept so they take no memory, and betweenness is added as they are found.
+                    if instrument:
+                        record["chunks"] += 1
+                        record["distance_matrix_entries"] += distance_matrix.values.shape[0]
+                        record["paths"] += chunck_stats["path_count"]
+                        record["path_segments"] += chunck_stats["segment_count"]
+                        record["pruned_branches"] += chunck_stats["pruned_branches"]
+                        record["path_generation_time"] += time.time() - start
+                    path_bytes_per_destination = 0
+                    continue
+
+                path_trie = wandering_messenger(
                 #path_edges, weights = bfs_path_edges_many_targets_iterative(
                     network=self.network,
                     o_graph=o_graph,
@@ -686,18 +997,42 @@ def betweenness_exposure(
                     od_scope=scope_nodes
                 )
 
-                #Diagnostics
-                chunck_path_count.append(sum([len(dest_paths) for dest_paths in path_edges.values()]))
-                chunck_segment_count.append(sum([sum([len(path_edges) for path_edges in dest_paths]) for dest_paths in path_edges.values()]))
-                chunck_path_segment_memory.append(sum([sum([getsizeof(path_edges) for path_edges in dest_paths]) for dest_paths in path_edges.values()]))
-                chunk_scope_node_count.append(len(scope_nodes))
+                if instrument:
+                    record["chunks"] += 1
+                    record["distance_matrix_entries"] += distance_matrix.values.shape[0]
+                    record["paths"] += len(path_trie)
+                    record["path_segments"] += path_trie.segment_count()
+                    record["pruned_branches"] += path_trie.pruned_branches
+                    record["path_memory"] = max(record["path_memory"], path_trie.nbytes)
+                    record["path_generation_time"] += time.time() - start
+                    start = time.time()
+
+                path_bytes_per_destination = path_trie.nbytes / len(d_idx_chunck)
+                path_bytes_per_scope_node = path_bytes_per_destination / len(o_scope)
             except Exception as ex:
                 print (f"CORE: {core_index}: [betweenness_exposure]: error generating paths for origin {origin_idx = } destination chunck {chunck_num = }, {len(processed_origins) = }, skipping destination")
-                import traceback
                 traceback.print_exc()
 
                 continue
 
+            # betweenness contribution of every path in the chunk, added to the edges once the chunk is done.
+            path_betweenness = np.zeros(len(path_trie), dtype=np.float64)
+            if collect_contributions:
+                path_unit_contributions = np.zeros(len(path_trie), dtype=np.float64)
+
+            if return_path_record:
+                # path attributes, filled for every destination betweenness is assigned to.
+                record_destination_ids = np.full(len(path_trie), -1, dtype=np.int64)
+                record_destination_probabilities = np.zeros(len(path_trie), dtype=np.float64)
+                record_path_ids = np.zeros(len(path_trie), dtype=np.int64)
+                record_path_probabilities = np.zeros(len(path_trie), dtype=np.float64)
+                record_path_decays = np.zeros(len(path_trie), dtype=np.float64)
+
+            if path_exposure_attribute is not None:
+                # weighted mean exposure of every path, one column per exposure attribute. paths with no weight have no exposure.
+                path_exposure_sums = path_trie.path_sums(edge_exposure_weights[edge_positions[path_trie.edge_ids]])
+                path_mean_exposures = np.divide(path_exposure_sums[:, 1:], path_exposure_sums[:, :1], out=np.zeros((path_exposure_sums.shape[0], len(exposure_attributes))), where=path_exposure_sums[:, :1] > 0)
+
             for destination_idx, this_destination_probability in zip(d_idx_chunck.keys(), destination_probabilities_ckunck):
             #origin_mean_path_length  = (destination_path_probabilies * d_path_weights).sum()
             #probable_travel_distance = (destination_path_probabilies * path_decays * d_path_weights).sum()
@@ -705,13 +1040,14 @@ def betweenness_exposure(
                     #od_edges = set([node_gdf.at[destination_idx, "nearest_edge_id"], origin_edge])
 
                     # skip this destination if cannot find paths from origin
-                    if len(weights[destination_idx]) == 0:
+                    d_paths = path_trie.paths(destination_idx)
+                    if len(d_paths) == 0:
                         #print(f"o:{origin_idx}\td:{destination_idx} have no paths...")
                         continue
 
                     # finding path probabilities given different penalty settings.
-                    path_detour_penalties = np.ones(len(weights[destination_idx]))
-                    d_path_weights = np.array(weights[destination_idx])
+                    path_detour_penalties = np.ones(len(d_paths))
+                    d_path_weights = path_trie.weights(destination_idx).copy()
 
                     # This fixes numerical issues  when path length = 0
                     d_path_weights[d_path_weights < 0.01] = 0.01
@@ -758,7 +1094,7 @@ def betweenness_exposure(
 
 
                     # FInding path decays. TODO: consider taking out of the loop as this 
-                    path_decays = np.ones(len(weights[destination_idx]))
+                    path_decays = np.ones(len(d_paths))
                     if decay:
                         if decay_method == "exponent":
                             # path_decays = 1.0 / pow(np.e, beta * d_path_weights)
@@ -779,68 +1115,75 @@ def betweenness_exposure(
                     origin_mean_path_length += (destination_path_probabilies * d_path_weights).sum()
                     probable_travel_distance += (destination_path_probabilies * path_decays * d_path_weights).sum()
 
+                    path_betweenness[d_paths.start:d_paths.stop] = betweennes_contributions
+                    if collect_contributions:
+                        path_unit_contributions[d_paths.start:d_paths.stop] = destination_path_probabilies * path_decays * origin_unit_weight
+                    if return_path_record:
+                        record_destination_ids[d_paths.start:d_paths.stop] = destination_idx
+                        record_destination_probabilities[d_paths.start:d_paths.stop] = this_destination_probability
+                        record_path_ids[d_paths.start:d_paths.stop] = np.arange(len(d_paths))
+                        record_path_probabilities[d_paths.start:d_paths.stop] = path_probabilities
+                        record_path_decays[d_paths.start:d_paths.stop] = path_decays
+
                     if len(d_path_weights[d_path_weights > (d_idx_chunck[destination_idx] * detour_ratio)+ 0.01]) > 0:
                         print(f"SOme paths exceeded allowed tolerance: {d_path_weights[d_path_weights > (d_idx_chunck[destination_idx] * detour_ratio)+ 0.01]}")
 
                 except Exception as ex:
                     print (f"CORE: {core_index}: [betweenness_exposure]: error generating path probabilities, decay,  betweenness for origin {origin_idx = } destination {destination_idx = }, {len(processed_origins) = }, skipping destination")
-                    import traceback
                     traceback.print_exc()
                     continue
 
 
                 try:
-                    if path_exposure_attribute is None:
-
-                        for this_path_edges, betweennes_contribution in zip (path_edges[destination_idx], betweennes_contributions): 
-                            for edge_id in this_path_edges:
-                            #for edge_id in set(this_path_edges).union(od_edges):
-                                batch_betweenness_tracker[edge_id] += betweennes_contribution
-
-                    else:  # for exposure
-                        for this_path_edges, betweennes_contribution, destination_path_probability, path_decay, this_path_weight in zip (path_edges[destination_idx], betweennes_contributions, destination_path_probabilies, path_decays, d_path_weights): 
-                            path_weight_exposure = 0       
-                            path_weight_sum = 0            
-
-
-                            for edge_id in this_path_edges:
-                                batch_betweenness_tracker[edge_id] += betweennes_contribution
-                                segment_weight = edge_gdf.at[int(edge_id), 'weight']
-                                path_weight_sum += segment_weight
-                                path_weight_exposure += segment_weight * self[self.network.edge_source_layer].gdf.at[edge_gdf.at[edge_id, 'parent_street_id'], path_exposure_attribute]
-                                
-                            
-                        
-                            path_mean_exposure = path_weight_exposure / path_weight_sum
-
-                            origin_mean_hazzard += destination_path_probability * path_mean_exposure
-                            origin_decayed_mean_hazzard += destination_path_probability * path_decay * path_mean_exposure
-                            expected_hazzard_meters += path_mean_exposure * destination_path_probability * this_path_weight
-                            probable_travel_distance_weighted_hazzard += destination_path_probability * path_decay * path_mean_exposure * this_path_weight
+                    if path_exposure_attribute is not None:
+                        d_path_mean_exposures = path_mean_exposures[d_paths.start:d_paths.stop]
+                        origin_mean_hazzard += destination_path_probabilies @ d_path_mean_exposures
+                        origin_decayed_mean_hazzard += (destination_path_probabilies * path_decays) @ d_path_mean_exposures
+                        expected_hazzard_meters += (destination_path_probabilies * d_path_weights) @ d_path_mean_exposures
+                        probable_travel_distance_weighted_hazzard += (destination_path_probabilies * path_decays * d_path_weights) @ d_path_mean_exposures
                 except:
                     print (f"CORE: {core_index}: [betweenness_exposure]: error assigning path betweenness to segment {origin_idx = } destination {destination_idx = }, {len(processed_origins) = }, skipping destination")
-                    import traceback
                     traceback.print_exc()
                     continue
-            chunck_time.append(time.time()-start)
-            #done chunck, since there is chance to pause for memory, delete this ieration's variables
 
+            try:
+                trie_edge_ids, trie_edge_betweenness = path_trie.edge_sums(path_betweenness)
+                batch_betweenness_tracker += np.bincount(edge_positions[trie_edge_ids], weights=trie_edge_betweenness, minlength=batch_betweenness_tracker.shape[0])
+                if collect_contributions:
+                    _, trie_edge_contributions = path_trie.edge_sums(path_unit_contributions)
+                    origin_contribution_positions.append(edge_positions[trie_edge_ids])
+                    origin_contribution_values.append(trie_edge_contributions)
+            except Exception as ex:
+                print (f"CORE: {core_index}: [betweenness_exposure]: error assigning path betweenness to segments {origin_idx = } destination chunck {chunck_num = }, {len(processed_origins) = }, skipping destination chunck")
+                traceback.print_exc()
 
-        '''
-                if return_path_record:
-                    path_record['origin_id'].append(origin_idx)
-                    path_record['destination_id'].append(destination_idx)
-                    path_record['destination_probability'].append(this_destination_probability)
-                    path_record['path_id'].append(path_id)
-                    path_record['path_weight'].append(this_path_weight)
-                    path_record['path_decay'].append(path_decay)
-                    path_record['path_probability'].append(destination_path_probability/this_destination_probability)
-                    path_record['path_betweenness'].append(betweennes_contribution)
-                    path_record['geometry'].append(geo.MultiLineString(edge_gdf.loc[edge_ids]['geometry'].values))
+            if return_path_record:
+                try:
+                    record_paths = np.flatnonzero(record_destination_ids != -1)
+                    record_edge_offsets, record_edge_ids = path_trie.edge_lists(record_paths)
+                    record_columns = {
+                        'origin_id': np.full(record_paths.shape[0], origin_idx, dtype=np.int64),
+                        'destination_id': record_destination_ids[record_paths],
+                        'destination_probability': record_destination_probabilities[record_paths],
+                        'path_id': record_path_ids[record_paths],
+                        'path_weight': path_trie.path_weights[record_paths],
+                        'path_decay': record_path_decays[record_paths],
+                        'path_probability': record_path_probabilities[record_paths],
+                        'path_betweenness': path_betweenness[record_paths],
+                    }
                     if path_exposure_attribute is not None:
-                        path_record['mean_path_exposure'].append(path_mean_exposure)
+                        for attribute_index, suffix in enumerate(exposure_suffixes):
+                            record_columns['mean_path_exposure' + suffix] = path_mean_exposures[record_paths, attribute_index]
+                    path_writer.write(record_columns, record_edge_offsets, record_edge_ids)
+                except Exception as ex:
+                    print (f"CORE: {core_index}: [betweenness_exposure]: error writing path records {origin_idx = } destination chunck {chunck_num = }, {len(processed_origins) = }, skipping destination chunck records")
+                    traceback.print_exc()
+            if instrument:
+                record["betweenness_time"] += time.time() - start
+
+        if collect_contributions and (len(origin_contribution_positions) > 0):
+            contribution_rows.add(origin_idx, origin_contribution_positions, origin_contribution_values)
 
-        '''
         try:
             #pass
             node_gdf.at[origin_idx, 'reach'] = len(d_idxs)
@@ -850,56 +1193,113 @@ def betweenness_exposure(
                 node_gdf.at[origin_idx, "knn_weight"] = origin_weight
                     
             if path_exposure_attribute is not None:
-                node_gdf.at[origin_idx, 'mean_hazzard'] = origin_mean_hazzard
-                node_gdf.at[origin_idx, 'decayed_mean_hazzad'] = origin_decayed_mean_hazzard
-                node_gdf.at[origin_idx, 'expected_hazzard_meters'] = expected_hazzard_meters
-                node_gdf.at[origin_idx, 'probable_travel_distance_weighted_hazzard'] = probable_travel_distance_weighted_hazzard
+                for attribute_index, suffix in enumerate(exposure_suffixes):
+                    node_gdf.at[origin_idx, 'mean_hazzard' + suffix] = origin_mean_hazzard[attribute_index]
+                    node_gdf.at[origin_idx, 'decayed_mean_hazzad' + suffix] = origin_decayed_mean_hazzard[attribute_index]
+                    node_gdf.at[origin_idx, 'expected_hazzard_meters' + suffix] = expected_hazzard_meters[attribute_index]
+                    node_gdf.at[origin_idx, 'probable_travel_distance_weighted_hazzard' + suffix] = probable_travel_distance_weighted_hazzard[attribute_index]
             
             node_gdf.at[origin_idx, 'closest_destination_distance'] = eligible_destinations_shortest_distance.min()
             node_gdf.at[origin_idx, 'furthest_destination_distance'] = eligible_destinations_shortest_distance.max()
             node_gdf.at[origin_idx, 'mean_path_length'] = origin_mean_path_length
             node_gdf.at[origin_idx, 'probable_travel_distance'] = probable_travel_distance
-            node_gdf.at[origin_idx, 'eligible_destinations'] = len(eligible_destinations)
-            node_gdf.at[origin_idx, 'path_count'] = sum(chunck_path_count)
-            node_gdf.at[origin_idx, 'path_segment_count'] = sum(chunck_segment_count)
-            node_gdf.at[origin_idx, 'path_segment_memory'] = sum(chunck_path_segment_memory)
-            node_gdf.at[origin_idx, 'scope_node_count'] = sum(chunk_scope_node_count)
-            node_gdf.at[origin_idx, 'destination_discovery_time'] = destination_discovery_time
-            node_gdf.at[origin_idx, 'destination_prep_time'] = destination_prep_time
-            node_gdf.at[origin_idx, 'path_generation_time'] = sum(chunck_time)
-            node_gdf.at[origin_idx, 'chunck_count'] = len(chunck_time)
-            node_gdf.at[origin_idx, 'chunck_time'] = chunck_time
-            node_gdf.at[origin_idx, 'chunck_path_count'] = chunck_path_count
-            node_gdf.at[origin_idx, 'chunck_path_segment_count'] = chunck_segment_count
-            node_gdf.at[origin_idx, 'chunck_path_segment_memory'] = chunck_path_segment_memory
-            node_gdf.at[origin_idx, 'chunk_scope_node_count'] = sum(chunk_scope_node_count)
-            node_gdf.at[origin_idx, 'memory_stalls'] = memory_stalls
 
 
             
         except:
             print (f"CORE: {core_index}: [betweenness_exposure]: error collecting origin statistics {origin_idx = } , {len(processed_origins) = }, proceeding to next task")
-            import traceback
             traceback.print_exc()
             continue
 
         try:
-            del path_edges, weights
-            del path_detour_penalties, d_path_weights, path_probabilities, path_decays, destination_path_probabilies, betweennes_contributions
-            self.network.remove_node_to_graph(o_graph, origin_idx)
             origin_queue.task_done()
         except:
             print (f"CORE: {core_index}: [betweenness_exposure]: error marking task done {origin_idx = } , {len(processed_origins) = }, proceeding to next task")
-            import traceback
             traceback.print_exc()
             continue
 
 
-    return_dict = {"batch_betweenness_tracker": batch_betweenness_tracker, 'origins': node_gdf.loc[processed_origins]}
+    return_dict = {"origin_ids": processed_origins, "edge_betweenness": sparse_delta(batch_betweenness_tracker), "origins": origin_statistics(node_gdf, processed_origins, statistic_columns), "instrumentation": origin_records}
     if return_path_record:
-        return_dict["path_record"] = path_record
+        return_dict["path_record_files"] = path_writer.commit()
+    if collect_contributions:
+        return_dict["contributions"] = contribution_rows.take()
     return return_dict
 
+def wait_for_workers(execution_results, scheduler, report_interval=0.5):
+    """
+    Waits for workers to finish, reporting progress every `report_interval` seconds, and raises the first worker
+    exception. Returns as soon as all workers are done.
+    """
+    start = time.time()
+    pending = execution_results
+    while pending:
+        done, pending = concurrent.futures.wait(pending, timeout=report_interval, return_when=concurrent.futures.FIRST_EXCEPTION)
+        print (f"Time spent: {round(time.time()-start):,}s [Done {scheduler.done_count:,} of {scheduler.origin_count:,} origins ({scheduler.done_count/max(scheduler.origin_count, 1) * 100:4.2f}%)]",  end='\r')
+        for future in [f for f in done if f.exception() is not None]: # if a process is done and have an exception, raise it
+            raise (future.exception())
+    return
+
+def start_workers(self: Zonal, origin_ids, origin_costs, num_workers, layer_columns=None, pool: ComputePool = None):
+    """
+    Returns the origin scheduler, shared zonal and executor of a parallel UNA run, all to be used as context
+    managers. Workers of `pool` are kept warm and only get what changed in the zonal, otherwise new workers are
+    started, and stopped when the executor exits.
+    """
+    if pool is None:
+        scheduler = OriginScheduler(origin_ids, costs=origin_costs, num_workers=num_workers)
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, initializer=scheduler.initialize_worker)
+        return scheduler, SharedZonal(self, layer_columns=layer_columns), executor
+
+    scheduler = OriginScheduler(origin_ids, costs=origin_costs, num_workers=pool.num_cores, lock=pool.lock, lock_name=pool.lock_name)
+    return scheduler, pool.share(layer_columns=layer_columns), contextlib.nullcontext(pool.executor)
+
+def run_workers(self: Zonal, origin_ids, origin_costs, num_workers, submit_workers, checkpoint: Checkpoint, merge_part, layer_columns=None, pool: ComputePool = None):
+    """
+    Runs workers until every origin is in a part of `checkpoint`, skipping origins already there, then loads parts
+    one at a time and hands each to `merge_part(part)`, which adds it to the result. `submit_workers(executor,
+    scheduler, shared_zonal)` submits workers and returns their futures, and what a worker returns is saved as a
+    part. A worker that dies breaks the executor, and the other workers with it: parts workers saved are kept, and
+    the origins they didn't save are handed to new workers. A `pool` is restarted when one of its workers died,
+    during the run or while the pool was idle.
+    """
+    origin_ids = np.asarray(origin_ids)
+    origin_costs = np.asarray(origin_costs)
+    completed_origins = checkpoint.completed_origins()
+    while True:
+        remaining = ~np.isin(origin_ids, list(completed_origins))
+        if not remaining.any():
+            break
+
+        worker_died = False
+        execution_results = []
+        scheduler, shared_zonal, executor = start_workers(self, origin_ids[remaining], origin_costs[remaining], num_workers, layer_columns=layer_columns, pool=pool)
+        with scheduler, shared_zonal, executor as executor:
+            try:
+                execution_results = submit_workers(executor, scheduler, shared_zonal)
+                wait_for_workers(execution_results, scheduler)
+            except concurrent.futures.process.BrokenProcessPool:
+                worker_died = True
+                concurrent.futures.wait(execution_results)
+            for future in execution_results:
+                if future.exception() is None:
+                    checkpoint.save(future.result())
+        if worker_died and (pool is not None):
+            pool.restart()
+            if len(execution_results) == 0:
+                # a worker of the pool died while it was idle, before this call: nothing was handed out yet.
+                continue
+
+        previous_count = len(completed_origins)
+        completed_origins = checkpoint.completed_origins()
+        if len(completed_origins) == previous_count:
+            raise RuntimeError(f"Workers stopped before finishing any of the {remaining.sum():,} remaining origins.")
+        if worker_died:
+            print (f"\nA worker died, handing {(~np.isin(origin_ids, list(completed_origins))).sum():,} unfinished origins to new workers")
+    for part in checkpoint.parts():
+        merge_part(part)
+    return
+
 def paralell_betweenness_exposure(
     self: Zonal,
     search_radius=1000,
@@ -914,103 +1314,147 @@ def paralell_betweenness_exposure(
     turn_penalty=False,
     path_exposure_attribute=None,
     return_path_record=False, 
-    destniation_cap=None
+    destniation_cap=None,
+    stream_paths=False,
+    chunking_method="concentric",
+    worker_memory_budget=512,
+    checkpoint_directory=None,
+    checkpoint_interval=60,
+    instrumentation: Instrumentation = None,
+    path_record_directory=None,
+    return_contribution_matrix=False,
+    origin_ids=None,
+    pool=None
     ):
     node_gdf = self.network.nodes
     edge_gdf = self.network.edges
 
     origins = node_gdf[node_gdf["type"] == "origin"]
+    if origin_ids is not None:
+        origins = origins.loc[origin_ids]
 
 
-    list_of_path_dfs = []
     edge_gdf['betweenness'] = 0.0
-    batch_results = []
-    origin_returns = []
-    num_procs = num_cores  # psutil.cpu_count(logical=logical)
+    num_procs = num_cores if pool is None else pool.num_cores
 
-    #TODO: investigate if this randomazation is causing any issues downsream.
-    #print (f"before 'sample' {origins.index = }")
-    origins = origins.sample(frac=1)
     origins.index = origins.index.astype("int")
-    #print (f"after 'sample' {origins.index = }")
-
-
 
+    # origins are handed to workers in batches, balanced by their estimated cost, instead of one at a time.
+    origin_costs = estimate_origin_costs(self.network, origins.index, search_radius, detour_ratio=detour_ratio)
 
+    # workers only read the network, and the exposure attribute of streets when needed.
+    layer_columns = {} if path_exposure_attribute is None else {self.network.edge_source_layer: [path_exposure_attribute] if isinstance(path_exposure_attribute, str) else list(path_exposure_attribute)}
 
+    def submit_workers(executor, scheduler, shared_zonal):
+        return [
+            executor.submit(
+                betweenness_exposure,
+                self=shared_zonal,
+                core_index=core_index,
+                origin_queue=scheduler,
+                search_radius=search_radius,
+                detour_ratio=detour_ratio,
+                decay=decay,
+                beta=beta,
+                decay_method=decay_method,
+                path_detour_penalty=path_detour_penalty,
+                elastic_weight=elastic_weight,
+                closest_destination=closest_destination,
+                turn_penalty=turn_penalty,
+                path_exposure_attribute=path_exposure_attribute,
+                return_path_record=return_path_record, 
+                destniation_cap=destniation_cap,
+                stream_paths=stream_paths,
+                chunking_method=chunking_method,
+                worker_memory_budget=worker_memory_budget,
+                checkpoint=checkpoint,
+                instrument=instrumentation is not None,
+                path_record_directory=record_directory,
+                path_record_run_id=checkpoint.run_id,
+                collect_contributions=return_contribution_matrix,
+            ) for core_index in range(scheduler.num_workers)
+        ]
+
+    # parameters that change results, a checkpoint can only be resumed with the same ones.
+    checkpoint_parameters = {
+        "function": "betweenness",
+        "search_radius": search_radius,
+        "detour_ratio": detour_ratio,
+        "decay": decay,
+        "decay_method": decay_method,
+        "beta": beta,
+        "path_detour_penalty": path_detour_penalty,
+        "closest_destination": closest_destination,
+        "elastic_weight": elastic_weight,
+        "knn_weight": getattr(self.network, "knn_weight", None),
+        "knn_plateau": getattr(self.network, "knn_plateau", None),
+        "turn_penalty": turn_penalty,
+        "path_exposure_attribute": path_exposure_attribute,
+        "destniation_cap": destniation_cap,
+        "return_path_record": return_path_record,
+        "return_contribution_matrix": return_contribution_matrix,
+        "origin_count": origins.shape[0],
+        "edge_count": edge_gdf.shape[0],
+    }
+    if origin_ids is not None:
+        checkpoint_parameters["origin_ids"] = [int(origin_id) for origin_id in origins.index]
+    # parts are added up as they load, see `run_workers()`.
+    edge_betweenness = np.zeros(edge_gdf.shape[0], dtype=np.float64)
+    statistics_parts = []
+    origin_records = []
+    path_record_files = []
+    contribution_rows = []
+
+    def merge_part(part):
+        add_sparse_delta(edge_betweenness, part["edge_betweenness"])
+        statistics_parts.append(part["origins"])
+        origin_records.extend(part.get("instrumentation", []))
+        path_record_files.extend(part.get("path_record_files", []))
+        if "contributions" in part:
+            contribution_rows.append(part["contributions"])
+        return
+
+    with Checkpoint(checkpoint_directory, parameters=checkpoint_parameters, interval=checkpoint_interval) as checkpoint, contextlib.ExitStack() as record_stack:
+        # without a directory, path records are kept with the checkpoint to resume, or in a temporary directory, and
+        # loaded once workers are done.
+        record_directory = path_record_directory
+        if return_path_record and (path_record_directory is None):
+            record_directory = os.path.join(checkpoint.directory, "path_records") if checkpoint.directory is not None else record_stack.enter_context(tempfile.TemporaryDirectory(prefix="madina_path_records_"))
+        if return_path_record:
+            # failing here instead of in every worker when pyarrow is missing.
+            _import_pyarrow()
+            os.makedirs(record_directory, exist_ok=True)
+            PathRecordWriter.check_directory(record_directory, checkpoint.run_id)
+        run_workers(
+            self,
+            origins.index,
+            origin_costs,
+            num_procs,
+            submit_workers,
+            checkpoint,
+            merge_part,
+            layer_columns=layer_columns,
+            pool=pool
+        )
+        if return_path_record:
+            PathRecordWriter.keep_files(record_directory, checkpoint.run_id, path_record_files)
+            path_record = read_path_records(record_directory, self) if path_record_directory is None else None
 
-
-    with concurrent.futures.ProcessPoolExecutor(max_workers=num_procs) as executor:
-        with mp.Manager() as manager:
-            #create aNDfill queue
-            origin_queue = manager.Queue()
-            origin_list = list(origins.index)
-            #random.shuffle(origin_list)     #randomize origins in queue so queue won't face bursts of easy origins and bursts of hard ones based on 
-            #print (f"after 'shuffle' {origin_list = }")
-
-            for o_idx in origin_list:
-                origin_queue.put(o_idx)
-            for core_index in range(num_cores):
-                origin_queue.put("done")
-
-            execution_results = []
-            for core_index in range(num_cores):
-                execution_results.append(executor.submit(
-                    betweenness_exposure,
-                    self=self,
-                    core_index=core_index,
-                    origin_queue=origin_queue,
-                    search_radius=search_radius,
-                    detour_ratio=detour_ratio,
-                    decay=decay,
-                    beta=beta,
-                    decay_method=decay_method,
-                    path_detour_penalty=path_detour_penalty,
-                    elastic_weight=elastic_weight,
-                    closest_destination=closest_destination,
-                    turn_penalty=turn_penalty,
-                    path_exposure_attribute=path_exposure_attribute,
-                    return_path_record=return_path_record, 
-                    destniation_cap=destniation_cap
-                ))
-
-            start = time.time()
-            while not all([future.done() for future in execution_results]):
-                time.sleep(0.5)
-                print (f"Time spent: {round(time.time()-start):,}s [Done {max(origins.shape[0] - origin_queue.qsize(), 0):,} of {origins.shape[0]:,} origins ({max(origins.shape[0] - origin_queue.qsize(), 0)/origins.shape[0] * 100:4.2f}%)]",  end='\r')
-                for future in [f for f in execution_results if f.done() and (f.exception() is not None)]: # if a process is done and have an exception, raise it
-                    raise (future.exception())
-           
-   
-
-            for result in concurrent.futures.as_completed(execution_results):
-                try:
-                    one_betweennes_output = result.result()
-                    batch_results.append(one_betweennes_output["batch_betweenness_tracker"])
-                    origin_returns.append(pd.DataFrame(one_betweennes_output["origins"]))
-
-                    if return_path_record:
-                        list_of_path_dfs.append(pd.DataFrame(one_betweennes_output["path_record"]))
-                except Exception as ex:
-                    print(str(ex))
-                    print(ex.__doc__)
-                    pass
-    end = time.time()
-    #print("-------------------------------------------")
-    #print(f"All cores done in {round(end - start, 2)}")
-    #print("-------------------------------------------")
-
-    for idx in edge_gdf.index:
-        edge_gdf.at[idx, "betweenness"] = sum([batch[idx] for batch in batch_results])
+    edge_gdf["betweenness"] = edge_betweenness
 
 
     # not sure if this assignment is necessary,
     self.network.nodes = node_gdf
     self.network.edges = edge_gdf
-    return_dict = {"edge_gdf": edge_gdf, "origin_gdf": pd.concat(origin_returns)}
-    if return_path_record:
-        path_record = gpd.GeoDataFrame(pd.concat(list_of_path_dfs), crs=edge_gdf.crs)
-        return_dict["path_record"] =  path_record
+    return_dict = {"edge_gdf": edge_gdf, "origin_gdf": origin_statistics_frame(node_gdf, statistics_parts)}
+    if instrumentation is not None:
+        instrumentation.add(origin_records)
+        return_dict["origin_instrumentation"] = Instrumentation.table(origin_records)
+    if return_path_record and (path_record_directory is None):
+        return_dict["path_record"] = path_record
+    if return_contribution_matrix:
+        matrix_parameters = {name: value for name, value in checkpoint_parameters.items() if name in CONTRIBUTION_MATRIX_PARAMETERS}
+        return_dict["contribution_matrix"] = ContributionMatrix.from_rows(contribution_rows, origins, edge_gdf, parameters=matrix_parameters)
     return return_dict
 
 def get_origin_properties(
@@ -1087,6 +1531,24 @@ def get_origin_properties(
 
 
 
+def access_part(node_gdf, origin_ids, origin_records, closest_facility):
+    """
+    Returns what an accessibility worker saves in a part, or returns: the statistics of `origin_ids`, see
+    `origin_statistics()`, their instrumentation records, and with `closest_facility`, the closest facility found so
+    far of every destination that has one, and its distance.
+    """
+    part = {"origin_ids": origin_ids, "origins": origin_statistics(node_gdf, origin_ids, ["reach", "gravity", "knn_weight", "knn_access"]), "instrumentation": origin_records}
+    if closest_facility:
+        facilities = node_gdf["closest_facility"].values
+        found = (node_gdf["type"].values == "destination") & ~pd.isna(facilities)
+        part["destinations"] = {
+            "destination_ids": node_gdf.index.values[found],
+            "closest_facility": facilities[found].astype(np.float64),
+            "closest_facility_distance": node_gdf["closest_facility_distance"].values[found].astype(np.float64),
+        }
+    return part
+
+
 def one_access(
     self: Zonal,
     origin_queue = None,
@@ -1099,6 +1561,8 @@ def one_access(
     closest_facility: bool = False,
     turn_penalty: bool = False, 
     reporting: bool = False, 
+    checkpoint: Checkpoint = None,
+    instrument: bool = False,
     ):
 
     node_gdf = self.network.nodes
@@ -1112,28 +1576,43 @@ def one_access(
     start = time.time()
     i = 1
     processed_origins = []
+    # counters and timers of each origin, see `Instrumentation`. only kept when `instrument` is set.
+    origin_records = []
     try: 
         while True:
+            # saving finished origins, and closest facilities found so far, so they are not lost if this worker dies.
+            if (checkpoint is not None) and (len(processed_origins) > 0) and checkpoint.due():
+                checkpoint.save(access_part(node_gdf, processed_origins, origin_records, closest_facility))
+                processed_origins = []
+                origin_records = []
+
             origin_idx = origin_queue.get()
 
             if origin_idx == "done":
                 origin_queue.task_done()
                 break
             processed_origins.append(origin_idx)
+            if instrument:
+                origin_start = time.time()
 
 
 
-            self.network.add_node_to_graph(o_graph, origin_idx)
-            d_idxs, _, _ = turn_o_scope(
+            d_idxs, o_scope, _ = turn_o_scope(
                 network=self.network,
                 o_idx=origin_idx,
                 search_radius=search_radius,
                 detour_ratio=1,
                 turn_penalty=turn_penalty,
-                o_graph=o_graph,
+                o_graph=self.network.virtual_node_graph(o_graph, origin_idx),
                 return_paths=False
             )
-            self.network.remove_node_to_graph(o_graph, origin_idx)
+
+            if instrument:
+                record = Instrumentation.origin_record(origin_idx)
+                record["destination_discovery_time"] = time.time() - origin_start
+                record["scope_nodes"] = len(o_scope)
+                record["reachable_destinations"] = len(d_idxs)
+                origin_records.append(record)
 
             if len(d_idxs) == 0:
                 continue
@@ -1171,10 +1650,9 @@ def one_access(
 
     except Exception as ex:
         print ('Issues in one access...')
-        import traceback
         traceback.print_exc()
 
-    return node_gdf.loc[processed_origins], node_gdf[node_gdf['type'] == 'destination']
+    return access_part(node_gdf, processed_origins, origin_records, closest_facility)
 
 
 
@@ -1190,10 +1668,13 @@ def parallel_access(
     closest_facility: bool = False,
     turn_penalty: bool = False, 
     num_cores: int = None,
+    checkpoint_directory: str = None,
+    checkpoint_interval: float = 60,
+    instrumentation: Instrumentation = None,
+    pool: ComputePool = None,
 ):
     node_gdf = self.network.nodes
     origin_gdf = node_gdf[node_gdf["type"] == "origin"]
-    origin_gdf = origin_gdf.sample(frac=1)
     origin_gdf.index = origin_gdf.index.astype("int")
 
     destination_gdf = node_gdf[node_gdf["type"] == "destination"]
@@ -1201,20 +1682,15 @@ def parallel_access(
 
 
     
-    with mp.Manager() as manager:
-
-        origin_queue = manager.Queue()
-
-        for o_idx in origin_gdf.index:
-            origin_queue.put(o_idx)
-
-        for core_index in range(num_cores):
-            origin_queue.put("done")
-
-        if num_cores == 1:
-            origin_gdf, destination_gdf = one_access(
-                self=self,
-                origin_queue=origin_queue,
+    # origins are handed to workers in batches, balanced by their estimated cost, instead of one at a time.
+    origin_costs = estimate_origin_costs(self.network, origin_gdf.index, search_radius)
+
+    def submit_workers(executor, scheduler, shared_zonal):
+        return [
+            executor.submit(
+                one_access,
+                self=shared_zonal,
+                origin_queue=scheduler,
                 search_radius=search_radius,
                 destination_weight=destination_weight,
                 alpha=alpha,
@@ -1223,13 +1699,49 @@ def parallel_access(
                 knn_plateau=knn_plateau,
                 closest_facility=closest_facility,
                 turn_penalty=turn_penalty,
-                reporting=True
-            )
-        else:
-            with concurrent.futures.ProcessPoolExecutor(max_workers=num_cores) as executor:        
-                execution_results = [
-                    executor.submit(
-                        one_access,
+                reporting=False,
+                checkpoint=checkpoint,
+                instrument=instrumentation is not None,
+            ) for core_index in range(scheduler.num_workers)
+        ]
+
+    # parameters that change results, a checkpoint can only be resumed with the same ones.
+    checkpoint_parameters = {
+        "function": "accessibility",
+        "search_radius": search_radius,
+        "destination_weight": destination_weight,
+        "alpha": alpha,
+        "beta": beta,
+        "knn_weights": knn_weights,
+        "knn_plateau": knn_plateau,
+        "closest_facility": closest_facility,
+        "turn_penalty": turn_penalty,
+        "origin_count": origin_gdf.shape[0],
+    }
+    if closest_facility:
+        # closest facilities of a previous call are in layer ids, origins of this call start with none.
+        node_gdf["closest_facility"] = np.nan
+        node_gdf["closest_facility_distance"] = np.nan
+
+    # parts are added up as they load, closest facilities of destinations are kept in the order parts load, and
+    # merged once all are in.
+    statistics_parts = []
+    origin_records = []
+    destination_parts = []
+
+    def merge_part(part):
+        statistics_parts.append(part["origins"])
+        origin_records.extend(part.get("instrumentation", []))
+        if "destinations" in part:
+            destination_parts.append(part["destinations"])
+        return
+
+    with Checkpoint(checkpoint_directory, parameters=checkpoint_parameters, interval=checkpoint_interval) as checkpoint:
+        if (num_cores == 1) and (pool is None):
+            remaining = ~origin_gdf.index.isin(list(checkpoint.completed_origins()))
+            if remaining.any():
+                with OriginScheduler(origin_gdf.index[remaining], costs=origin_costs[remaining]) as origin_queue:
+                    checkpoint.save(one_access(
                         self=self,
                         origin_queue=origin_queue,
                         search_radius=search_radius,
@@ -1240,56 +1752,39 @@ def parallel_access(
                         knn_plateau=knn_plateau,
                         closest_facility=closest_facility,
                         turn_penalty=turn_penalty,
-                        reporting=False
-                    ) for core_index in range(num_cores)
-                ]
-
-                # Progress update and raising exceptions..
-                start = time.time()
-                while not all([future.done() for future in execution_results]):
-                    time.sleep(0.5)
-                    done_so_far = origin_gdf.shape[0] - max(origin_queue.qsize() - num_cores, 0)
-                    print (f"Time spent: {round(time.time()-start):,}s [Done {done_so_far:,} of {origin_gdf.shape[0]:,} origins ({done_so_far/origin_gdf.shape[0] * 100:4.2f}%)]",  end='\r')
-                    for future in [f for f in execution_results if f.done() and (f.exception() is not None)]: # if a process is done and have an exception, raise it
-                        raise (future.exception())
-                
-                
-
-                ## COnsolidating output from cores
-                core_origin_gdfs = []
-                core_destination_gdfs = []
-
-                for result in concurrent.futures.as_completed(execution_results):
-                   o_gdf, d_gdf =  result.result()
-                   core_origin_gdfs.append(o_gdf)
-                   core_destination_gdfs.append(d_gdf)
-
-                origin_gdf = pd.concat(core_origin_gdfs)
-
-                node_gdf['reach'] = origin_gdf['reach']
-                node_gdf['gravity'] = origin_gdf['gravity']
-                if knn_weights is not None:
-                    node_gdf["knn_weight"] = origin_gdf["knn_weight"]
-                    node_gdf["knn_access"] = origin_gdf["knn_access"]
-
-                if closest_facility:
-                    # extracting closest facility over multiple destination_gdf coming from different cores, think about a panda solution instead of nested loops.
-                    node_gdf["closest_facility"] = np.nan
-                    node_gdf["closest_facility_distance"] = np.nan
-                    for core_destination_gdf in core_destination_gdfs:
-                        for d_idx in core_destination_gdf.index:
-                            if np.isnan(node_gdf.loc[d_idx]["closest_facility"]):
-                                node_gdf.at[d_idx, "closest_facility"] = core_destination_gdf.at[d_idx, "closest_facility"]
-                                node_gdf.at[d_idx, "closest_facility_distance"] = core_destination_gdf.at[d_idx, "closest_facility_distance"]
-                            elif core_destination_gdf.at[d_idx, "closest_facility_distance"] < node_gdf.at[d_idx, "closest_facility_distance"]:
-                                node_gdf.at[d_idx, "closest_facility"] = core_destination_gdf.at[d_idx, "closest_facility"]
-                                node_gdf.at[d_idx, "closest_facility_distance"] = core_destination_gdf.at[d_idx, "closest_facility_distance"]
-
+                        reporting=True,
+                        checkpoint=checkpoint,
+                        instrument=instrumentation is not None,
+                    ))
+            for part in checkpoint.parts():
+                merge_part(part)
+        else:
+            # workers only read the network, and destination weights when they come from the destination layer.
+            layer_columns = {} if destination_weight is None else {destination_layer: [destination_weight]}
+            run_workers(self, origin_gdf.index, origin_costs, num_cores, submit_workers, checkpoint, merge_part, layer_columns=layer_columns, pool=pool)
+
+    ## COnsolidating output from cores and checkpoint parts
+    origin_gdf = origin_statistics_frame(node_gdf, statistics_parts)
+    if instrumentation is not None:
+        instrumentation.add(origin_records)
+    for column_name in ["reach", "gravity", "knn_weight", "knn_access"]:
+        if column_name in origin_gdf.columns:
+            node_gdf[column_name] = origin_gdf[column_name]
 
-                            
+    if closest_facility:
+        # the closest facility of a destination over all parts: the first found among the closest ones, in the
+        # order parts loaded.
+        node_gdf["closest_facility"] = np.nan
+        node_gdf["closest_facility_distance"] = np.nan
+        if len(destination_parts) > 0:
+            destination_ids = np.concatenate([part["destination_ids"] for part in destination_parts])
+            facilities = np.concatenate([part["closest_facility"] for part in destination_parts])
+            distances = np.concatenate([part["closest_facility_distance"] for part in destination_parts])
+            order = np.lexsort((np.arange(destination_ids.shape[0]), distances, destination_ids))
+            closest = order[np.concatenate([[True], destination_ids[order][1:] != destination_ids[order][:-1]])]
+            node_gdf.loc[destination_ids[closest], "closest_facility"] = facilities[closest]
+            node_gdf.loc[destination_ids[closest], "closest_facility_distance"] = distances[closest]
 
-                    
-                    
     if closest_facility:
         ## adjust origin reach ad gravity based on joint destinations
         for o_idx in origin_gdf.index:
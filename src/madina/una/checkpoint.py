@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import uuid
+import pickle
+
+import numpy as np
+
+
+class Checkpoint:
+    """
+    Saves what workers finished to `directory` every `interval` seconds, so a run that is interrupted (a crash, an
+    OOM kill, a preempted node) resumes where it stopped. Each save is a part: the origins a worker finished since
+    its previous save, their statistics, and what they add to the result as sparse deltas (e.g. the edges they add
+    betweenness to, and how much, see `sparse_delta()`), so parts are added up to get the result of a run. A worker
+    that dies only loses what it did since its last save.
+
+    A part is pickled to `part_<id>.pkl`, and the ids of its origins to `part_<id>.npy`, so finished origins are
+    known without loading parts. The parameters of the run are kept in `checkpoint.json`, resuming with other
+    parameters raises a ValueError. `run_id` identifies the run, files written for it elsewhere (e.g. path records)
+    carry it, it is kept in `run_id` so a resumed run has the same.
+
+    When `directory` is None, nothing is written: workers don't save parts, and what they return is kept in memory,
+    so the origins of a worker that dies are all handed to new workers.
+
+    :Example:
+        >>> with Checkpoint("betweenness_checkpoint", parameters={"search_radius": 800}) as checkpoint:
+        >>>     finished = checkpoint.completed_origins()
+        >>>     ...
+        >>>     if checkpoint.due():
+        >>>         checkpoint.save({"origin_ids": processed_origins, "edge_betweenness": sparse_delta(batch_betweenness_tracker)})
+    """
+
+    def __init__(self, directory: str = None, parameters: dict = None, interval: float = 60):
+        self.directory = directory
+        self.interval = interval
+        # parts saved when there is no directory, workers can't save those.
+        self.memory_parts = []
+        self.last_save = time.time()
+        self.run_id = uuid.uuid4().hex
+        if directory is None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        # json round trip, so tuples and numpy scalars compare equal to what was loaded.
+        parameters = json.loads(json.dumps({} if parameters is None else parameters, default=str))
+        manifest_path = os.path.join(self.directory, "checkpoint.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                saved_parameters = json.load(manifest_file)
+            if saved_parameters != parameters:
+                raise ValueError(f"Checkpoint directory '{self.directory}' was created with other parameters: {saved_parameters}, cannot resume with {parameters}. Use another directory.")
+        else:
+            with open(manifest_path, "w") as manifest_file:
+                json.dump(parameters, manifest_file, indent=4)
+
+        run_id_path = os.path.join(self.directory, "run_id")
+        if os.path.exists(run_id_path):
+            with open(run_id_path) as run_id_file:
+                self.run_id = run_id_file.read().strip()
+        else:
+            with open(run_id_path, "w") as run_id_file:
+                run_id_file.write(self.run_id)
+        return
+
+    def __getstate__(self):
+        # workers only save parts to the directory, parts kept in memory stay with the process that saved them.
+        state = self.__dict__.copy()
+        state["memory_parts"] = []
+        return state
+
+    def due(self):
+        """
+        True when `interval` seconds passed since the last save, always False without a directory.
+        """
+        return (self.directory is not None) and ((time.time() - self.last_save) >= self.interval)
+
+    def save(self, part: dict):
+        """
+        Saves a part, a dict with the finished "origin_ids" and whatever they add to the result. Files are written
+        under a temporary name first, then renamed, the origin ids before the part, so a process killed while saving
+        never leaves half a part: origin ids without a part are ignored.
+        """
+        if self.directory is None:
+            self.memory_parts.append(part)
+            return
+        part_name = f"part_{uuid.uuid4().hex}"
+        temporary_path = os.path.join(self.directory, part_name + ".tmp")
+        with open(temporary_path, "wb") as index_file:
+            np.save(index_file, np.asarray(part["origin_ids"], dtype=np.int64))
+        os.replace(temporary_path, os.path.join(self.directory, part_name + ".npy"))
+        with open(temporary_path, "wb") as part_file:
+            pickle.dump(part, part_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, os.path.join(self.directory, part_name + ".pkl"))
+        self.last_save = time.time()
+        return
+
+    def _part_names(self):
+        if self.directory is None:
+            return []
+        file_names = set(os.listdir(self.directory))
+        return sorted(file_name[:-len(".pkl")] for file_name in file_names if file_name.startswith("part_") and file_name.endswith(".pkl"))
+
+    def parts(self):
+        """
+        Yields every saved part, loading one at a time, so parts can be added up as they load.
+        """
+        yield from self.memory_parts
+        for part_name in self._part_names():
+            with open(os.path.join(self.directory, part_name + ".pkl"), "rb") as part_file:
+                yield pickle.load(part_file)
+
+    def completed_origins(self):
+        """
+        Returns the set of origin ids in saved parts, from their origin ids only.
+        """
+        completed_origins = set(origin_idx for part in self.memory_parts for origin_idx in part["origin_ids"])
+        for part_name in self._part_names():
+            completed_origins.update(np.load(os.path.join(self.directory, part_name + ".npy")).tolist())
+        return completed_origins
+
+    def close(self):
+        """
+        Drops parts kept in memory, saved parts are kept in the directory.
+        """
+        self.memory_parts = []
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def sparse_delta(values: np.ndarray) -> dict:
+    """
+    Returns the nonzero rows of `values`, an array with a value, or a row of values, for every edge, as a dict of
+    their "positions" and "values", to save in a part or return from a worker instead of the whole array.
+    """
+    nonzero = (values != 0) if values.ndim == 1 else (values != 0).any(axis=1)
+    positions = np.flatnonzero(nonzero)
+    return {"positions": positions, "values": values[positions]}
+
+
+def add_sparse_delta(values: np.ndarray, delta: dict):
+    """
+    Adds a delta made by `sparse_delta()` to `values`, in place.
+    """
+    values[delta["positions"]] += delta["values"]
+    return
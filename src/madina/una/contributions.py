@@ -0,0 +1,324 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+# betweenness parameters kept with a contribution matrix, to recompute origins the same way when edges change.
+CONTRIBUTION_MATRIX_PARAMETERS = ["search_radius", "detour_ratio", "decay", "decay_method", "beta", "path_detour_penalty", "closest_destination", "elastic_weight", "knn_weight", "knn_plateau", "turn_penalty"]
+
+
+class ContributionRows:
+    """
+    Collects, in a worker, what each origin adds to edge betweenness for a unit origin weight, as sparse rows: the
+    positions of the edges an origin's trips use, and what they add to each. `take()` hands the rows collected so far
+    to a checkpoint part or a worker result. The nodes in the search scope of each origin are kept too, as the index
+    of origins an edge change can affect.
+    """
+
+    def __init__(self):
+        self.origin_ids = []
+        self.edge_counts = []
+        self.edge_positions = []
+        self.values = []
+        self.scope_origin_ids = []
+        self.scope_counts = []
+        self.scope_nodes = []
+        return
+
+    def add(self, origin_idx, edge_positions, values):
+        """
+        Adds the row of `origin_idx`, an edge can appear several times in `edge_positions`, its values are summed.
+        """
+        edge_positions = np.concatenate(edge_positions) if isinstance(edge_positions, list) else edge_positions
+        values = np.concatenate(values) if isinstance(values, list) else values
+        row_positions, inverse = np.unique(edge_positions, return_inverse=True)
+        row_values = np.bincount(inverse, weights=values, minlength=row_positions.shape[0])
+        nonzero = row_values != 0
+        self.origin_ids.append(origin_idx)
+        self.edge_counts.append(int(nonzero.sum()))
+        self.edge_positions.append(row_positions[nonzero])
+        self.values.append(row_values[nonzero])
+        return
+
+    def add_scope(self, origin_idx, scope_nodes):
+        """
+        Adds the nodes in the search scope of `origin_idx`.
+        """
+        scope_nodes = np.fromiter(scope_nodes, dtype=np.int64, count=len(scope_nodes))
+        self.scope_origin_ids.append(origin_idx)
+        self.scope_counts.append(scope_nodes.shape[0])
+        self.scope_nodes.append(scope_nodes)
+        return
+
+    def take(self):
+        """
+        Returns the rows collected so far as a dict of arrays, and starts over.
+        """
+        rows = {
+            "origin_ids": np.array(self.origin_ids, dtype=np.int64),
+            "edge_counts": np.array(self.edge_counts, dtype=np.int64),
+            "edge_positions": np.concatenate(self.edge_positions) if len(self.edge_positions) > 0 else np.zeros(0, dtype=np.int64),
+            "values": np.concatenate(self.values) if len(self.values) > 0 else np.zeros(0, dtype=np.float64),
+            "scope_origin_ids": np.array(self.scope_origin_ids, dtype=np.int64),
+            "scope_counts": np.array(self.scope_counts, dtype=np.int64),
+            "scope_nodes": np.concatenate(self.scope_nodes) if len(self.scope_nodes) > 0 else np.zeros(0, dtype=np.int64),
+        }
+        self.__init__()
+        return rows
+
+
+def _csr_rows(row_count, entry_rows, *entry_arrays):
+    """
+    Returns the row pointer of a compressed sparse row layout with `row_count` rows, and `entry_arrays` sorted by
+    `entry_rows`, the row of each entry, keeping the order of entries within a row.
+    """
+    order = np.argsort(entry_rows, kind="stable")
+    indptr = np.zeros(row_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(entry_rows, minlength=row_count), out=indptr[1:])
+    return (indptr, *[entry_array[order] for entry_array in entry_arrays])
+
+
+class ContributionMatrix:
+    """
+    What every origin adds to the betweenness of every edge for a unit origin weight, as a compressed sparse row
+    matrix: the edges of origin `origin_ids[i]` are `edge_ids[indices[indptr[i]:indptr[i+1]]]`, and it adds
+    `data[indptr[i]:indptr[i+1]]` to them for each unit of weight. As betweenness is linear in origin weights, flows
+    under other origin weights (a new population or land use scenario) are one sparse matrix-vector product, and the
+    origins that load an edge are a column of the matrix, without searching paths again.
+
+    The nodes in the search scope of origin `origin_ids[i]` are `scope_nodes[scope_indptr[i]:scope_indptr[i+1]]`,
+    an index of the origins an edge change can affect: an origin can only reach a changed edge through a node in
+    its scope, see `affected_origins()`. With the end nodes and weights of edges, and the parameters of the run, it
+    lets `betweenness_update()` recompute only those origins when edges change.
+
+    Created by `betweenness()` with `contribution_matrix_file`, and saved to and loaded from a numpy `.npz` file.
+
+    :Example:
+        >>> contribution_matrix = ContributionMatrix.load("contributions.npz")
+        >>> scenario_flows = contribution_matrix.flows(zonal["buildings"].gdf["people_2040"])
+        >>> contribution_matrix.origin_loads(edge_id).sort_values().tail(10)
+    """
+
+    ARRAYS = ["origin_ids", "origin_source_ids", "origin_weights", "edge_ids", "indptr", "indices", "data", "scope_indptr", "scope_nodes", "edge_starts", "edge_ends", "edge_weights"]
+
+    def __init__(self, origin_ids, origin_source_ids, origin_weights, edge_ids, indptr, indices, data, scope_indptr, scope_nodes, edge_starts, edge_ends, edge_weights, parameters: dict = None):
+        self.origin_ids = np.asarray(origin_ids, dtype=np.int64)
+        self.origin_source_ids = np.asarray(origin_source_ids)
+        self.origin_weights = np.asarray(origin_weights, dtype=np.float64)
+        self.edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float64)
+        self.scope_indptr = np.asarray(scope_indptr, dtype=np.int64)
+        self.scope_nodes = np.asarray(scope_nodes, dtype=np.int64)
+        self.edge_starts = np.asarray(edge_starts, dtype=np.int64)
+        self.edge_ends = np.asarray(edge_ends, dtype=np.int64)
+        self.edge_weights = np.asarray(edge_weights, dtype=np.float64)
+        self.parameters = {} if parameters is None else parameters
+        return
+
+    @classmethod
+    def from_rows(cls, rows, origin_gdf: pd.DataFrame, edge_gdf: pd.DataFrame, parameters: dict = None):
+        """
+        Builds the matrix from contribution rows taken from `ContributionRows` by workers, with a row for every
+        origin in `origin_gdf` (empty for origins that reach no destination), in its order, and a column for every
+        edge in `edge_gdf`. `parameters` are the betweenness parameters of the run.
+        """
+
+        def concatenated(name, dtype):
+            return np.concatenate([part_rows[name] for part_rows in rows]) if len(rows) > 0 else np.zeros(0, dtype=dtype)
+
+        # rows come in the order workers finished origins, they are put in the order of `origin_gdf`.
+        origin_index = pd.Index(origin_gdf.index.values)
+        entry_rows = np.repeat(origin_index.get_indexer(concatenated("origin_ids", np.int64)), concatenated("edge_counts", np.int64))
+        indptr, indices, data = _csr_rows(origin_index.shape[0], entry_rows, concatenated("edge_positions", np.int64), concatenated("values", np.float64))
+        scope_rows = np.repeat(origin_index.get_indexer(concatenated("scope_origin_ids", np.int64)), concatenated("scope_counts", np.int64))
+        scope_indptr, scope_nodes = _csr_rows(origin_index.shape[0], scope_rows, concatenated("scope_nodes", np.int64))
+        return cls(
+            origin_gdf.index.values,
+            origin_gdf["source_id"].values,
+            origin_gdf["weight"].values,
+            edge_gdf.index.values,
+            indptr,
+            indices,
+            data,
+            scope_indptr,
+            scope_nodes,
+            edge_gdf["start"].values,
+            edge_gdf["end"].values,
+            edge_gdf["weight"].values,
+            parameters=parameters,
+        )
+
+    @property
+    def shape(self):
+        return (self.origin_ids.shape[0], self.edge_ids.shape[0])
+
+    def _row_weights(self, origin_weights):
+        if origin_weights is None:
+            return self.origin_weights
+        if isinstance(origin_weights, pd.Series):
+            return origin_weights.reindex(self.origin_source_ids).fillna(0).to_numpy(dtype=np.float64)
+        origin_weights = np.asarray(origin_weights, dtype=np.float64)
+        if origin_weights.shape[0] != self.origin_ids.shape[0]:
+            raise ValueError(f"Parameter 'origin_weights' must have a weight for each of the {self.origin_ids.shape[0]:,} origins, {origin_weights.shape[0]:,} were given.")
+        return origin_weights
+
+    def flows(self, origin_weights=None):
+        """
+        Returns edge betweenness, aligned with `edge_ids`, for `origin_weights`: a Series indexed like the origin
+        layer (missing origins weigh 0), an array aligned with `origin_ids`, or the weights of the run when None.
+        """
+        row_weights = self._row_weights(origin_weights)
+        return np.bincount(self.indices, weights=self.data * np.repeat(row_weights, np.diff(self.indptr)), minlength=self.edge_ids.shape[0])
+
+    def origin_loads(self, edge_id, origin_weights=None):
+        """
+        Returns what each origin adds to the betweenness of `edge_id` for `origin_weights` (see `flows()`), as a
+        Series indexed by origin source id, only for origins whose trips use the edge.
+        """
+        edge_position = np.flatnonzero(self.edge_ids == edge_id)
+        if edge_position.shape[0] == 0:
+            raise ValueError(f"Edge {edge_id} is not in the network the contribution matrix was made with.")
+        entries = np.flatnonzero(self.indices == edge_position[0])
+        rows = np.searchsorted(self.indptr, entries, side="right") - 1
+        return pd.Series(self.data[entries] * self._row_weights(origin_weights)[rows], index=self.origin_source_ids[rows], name=edge_id)
+
+    def origin_contributions(self, origin_source_id):
+        """
+        Returns what an origin, by its source id, adds to each edge it uses for a unit weight, as a Series indexed
+        by edge id.
+        """
+        row = np.flatnonzero(self.origin_source_ids == origin_source_id)
+        if row.shape[0] == 0:
+            raise ValueError(f"Origin {origin_source_id} is not in the contribution matrix.")
+        entries = slice(self.indptr[row[0]], self.indptr[row[0] + 1])
+        return pd.Series(self.data[entries], index=self.edge_ids[self.indices[entries]], name=origin_source_id)
+
+    def affected_origins(self, edge_ids, edge_gdf: pd.DataFrame, node_gdf: pd.DataFrame):
+        """
+        Returns the ids of origins whose results can change when edges `edge_ids` change: their weight, their
+        removal from the network, or their addition to it. `edge_gdf` and `node_gdf` are the network after the change.
+
+        An edge that got longer, was closed or was removed only changes the trips that used it, so it affects the
+        origins with a contribution on it. When origin weights depend on distances (`elastic_weight`), or some
+        destinations have no weight, results can depend on trips without contributions, and such edges are matched
+        as any other change.
+
+        Any other change can give an origin new paths. A path that uses a changed edge reaches it through edges that
+        didn't change, so it reaches one of its end nodes within the same distance as before the change: that node is
+        in the origin's scope, or is a dead end left out of it, next to a node in it. Origins and destinations on a
+        changed edge are matched too.
+        """
+        edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        destination_weights = node_gdf["weight"].values[(node_gdf["type"] == "destination").values]
+        previous_edges = np.isin(self.edge_ids, edge_ids)
+        if self.parameters.get("elastic_weight") or (destination_weights == 0).any():
+            longer_edges = np.zeros(self.edge_ids.shape[0], dtype=bool)
+        else:
+            current_weights = edge_gdf["weight"].reindex(self.edge_ids).values.astype(np.float64)
+            longer_edges = previous_edges & (np.isnan(current_weights) | (current_weights >= self.edge_weights))
+
+        entry_rows = np.repeat(np.arange(self.origin_ids.shape[0]), np.diff(self.indptr))
+        using_rows = entry_rows[np.isin(self.indices, np.flatnonzero(longer_edges))]
+
+        other_edge_ids = np.setdiff1d(edge_ids, self.edge_ids[longer_edges])
+        previous_edges = np.isin(self.edge_ids, other_edge_ids)
+        current_edges = edge_gdf.index.isin(other_edge_ids)
+        touched_nodes = np.unique(np.concatenate([
+            self.edge_starts[previous_edges],
+            self.edge_ends[previous_edges],
+            edge_gdf["start"].values[current_edges].astype(np.int64),
+            edge_gdf["end"].values[current_edges].astype(np.int64),
+        ]))
+
+        # end nodes that were dead ends are matched by their only neighbor.
+        neighbor_pairs = np.unique(np.stack([
+            np.concatenate([self.edge_starts, self.edge_ends]),
+            np.concatenate([self.edge_ends, self.edge_starts]),
+        ], axis=1), axis=0)
+        dead_end_nodes, neighbor_counts = np.unique(neighbor_pairs[:, 0], return_counts=True)
+        dead_end_nodes = np.intersect1d(dead_end_nodes[neighbor_counts == 1], touched_nodes)
+        next_to_dead_ends = neighbor_pairs[np.isin(neighbor_pairs[:, 0], dead_end_nodes), 1]
+        inserted_nodes = node_gdf.index.values[(node_gdf["type"] != "street_node").values & np.isin(node_gdf["nearest_edge_id"].values, other_edge_ids)]
+        touched_nodes = np.unique(np.concatenate([touched_nodes, next_to_dead_ends, inserted_nodes.astype(np.int64)]))
+
+        entries = np.flatnonzero(np.isin(self.scope_nodes, touched_nodes))
+        scope_rows = np.searchsorted(self.scope_indptr, entries, side="right") - 1
+        return self.origin_ids[np.unique(np.concatenate([using_rows, scope_rows]))]
+
+    def update(self, contribution_matrix: "ContributionMatrix"):
+        """
+        Returns this matrix with the rows of the origins in `contribution_matrix` replaced by theirs, on the edges of
+        `contribution_matrix`, and the edge betweenness of the result, aligned with its `edge_ids`. Betweenness is
+        updated, not summed again: the previous contributions of those origins are taken off this matrix's
+        betweenness, and their new ones added, all with the origin weights of this matrix.
+        """
+        replaced_rows = pd.Index(self.origin_ids).get_indexer(contribution_matrix.origin_ids)
+        if (replaced_rows == -1).any():
+            raise ValueError("Parameter 'contribution_matrix' must only have origins of this contribution matrix.")
+        replaced = np.zeros(self.origin_ids.shape[0], dtype=bool)
+        replaced[replaced_rows] = True
+
+        # edge positions of this matrix in the updated edges, -1 for removed edges.
+        edge_positions = pd.Index(contribution_matrix.edge_ids).get_indexer(self.edge_ids)
+        kept = edge_positions != -1
+
+        betweenness = self.flows() - self.flows(np.where(replaced, self.origin_weights, 0))
+        edge_betweenness = np.zeros(contribution_matrix.edge_ids.shape[0], dtype=np.float64)
+        edge_betweenness[edge_positions[kept]] = betweenness[kept]
+        edge_betweenness += contribution_matrix.flows(self.origin_weights[replaced_rows])
+
+        entry_rows = np.repeat(np.arange(self.origin_ids.shape[0]), np.diff(self.indptr))
+        kept_entries = ~replaced[entry_rows] & kept[self.indices]
+        indptr, indices, data = _csr_rows(
+            self.origin_ids.shape[0],
+            np.concatenate([entry_rows[kept_entries], np.repeat(replaced_rows, np.diff(contribution_matrix.indptr))]),
+            np.concatenate([edge_positions[self.indices[kept_entries]], contribution_matrix.indices]),
+            np.concatenate([self.data[kept_entries], contribution_matrix.data]),
+        )
+        scope_rows = np.repeat(np.arange(self.origin_ids.shape[0]), np.diff(self.scope_indptr))
+        kept_scope = ~replaced[scope_rows]
+        scope_indptr, scope_nodes = _csr_rows(
+            self.origin_ids.shape[0],
+            np.concatenate([scope_rows[kept_scope], np.repeat(replaced_rows, np.diff(contribution_matrix.scope_indptr))]),
+            np.concatenate([self.scope_nodes[kept_scope], contribution_matrix.scope_nodes]),
+        )
+        updated_matrix = ContributionMatrix(
+            self.origin_ids,
+            self.origin_source_ids,
+            self.origin_weights,
+            contribution_matrix.edge_ids,
+            indptr,
+            indices,
+            data,
+            scope_indptr,
+            scope_nodes,
+            contribution_matrix.edge_starts,
+            contribution_matrix.edge_ends,
+            contribution_matrix.edge_weights,
+            parameters=self.parameters,
+        )
+        return updated_matrix, edge_betweenness
+
+    def to_scipy(self):
+        """
+        Returns the matrix as a `scipy.sparse.csr_matrix`, needs scipy.
+        """
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+    def save(self, file_path: str):
+        """
+        Saves the matrix to a numpy `.npz` file.
+        """
+        np.savez_compressed(file_path, parameters=json.dumps(self.parameters), **{name: getattr(self, name) for name in self.ARRAYS})
+        return
+
+    @classmethod
+    def load(cls, file_path: str):
+        """
+        Loads a matrix saved by `save()`.
+        """
+        with np.load(file_path, allow_pickle=False) as arrays:
+            return cls(**{name: arrays[name] for name in cls.ARRAYS}, parameters=json.loads(str(arrays["parameters"])))
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+
+class Instrumentation:
+    """
+    Collects per-origin counters and stage timers of UNA runs, from every worker. Pass one to `betweenness()` or
+    `accessibility()` as `instrumentation`, then look at `origin_table()` to find pathological origins, and at
+    `summary()` to compare runs with other search radius or detour settings. Without one, workers keep no records
+    and time no stages, and kernels only count events they already branch on, once per event.
+
+    Counters, per origin:
+        - scope_nodes: nodes within the search scope of the origin.
+        - heap_pushes: labels pushed on the heap of the scope search.
+        - reachable_destinations: destinations within the search radius.
+        - eligible_destinations: destinations trips are distributed to.
+        - chunks: destination chunks the origin was searched in.
+        - distance_matrix_entries: (node, destination) distances kept to guide path enumeration.
+        - paths: paths enumerated.
+        - path_segments: edges over all paths, as if every path was stored on its own.
+        - pruned_branches: path branches dropped as they could not reach any remaining destination.
+        - path_memory: bytes of the largest chunk of paths, 0 when paths are streamed.
+
+    Timers, per origin, in seconds: destination_discovery_time, destination_prep_time, path_generation_time and
+    betweenness_time.
+
+    :Example:
+        >>> instrumentation = Instrumentation()
+        >>> betweenness(shaqra, search_radius=800, detour_ratio=1.15, ..., instrumentation=instrumentation)
+        >>> instrumentation.origin_table().sort_values("path_generation_time").tail(10)
+        >>> instrumentation.summary()
+    """
+
+    counters = [
+        "scope_nodes",
+        "heap_pushes",
+        "reachable_destinations",
+        "eligible_destinations",
+        "chunks",
+        "distance_matrix_entries",
+        "paths",
+        "path_segments",
+        "pruned_branches",
+        "path_memory",
+    ]
+    timers = [
+        "destination_discovery_time",
+        "destination_prep_time",
+        "path_generation_time",
+        "betweenness_time",
+    ]
+
+    def __init__(self):
+        self.records = []
+        return
+
+    @classmethod
+    def origin_record(cls, origin_idx):
+        """
+        Returns an empty record for `origin_idx`, workers add to its counters and timers.
+        """
+        record = dict.fromkeys(cls.counters + cls.timers, 0)
+        record["origin_id"] = origin_idx
+        return record
+
+    def add(self, records):
+        """
+        Adds origin records collected by a worker.
+        """
+        self.records.extend(records)
+        return
+
+    @classmethod
+    def table(cls, records) -> pd.DataFrame:
+        """
+        Returns origin records as a DataFrame indexed by origin id.
+        """
+        return pd.DataFrame(records, columns=["origin_id"] + cls.counters + cls.timers).set_index("origin_id")
+
+    def origin_table(self) -> pd.DataFrame:
+        """
+        Returns a DataFrame with a row of counters and timers for every origin, indexed by origin id.
+        """
+        return self.table(self.records)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Returns a DataFrame with a row for every counter and timer: its total, mean, median, 95th percentile and
+        maximum over origins, and the origin where the maximum is.
+        """
+        origin_table = self.origin_table()
+        summary = pd.DataFrame(index=self.counters + self.timers, columns=["total", "mean", "median", "p95", "max", "max_origin_id"])
+        if origin_table.shape[0] == 0:
+            return summary
+        values = origin_table.to_numpy(dtype=np.float64)
+        summary["total"] = values.sum(axis=0)
+        summary["mean"] = values.mean(axis=0)
+        summary["median"] = np.median(values, axis=0)
+        summary["p95"] = np.percentile(values, 95, axis=0)
+        summary["max"] = values.max(axis=0)
+        summary["max_origin_id"] = origin_table.index.values[values.argmax(axis=0)]
+        return summary
+
+    def clear(self):
+        """
+        Drops all records, to reuse this instrumentation for another run.
+        """
+        self.records = []
+        return
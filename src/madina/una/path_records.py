@@ -0,0 +1,170 @@
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from ..zonal import Zonal
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as ex:
+        raise ImportError("Path records are written as parquet files, which needs 'pyarrow': pip install madina[path_records]") from ex
+    return pyarrow
+
+
+class PathRecordWriter:
+    """
+    Streams path records of a worker to parquet files in `directory`: a row for every path, with its origin,
+    destination, path id, weight, decay, probability, betweenness and the list of its edge ids, from the origin to the
+    destination. Rows are buffered and written as a row group every `buffer_rows` rows, so memory stays bounded
+    however many paths there are. Geometry is not written, `read_path_records()` builds it from edge ids when read.
+
+    File names carry `run_id`, the id of the run (see `Checkpoint`), so only files of the run are ever removed. A
+    file is written under a temporary name, and only gets its final name on `commit()`, which returns the names of
+    committed files, to be kept with the checkpoint part of the origins they hold: files of origins a dead worker
+    didn't save are dropped by `keep_files()`, so origins handed to new workers are not written twice.
+
+    :Example:
+        >>> writer = PathRecordWriter("path_records", checkpoint.run_id)
+        >>> writer.write({"origin_id": ..., "destination_id": ..., ...}, edge_offsets, edge_ids)
+        >>> part["path_record_files"] = writer.commit()
+    """
+
+    def __init__(self, directory: str, run_id: str, buffer_rows: int = 100_000):
+        self.pyarrow = _import_pyarrow()
+        self.directory = directory
+        self.run_id = run_id
+        self.buffer_rows = buffer_rows
+        os.makedirs(self.directory, exist_ok=True)
+        self.buffer = []
+        self.buffered_rows = 0
+        self.file_name = None
+        self.file_writer = None
+        self.committed_files = []
+        return
+
+    def write(self, columns: dict, edge_offsets, edge_ids):
+        """
+        Adds a row for every path. `columns` maps column names to arrays with a value for every path, and the edge
+        ids of path `p` are `edge_ids[edge_offsets[p]:edge_offsets[p+1]]`.
+        """
+        pa = self.pyarrow
+        arrays = {name: pa.array(values) for name, values in columns.items()}
+        arrays["edge_ids"] = pa.ListArray.from_arrays(pa.array(edge_offsets, type=pa.int32()), pa.array(edge_ids, type=pa.int64()))
+        self.buffer.append(pa.RecordBatch.from_pydict(arrays))
+        self.buffered_rows += len(edge_offsets) - 1
+        if self.buffered_rows >= self.buffer_rows:
+            self.flush()
+        return
+
+    def flush(self):
+        """
+        Writes buffered rows as a row group of the current file.
+        """
+        if self.buffered_rows == 0:
+            return
+        table = self.pyarrow.Table.from_batches(self.buffer)
+        if self.file_writer is None:
+            self.file_name = f"paths_{self.run_id}_{uuid.uuid4().hex}.parquet"
+            self.file_writer = self.pyarrow.parquet.ParquetWriter(os.path.join(self.directory, self.file_name + ".tmp"), table.schema)
+        self.file_writer.write_table(table)
+        self.buffer = []
+        self.buffered_rows = 0
+        return
+
+    def commit(self):
+        """
+        Flushes buffered rows and closes the current file under its final name. Returns the names of files
+        committed since the previous call, later rows go to a new file.
+        """
+        self.flush()
+        if self.file_writer is not None:
+            self.file_writer.close()
+            os.replace(os.path.join(self.directory, self.file_name + ".tmp"), os.path.join(self.directory, self.file_name))
+            self.committed_files.append(self.file_name)
+            self.file_writer = None
+            self.file_name = None
+        committed_files = self.committed_files
+        self.committed_files = []
+        return committed_files
+
+    @staticmethod
+    def check_directory(directory: str, run_id: str):
+        """
+        Raises a ValueError when `directory` has path records of a run other than `run_id`, as they would be read
+        with the records of this run.
+        """
+        other_files = [file_name for file_name in os.listdir(directory) if file_name.startswith("paths_") and not file_name.startswith(f"paths_{run_id}_")]
+        if len(other_files) > 0:
+            raise ValueError(f"Path record directory '{directory}' has path records of another run ({len(other_files):,} files), use an empty directory, or resume that run with its checkpoint directory.")
+        return
+
+    @staticmethod
+    def keep_files(directory: str, run_id: str, file_names):
+        """
+        Removes path record files of run `run_id` in `directory` that are not in `file_names`: files of a dead
+        worker, or of an interrupted run resumed since. Other files are never removed.
+        """
+        file_names = set(file_names)
+        for file_name in os.listdir(directory):
+            if file_name.startswith(f"paths_{run_id}_") and (file_name not in file_names):
+                os.remove(os.path.join(directory, file_name))
+        return
+
+
+def path_geometries(edge_id_lists, edge_gdf: gpd.GeoDataFrame):
+    """
+    Returns an array with a MultiLineString for every list of edge ids in `edge_id_lists`, from the geometry of
+    edges in `edge_gdf`, None for paths with no edges.
+    """
+    lengths = np.array([len(edge_ids) for edge_ids in edge_id_lists], dtype=np.int64)
+    geometries = np.full(lengths.shape[0], None, dtype=object)
+    if lengths.sum() == 0:
+        return geometries
+    flat_edge_ids = np.concatenate([np.asarray(edge_ids, dtype=np.int64) for edge_ids in edge_id_lists])
+    edge_geometries = edge_gdf["geometry"].values[edge_gdf.index.get_indexer(flat_edge_ids)]
+    return shapely.multilinestrings(np.asarray(edge_geometries, dtype=object), indices=np.repeat(np.arange(lengths.shape[0]), lengths), out=geometries)
+
+
+def read_path_records(
+    directory: str,
+    zonal: Zonal = None,
+    columns: list = None,
+    filters=None,
+):
+    """
+    Reads path records written by `betweenness()` with a `path_record_directory`. Only the rows matching `filters`
+    are read, so records of a few origins can be read from a city-wide run without reading the rest.
+
+    :param directory: The path record directory of the run.
+    :type directory: str
+    :param zonal: When given, path geometries are built from the edge ids of each path and the geometry of edges in this zonal's network, which must be the one the records were made with, and a GeoDataFrame is returned, defaults to None
+    :type zonal: Zonal, optional
+    :param columns: Columns to read, all columns when None, defaults to None
+    :type columns: list, optional
+    :param filters: Row filters, in the pyarrow format, for instance [("origin_id", "in", [12, 14])], defaults to None
+    :type filters: list, optional
+    :return: A DataFrame with a row for every path, or a GeoDataFrame when `zonal` is given.
+    :rtype: pd.DataFrame | gpd.GeoDataFrame
+    """
+    pyarrow = _import_pyarrow()
+    file_paths = [os.path.join(directory, file_name) for file_name in sorted(os.listdir(directory)) if file_name.startswith("paths_") and file_name.endswith(".parquet")]
+    if len(file_paths) == 0:
+        path_records = pd.DataFrame(columns=columns if columns is not None else [])
+    else:
+        read_columns = columns if (columns is None) or (zonal is None) or ("edge_ids" in columns) else list(columns) + ["edge_ids"]
+        path_records = pyarrow.parquet.ParquetDataset(file_paths, filters=filters).read(columns=read_columns).to_pandas()
+    if zonal is None:
+        return path_records
+
+    edge_gdf = zonal.network.edges
+    geometries = path_geometries(path_records["edge_ids"].values if "edge_ids" in path_records.columns else [], edge_gdf)
+    if (columns is not None) and ("edge_ids" not in columns):
+        path_records = path_records.drop(columns=["edge_ids"])
+    return gpd.GeoDataFrame(path_records, geometry=geometries, crs=edge_gdf.crs)
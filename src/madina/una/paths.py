@@ -1,5 +1,7 @@
 import math
-from collections import deque
+import numpy as np
+from array import array
+from collections import deque, defaultdict
 from heapq import heappush, heappop
 from ..zonal import Network
 
@@ -8,9 +10,7 @@ def path_generator(network: Network, o_idx, search_radius=800, detour_ratio=1.15
     """
     to be filled in.
 """
-    o_graph = network.d_graph
-    network.add_node_to_graph(o_graph, o_idx)
-    #network.update_light_graph(o_graph, add_nodes=[o_idx])
+    o_graph = network.virtual_node_graph(network.d_graph, o_idx)
 
     d_idxs, o_scope, o_scope_paths = turn_o_scope(
         network=network,
@@ -50,9 +50,7 @@ def path_generator(network: Network, o_idx, search_radius=800, detour_ratio=1.15
         turn_penalty=turn_penalty,
         od_scope=scope_nodes
     )
-    
-    #network.update_light_graph(o_graph, remove_nodes=[o_idx])
-    network.remove_node_to_graph(o_graph, o_idx)
+
     #return paths, distances, d_idxs
     return path_edges, distances, d_idxs
 
@@ -65,113 +63,113 @@ def bfs_subgraph_generation(
     d_idxs=None,
     o_scope=None,
     o_scope_paths=None,
+    scope_graph=None,
     ):
-    # TODO: should we only run destination search to half radius and use origin's shortest paths to complete the rest?
-    # TODO: should we use origin shortest paths to quickly terminate search from dest?traverse path to update
-    #  distance from destination to the dist_matrix
-    # TODO: should we batch search for all dests? it would be hard as we only keep track of one weight? maybe
-    #  keep track of multiple weights one for each source.
-    # TODO: should we use shortest_path_to_o while we search? probably yes.
+    """
+    Finds, for every destination in `d_idxs`, the nodes of the origin's scope that could be on a path from the origin
+    within `detour_ratio` of the destination's shortest distance, and their network distance to the destination.
+
+    Runs a reverse Dijkstra search from each destination, where a node is settled once, at its shortest distance. A
+    node is kept for a destination when its distance from the origin plus its distance to the destination is within
+    the destination's allowed distance, so each search is bounded by it and only visits kept nodes. Searches don't
+    continue past the origin or into dead ends, as paths can't use them. Only the kept (node, destination, distance)
+    triples are stored.
+
+    `scope_graph` is the origin's `ScopeGraph`, built once and shared by the searches of all destination chunks of
+    an origin, it is built from `o_graph` when not given. `o_scope_paths` is not needed anymore, and kept for
+    compatibility.
+
+    Returns:
+        od_scope: set of nodes kept for at least one destination
+        distance_matrix: a `DistanceMatrix`, distance_matrix[node][d_idx] is the distance from node to d_idx
+        d_idxs: unchanged
+    """
     od_scope = set()
     distance_matrix = {}
 
     if (len(d_idxs) == 0):
         return od_scope, distance_matrix, d_idxs
 
-    distance_matrix = {node_idx:{} for node_idx in o_scope.keys()}
+    if scope_graph is None:
+        scope_graph = ScopeGraph(o_idx, o_graph, o_scope)
+    node_rows = scope_graph.node_rows
+    neighbor_rows = scope_graph.neighbor_rows
+    neighbor_weights = scope_graph.neighbor_weights
+    scope_distances = scope_graph.scope_distances
+
+    destinations = list(d_idxs.keys())
+
+    # kept (row, column, distance) triples, a column per destination
+    rows = []
+    columns = []
+    values = []
+    # best distance found so far to each row, reset after each destination's search
+    best_distances = [math.inf] * len(scope_graph.nodes)
+    for column, d_idx in enumerate(destinations):
+        # small tolerance, same as path enumeration, so nodes on a shortest path are kept despite numerical error when detour_ratio=1
+        allowed_distance = o_scope[d_idx] * detour_ratio + 0.00001
+        start_row = node_rows[d_idx]
+        best_distances[start_row] = 0.0
+        reached_rows = [start_row]
+        queue = [(0.0, start_row)]
+        while queue:
+            distance, row = heappop(queue)
+            if distance > best_distances[row]:
+                # a shorter way to this row was found since it was queued
+                continue
+            rows.append(row)
+            columns.append(column)
+            values.append(distance)
+            for neighbor_row, edge_weight in zip(neighbor_rows[row], neighbor_weights[row]):
+                candidate = distance + edge_weight
+                if (candidate >= best_distances[neighbor_row]) or (candidate + scope_distances[neighbor_row] > allowed_distance):
+                    continue
+                if best_distances[neighbor_row] == math.inf:
+                    reached_rows.append(neighbor_row)
+                best_distances[neighbor_row] = candidate
+                heappush(queue, (candidate, neighbor_row))
+        for row in reached_rows:
+            best_distances[row] = math.inf
 
+    distance_matrix = DistanceMatrix.from_triples(scope_graph.nodes, destinations, rows, columns, values)
+    od_scope = set(distance_matrix.keys())
 
-    impossible_high_cost = max(d_idxs.values()) + 1
+    return od_scope, distance_matrix, d_idxs
 
-    def trailblazer(d_idx, source):
-        # nonlocal node_is_new_trailhead, trailblazer_early_termination
-        # node_is_new_trailhead += 1
-        for trailblazer_node in o_scope_paths[source][-2::-1]:
-            #if trailblazer_node in distance_matrix[d_idx]:
-            if d_idx in distance_matrix[trailblazer_node]:
-                # trailblazer_early_termination += 1
-                break
-            #distance_matrix[d_idx][trailblazer_node] = impossible_high_cost
-            distance_matrix[trailblazer_node][d_idx] = impossible_high_cost
 
-    best_weight_node_queue = []
-    # TODO: using a hashable priority queue might be something to try... as it offer a fast way to update a
-    #  value which might make trailblazing work effeciently with distances than just passing screening.
+class ScopeGraph:
+    """
+    Edges between the nodes of an origin's scope, for the reverse searches of `bfs_subgraph_generation`, as
+    adjacency lists by node row: the edges out of row `r` go to rows `neighbor_rows[r]`, with weights
+    `neighbor_weights[r]`. Edges out of the origin and into dead ends are left out, as paths can't use them.
+    `scope_distances[r]` is the distance of row `r` from the origin.
+    """
 
-    for d_idx in d_idxs:
-        distance_matrix[d_idx] = {d_idx: 0}
-        trailblazer(d_idx, d_idx)
-        heappush(best_weight_node_queue, (0, d_idx))
-
-        while best_weight_node_queue:
-            # if len(best_weight_node_queue) > max_queue_length:
-            #    max_queue_length = len(best_weight_node_queue)
-
-            # queue_counter += 1
-            weight, node = heappop(best_weight_node_queue)
-            # for neighbor in list(graph.neighbors(node)):
-            # if o_graph is None:
-            #    scope_neighbors = list(graph.neighbors(node))
-            # else:
-            #    scope_neighbors = [neighbor for neighbor in list(graph.neighbors(node)) if neighbor in od_scope]
-            for neighbor in list(o_graph.neighbors(node)):
-                if neighbor not in o_scope:
-                    # print(f"{node = }\tOut of O Scope termination")
-                    # new_node_out_of_scope += 1
-                    continue
-                # queue_neighbor_counter += 1
-                # TODO: consolidate the addinion of 'weight'
-                spent_weight =  o_graph.edges[(node, neighbor)]["weight"] + weight
-                #if neighbor in distance_matrix[d_idx]:  # equivalent to if in seen
-                if d_idx in distance_matrix[neighbor]:
-                    #if spent_weight >= distance_matrix[d_idx][neighbor]:
-                    if spent_weight >= distance_matrix[neighbor][d_idx]:
-                        # current_is_better += 1
-                        # print(f"{node = }\t{d_scope = }\tAlready found shorter distance termination")
+    def __init__(self, o_idx, o_graph, o_scope):
+        self.nodes = list(o_scope.keys())
+        self.node_rows = {node: row for row, node in enumerate(self.nodes)}
+        self.scope_distances = list(o_scope.values())
+        self.neighbor_rows = []
+        self.neighbor_weights = []
+
+        node_rows = self.node_rows
+        is_dead_end = {}
+        for node in self.nodes:
+            neighbor_rows = []
+            neighbor_weights = []
+            if node != o_idx:
+                for neighbor, edge_weight, _ in o_graph.neighbor_edges(node):
+                    if neighbor not in node_rows:
                         continue
-                    else:
-                        # better_update_difference_total += distance_matrix[d_idx][neighbor] - (spent_weight + weight)
-                        #distance_matrix[d_idx][neighbor] = spent_weight
-                        distance_matrix[neighbor][d_idx] = spent_weight 
-                        # found_better_updates += 1
-                        # TODO: Here, we also don't need to recheck. just insert to the heap again..
-                        heappush(best_weight_node_queue, (spent_weight, neighbor))
+                    if neighbor not in is_dead_end:
+                        is_dead_end[neighbor] = o_graph.neighbor_count(neighbor) == 1
+                    if is_dead_end[neighbor]:
                         continue
-                # found_new_node += 1
-
-
-
-                if (spent_weight + o_scope[neighbor]) > (o_scope[d_idx] * detour_ratio):
-                    # new_node_cant_reach_o += 1
-                    # print(f"{node = }\t{spent_weight = }\t{weight = }
-                    # \t{o_scope[d_idx] = }\t{o_scope[d_idx]
-                    # * detour_ratio = }network distance termination termination")
-                    continue
-
-                if len(list(o_graph.neighbors(neighbor))) == 1:
-                    # print(f"{node = }\tSIngle neighbor termination")
-                    # new_node_is_deadend += 1
-                    continue
-                # new_node_passed_filters += 1
-                # TODO: Mark as trailhead, and also insert o_shortest route elements into distance_matrix[d_idx]
-                #distance_matrix[d_idx][neighbor] = spent_weight
-                distance_matrix[neighbor][d_idx] = spent_weight
-
-                if neighbor == o_idx:
-                    # new_node_is_o_idx += 1
-                    # print("got home")
-                    continue
-                # new_node_passed_filters +=1
-                trailblazer(d_idx, neighbor)
-                heappush(best_weight_node_queue, (spent_weight, neighbor))
-
-    #for d_idx in distance_matrix.keys():
-    #    od_scope = od_scope.union(set(distance_matrix[d_idx].keys()))
-    
-
-    od_scope = {node_idx for node_idx in distance_matrix.keys() if  len(distance_matrix[node_idx]) > 0}
-
-    return od_scope, distance_matrix, d_idxs
+                    neighbor_rows.append(node_rows[neighbor])
+                    neighbor_weights.append(edge_weight)
+            self.neighbor_rows.append(neighbor_rows)
+            self.neighbor_weights.append(neighbor_weights)
+        return
 
 
 def bfs_paths_many_targets_iterative(
@@ -205,6 +203,7 @@ def bfs_paths_many_targets_iterative(
 
     # TODO: should this also be done in graph generation to limit scope? prob yes but need to keep track of predecessor.
 
+    turn_cost_value = network.turn_costs().penalty if turn_penalty else None
     allowed_path_nodes = set(network.street_node_ids)
     allowed_path_nodes.add(o_idx)
     paths = {}
@@ -223,22 +222,21 @@ def bfs_paths_many_targets_iterative(
         visited, source, targets_remaining, current_weight = q.pop()
 
         if od_scope is None:
-            scope_neighbors = list(o_graph.neighbors(source))
+            scope_neighbors = o_graph.neighbor_edges(source)
         else:
-            scope_neighbors = [neighbor for neighbor in list(o_graph.neighbors(source)) if neighbor in od_scope]
-        for neighbor in scope_neighbors:
+            scope_neighbors = [neighbor_edge for neighbor_edge in o_graph.neighbor_edges(source) if neighbor_edge[0] in od_scope]
+        for neighbor, spent_weight, _ in scope_neighbors:
             if neighbor in visited:
                 continue
             # the given graph have 2 neighbors for origins and destinations. if a node has only one
             # neighbor, its a deadend.
-            if len(list(o_graph.neighbors(neighbor))) == 1:
+            if o_graph.neighbor_count(neighbor) == 1:
                 continue
 
             turn_cost = 0
             if turn_penalty and len(visited) >= 2:
-                turn_cost = turn_penalty_value(network, visited[-2], source, neighbor)
+                turn_cost = turn_cost_value(visited[-2], source, neighbor)
 
-            spent_weight = o_graph.edges[(source, neighbor)]["weight"]
             neighbor_current_weight =  current_weight + spent_weight + turn_cost
             neighbor_targets_remaining = []
 
@@ -262,7 +260,6 @@ def bfs_paths_many_targets_iterative(
             q.appendleft((visited + [neighbor], neighbor, neighbor_targets_remaining, neighbor_current_weight))
     return paths, distances
 
-import networkx as nx
 def wandering_messenger(
     network: Network,
     o_graph,
@@ -272,59 +269,274 @@ def wandering_messenger(
     turn_penalty=False,
     od_scope=None
 ):
-    graph_dict = nx.to_dict_of_dicts(o_graph, nodelist=od_scope)
-
-    path_edges = {d_idx: deque([]) for d_idx in d_idxs}
-    distances = {d_idx: deque([]) for d_idx in d_idxs}
+    # adjacency restricted to the scope: {node: {neighbor: (weight, edge_id)}}
+    graph_dict = {
+        node: {neighbor: (weight, edge_id) for neighbor, weight, edge_id in o_graph.neighbor_edges(node) if neighbor in od_scope}
+        for node in od_scope
+    }
+    turn_cost_value = network.turn_costs().penalty if turn_penalty else None
+
+    # trie nodes and paths, as flat arrays. see `PathTrie`
+    trie_edge_ids = array("q")
+    trie_parents = array("q")
+    trie_depths = array("q")
+    path_destinations = array("q")
+    path_nodes = array("q")
+    path_weights = array("d")
+    d_columns = {d_idx: column for column, d_idx in enumerate(d_idxs)}
+
+    # the current path (the path diary), one page per step: the node reached, its trie node, its weight, the edge
+    # it added to the path (-1 when the edge was already on it) and whether it reached a target. Popping a branch
+    # that starts at page k drops the pages deeper than k, so the sets below only hold what is on the current path.
+    # a node only repeats on consecutive pages, through a self-loop, so it stays visited while the page below has it.
+    path_diary = [(o_idx, -1, 0, -1, False)]
+    visited = {o_idx}
+    visited_edges = set()
+    visited_targets = set()
 
-    path_diary =  [(o_idx, [], [], [], 0)] # (source, source_visited, source_visited_targets, source_visited_edges, source_weight)
     path_tree = deque([(o_neighbor, 0) for o_neighbor in graph_dict[o_idx]])
-
+    pruned_branches = 0
 
     while path_tree:
         node, source_diary_page = path_tree.pop()
-        (source, source_visited, source_visited_targets, source_visited_edges, source_weight) = path_diary[source_diary_page]
-
-        turn_cost = turn_penalty_value(network, source_visited[-1], source, node) if (turn_penalty and len(source_visited) > 0) else 0
-
-        node_weight =  source_weight + graph_dict[source][node]["weight"] + turn_cost
-        node_edge_id = graph_dict[source][node]["id"] 
-
-        node_visited_edges = source_visited_edges if node_edge_id in source_visited_edges else source_visited_edges+[node_edge_id]
-
-        if (node in d_idxs)  and (node_weight - d_idxs[node] <=  0.00001):
-            path_edges[node].append(node_visited_edges) #### ADD PATH (of step ids...) TO TREE if compression is needed.
-            distances[node].append(node_weight) ##### For step ID node, NEIGHBOR AS NODE ATTRIBUTE FOR neighbor. ALSO, Neighbor ID Aattribute
-            node_visited_targets = source_visited_targets + [node]
-        else:
-            node_visited_targets = source_visited_targets
-
-        for target in distance_matrix[node]:
-            if (target not in node_visited_targets) and (distance_matrix[node][target] + node_weight - d_idxs[target] <=  0.00001):
+        while len(path_diary) > source_diary_page + 1:
+            dropped_node, _, _, dropped_edge, dropped_target = path_diary.pop()
+            below_node, _, _, _, below_target = path_diary[-1]
+            if dropped_node != below_node:
+                visited.discard(dropped_node)
+            if dropped_edge != -1:
+                visited_edges.discard(dropped_edge)
+            if dropped_target and not (below_target and dropped_node == below_node):
+                visited_targets.discard(dropped_node)
+
+        source, source_trie_node, source_weight, _, _ = path_diary[source_diary_page]
+        turn_cost = turn_cost_value(path_diary[source_diary_page - 1][0], source, node) if (turn_penalty and source_diary_page > 0) else 0
+
+        edge_weight, node_edge_id = graph_dict[source][node]
+        node_weight = source_weight + edge_weight + turn_cost
+
+        # a step along an edge already on the path adds nothing to it, and shares the trie node of its source.
+        new_edge = node_edge_id not in visited_edges
+        node_trie_node = -1 if new_edge else source_trie_node
+
+        reached_target = (node in d_idxs) and (node_weight - d_idxs[node] <= 0.00001)
+        if reached_target:
+            if node_trie_node == -1:
+                node_trie_node = len(trie_edge_ids)
+                trie_edge_ids.append(node_edge_id)
+                trie_parents.append(source_trie_node)
+                trie_depths.append(trie_depths[source_trie_node] + 1 if source_trie_node != -1 else 1)
+            path_destinations.append(d_columns[node])
+            path_nodes.append(node_trie_node)
+            path_weights.append(node_weight)
+
+        node_distances = distance_matrix[node]
+        for target in node_distances:
+            if ((target not in visited_targets) and not (reached_target and target == node)) and (node_distances[target] + node_weight - d_idxs[target] <= 0.00001):
                 # there is at least one more reachible unvisited target: keep going
-                # update diary here
-                
-                node_visited = source_visited + [source]
-                # (source, source_visited, source_visited_targets, source_visited_edges, source_weight)
-                path_diary  =  path_diary[:source_diary_page + 1] + [(node, node_visited, node_visited_targets, node_visited_edges, node_weight)]
-                    
-                ## This intersection could have been eliminated if the o_graph was as tight as the o_scope
-                #for neighbor in set(o_graph.neighbors(node)).intersection(od_scope):
                 for neighbor in graph_dict[node]:
-                    if neighbor not in node_visited:
+                    if neighbor not in visited:
                         path_tree.append((neighbor, source_diary_page + 1))
-                
-                break # break after finding one remaining target and doing neibor queuing
 
+                if node_trie_node == -1:
+                    node_trie_node = len(trie_edge_ids)
+                    trie_edge_ids.append(node_edge_id)
+                    trie_parents.append(source_trie_node)
+                    trie_depths.append(trie_depths[source_trie_node] + 1 if source_trie_node != -1 else 1)
+                path_diary.append((node, node_trie_node, node_weight, node_edge_id if new_edge else -1, reached_target))
+                visited.add(node)
+                if new_edge:
+                    visited_edges.add(node_edge_id)
+                if reached_target:
+                    visited_targets.add(node)
+                break # break after finding one remaining target and doing neibor queuing
+        else:
+            pruned_branches += 1
+
+    return PathTrie.from_paths(
+        destinations=list(d_idxs),
+        edge_ids=np.frombuffer(trie_edge_ids, dtype=np.int64),
+        parents=np.frombuffer(trie_parents, dtype=np.int64),
+        depths=np.frombuffer(trie_depths, dtype=np.int64),
+        path_destinations=np.frombuffer(path_destinations, dtype=np.int64),
+        path_nodes=np.frombuffer(path_nodes, dtype=np.int64),
+        path_weights=np.frombuffer(path_weights, dtype=np.float64),
+        pruned_branches=pruned_branches,
+    )
 
 
+def stream_path_contributions(
+    network: Network,
+    o_graph,
+    o_idx,
+    d_idxs,
+    distance_matrix=None,
+    turn_penalty=False,
+    od_scope=None,
+    path_contribution=None,
+    edge_accumulator=None
+):
+    """
+    Walks the same paths as `wandering_messenger`, in the same order, without keeping them. Every path found calls
+    `path_contribution(d_idx, path_weight, segment_count)`, and the value returned is added to
+    `edge_accumulator[edge_id]` for every edge of the path. With `edge_accumulator=None`, paths are only counted
+    by `path_contribution`. Memory is bounded by the depth of the current path, whatever the number of paths.
+    Returns the number of branches pruned as they could not reach any remaining target.
+    """
+    # adjacency restricted to the scope: {node: {neighbor: (weight, edge_id)}}
+    graph_dict = {
+        node: {neighbor: (weight, edge_id) for neighbor, weight, edge_id in o_graph.neighbor_edges(node) if neighbor in od_scope}
+        for node in od_scope
+    }
+    turn_cost_value = network.turn_costs().penalty if turn_penalty else None
+
+    # same path diary as `wandering_messenger`, pages keep the number of edges on the path instead of a trie node.
+    # contributions of paths ending below a page are summed on the page, and handed to its edge and to the page
+    # below it when the page is dropped, so a path costs one addition whatever its length.
+    path_diary = [(o_idx, 0, 0, -1, False)]
+    pending_contributions = [0.0]
+    visited = {o_idx}
+    visited_edges = set()
+    visited_targets = set()
 
+    path_tree = deque([(o_neighbor, 0) for o_neighbor in graph_dict[o_idx]])
+    pruned_branches = 0
 
-    return path_edges, distances
+    while path_tree:
+        node, source_diary_page = path_tree.pop()
+        while len(path_diary) > source_diary_page + 1:
+            dropped_node, _, _, dropped_edge, dropped_target = path_diary.pop()
+            below_node, _, _, _, below_target = path_diary[-1]
+            if dropped_node != below_node:
+                visited.discard(dropped_node)
+            if dropped_edge != -1:
+                visited_edges.discard(dropped_edge)
+            if dropped_target and not (below_target and dropped_node == below_node):
+                visited_targets.discard(dropped_node)
+            dropped_contribution = pending_contributions.pop()
+            if dropped_contribution != 0:
+                if dropped_edge != -1:
+                    edge_accumulator[dropped_edge] += dropped_contribution
+                pending_contributions[-1] += dropped_contribution
+
+        source, source_segment_count, source_weight, _, _ = path_diary[source_diary_page]
+        turn_cost = turn_cost_value(path_diary[source_diary_page - 1][0], source, node) if (turn_penalty and source_diary_page > 0) else 0
+
+        edge_weight, node_edge_id = graph_dict[source][node]
+        node_weight = source_weight + edge_weight + turn_cost
+
+        new_edge = node_edge_id not in visited_edges
+        node_segment_count = source_segment_count + 1 if new_edge else source_segment_count
+
+        reached_target = (node in d_idxs) and (node_weight - d_idxs[node] <= 0.00001)
+        if reached_target:
+            contribution = path_contribution(node, node_weight, node_segment_count)
+            if (edge_accumulator is not None) and (contribution != 0):
+                pending_contributions[source_diary_page] += contribution
+                if new_edge:
+                    edge_accumulator[node_edge_id] += contribution
+
+        node_distances = distance_matrix[node]
+        for target in node_distances:
+            if ((target not in visited_targets) and not (reached_target and target == node)) and (node_distances[target] + node_weight - d_idxs[target] <= 0.00001):
+                # there is at least one more reachible unvisited target: keep going
+                for neighbor in graph_dict[node]:
+                    if neighbor not in visited:
+                        path_tree.append((neighbor, source_diary_page + 1))
 
+                path_diary.append((node, node_segment_count, node_weight, node_edge_id if new_edge else -1, reached_target))
+                pending_contributions.append(0.0)
+                visited.add(node)
+                if new_edge:
+                    visited_edges.add(node_edge_id)
+                if reached_target:
+                    visited_targets.add(node)
+                break # break after finding one remaining target and doing neibor queuing
+        else:
+            pruned_branches += 1
 
+    # hand the contributions still on the path down to the origin.
+    while len(path_diary) > 1:
+        _, _, _, dropped_edge, _ = path_diary.pop()
+        dropped_contribution = pending_contributions.pop()
+        if (dropped_contribution != 0) and (dropped_edge != -1):
+            edge_accumulator[dropped_edge] += dropped_contribution
+        pending_contributions[-1] += dropped_contribution
+    return pruned_branches
 
 
+def shortest_path_dependencies(
+    o_graph,
+    o_idx,
+    o_scope,
+    destination_values,
+):
+    """
+    Spreads `destination_values` ({d_idx: value}) over the shortest paths from `o_idx` to each destination, every
+    shortest path of a destination getting an equal share of its value, and returns what each edge gets, without
+    enumerating paths: the same edge betweenness `wandering_messenger` paths give when `detour_ratio=1`.
+
+    Brandes-style: shortest paths from the origin form a DAG over `o_scope` ({node: distance}, as `turn_o_scope`
+    finds it without turn penalties). A forward pass in order of distance counts the shortest paths to each node,
+    a backward pass sums each node's dependency: the value per path to it of the destinations reached through it.
+    A DAG edge (u, v) carries paths_to(u) x dependency(v). A path through a node inserted on an edge uses the edge
+    twice, once on each side, but adds to it once like in `PathTrie`, so what continues on the same edge id is taken
+    off again.
+
+    Returns:
+        edge_ids: array of edge ids
+        edge_values: array, what each edge in `edge_ids` gets
+        path_counts: {d_idx: number of shortest paths} for destinations in `destination_values`
+    """
+    order = sorted(o_scope, key=o_scope.get)
+    ranks = {node: rank for rank, node in enumerate(order)}
+
+    # forward pass: shortest path counts, and DAG edges into each node as (predecessor, edge_id).
+    node_path_counts = {o_idx: 1.0}
+    predecessors = {}
+    successors = defaultdict(list)
+    for node in order:
+        if node == o_idx:
+            continue
+        node_rank = ranks[node]
+        node_distance = o_scope[node]
+        node_predecessors = []
+        path_count = 0.0
+        for neighbor, edge_weight, edge_id in o_graph.neighbor_edges(node):
+            neighbor_rank = ranks.get(neighbor)
+            if (neighbor_rank is None) or (neighbor_rank >= node_rank):
+                continue
+            # same small tolerance as path enumeration, for numerical error on equal length paths.
+            if o_scope[neighbor] + edge_weight - node_distance <= 0.00001:
+                node_predecessors.append((neighbor, edge_id))
+                successors[neighbor].append((node, edge_id))
+                path_count += node_path_counts[neighbor]
+        predecessors[node] = node_predecessors
+        node_path_counts[node] = path_count
+
+    # backward pass: dependencies, and what DAG edges carry, summed per edge id.
+    dependencies = {}
+    edge_values = defaultdict(float)
+    for node in reversed(order):
+        dependency = sum(dependencies[successor] for successor, _ in successors.get(node, []))
+        if (node in destination_values) and (node_path_counts[node] > 0):
+            dependency += destination_values[node] / node_path_counts[node]
+        dependencies[node] = dependency
+        if (dependency == 0) or (node == o_idx):
+            continue
+        for predecessor, edge_id in predecessors[node]:
+            carried = dependency
+            for successor, successor_edge_id in successors.get(node, []):
+                if successor_edge_id == edge_id:
+                    carried -= dependencies[successor]
+            edge_values[edge_id] += node_path_counts[predecessor] * carried
+
+    path_counts = {d_idx: node_path_counts.get(d_idx, 0.0) for d_idx in destination_values}
+    return (
+        np.fromiter(edge_values.keys(), dtype=np.int64, count=len(edge_values)),
+        np.fromiter(edge_values.values(), dtype=np.float64, count=len(edge_values)),
+        path_counts,
+    )
 
 
 def bfs_path_edges_many_targets_iterative(
@@ -342,6 +554,7 @@ def bfs_path_edges_many_targets_iterative(
     for d_idx in d_idxs:
         path_edges[d_idx] = deque([])#[]
         distances[d_idx] = deque([])#[]
+    turn_cost_value = network.turn_costs().penalty if turn_penalty else None
 
     # queue initialization
     q = deque([])
@@ -352,20 +565,19 @@ def bfs_path_edges_many_targets_iterative(
         visited, edges, source, current_weight = q.pop()
         #visited, visited_targets, edges, source, current_weight = q.pop()
 
-        scope_neighbors = set(o_graph.neighbors(source)).intersection(od_scope)
+        scope_neighbors = [neighbor_edge for neighbor_edge in o_graph.neighbor_edges(source) if neighbor_edge[0] in od_scope]
 
-        for neighbor in scope_neighbors:
+        for neighbor, edge_weight, edge_id in scope_neighbors:
             if neighbor in visited:
                 continue
 
             turn_cost = 0
             if turn_penalty and len(visited) >= 2:
-                turn_cost = turn_penalty_value(network, visited[-2], source, neighbor)
+                turn_cost = turn_cost_value(visited[-2], source, neighbor)
 
 
 
-            edge_data = o_graph.edges[(source, neighbor)]
-            neighbor_current_weight =  current_weight + edge_data["weight"] + turn_cost
+            neighbor_current_weight =  current_weight + edge_weight + turn_cost
             ## create a list of edges visited, avoid adding an edge twice (when passing a destination, two segments have the same edg id for instance)
             
 
@@ -398,7 +610,6 @@ def bfs_path_edges_many_targets_iterative(
                         neighbor_edges = []
                     #igniring the first segment, storing it is memory overhead
                     else:
-                        edge_id = edge_data["id"] 
                         neighbor_edges = edges.copy() if edge_id in edges else edges + [edge_id]
                     
                     q.append((neighbor_visited, neighbor_edges, neighbor, neighbor_current_weight))
@@ -424,49 +635,70 @@ def turn_o_scope(
     detour_ratio: float, 
     turn_penalty=True,
     o_graph=None,
-    return_paths=True
+    return_paths=True,
+    edge_states=True
     ):
     """
     TODO: fill out the spec
     o_idx: origin index, integer, coming from the node_gdf
-    o_graph: reusing updated graphs (e. g. doing inelastic after elastic), optional
+    o_graph: reusing updated graphs (e. g. doing inelastic after elastic), optional. Defaults to a view of
+    `network.d_graph` with the origin inserted, see `Network.virtual_node_graph`
+    edge_states: when `turn_penalty` is enabled, search (node, previous node) states so turn-penalized distances
+    are exact, see `edge_state_o_scope`. If False, keeps a single label per node, which is faster but can
+    overestimate distances when the best way into a node is not the best way through it.
     """
-    node_gdf = network.nodes
-    destinations = node_gdf[node_gdf["type"] == "destination"].index
+    if o_graph is None:
+        o_graph = network.virtual_node_graph(network.d_graph, o_idx)
+    if turn_penalty and edge_states:
+        return edge_state_o_scope(
+            network=network,
+            o_idx=o_idx,
+            search_radius=search_radius,
+            detour_ratio=detour_ratio,
+            o_graph=o_graph,
+            return_paths=return_paths
+        )
+    destinations = network.destination_ids
+    turn_cost_value = network.turn_costs().penalty if turn_penalty else None
     # print(f"turn_o_scope: {o_idx = }")
 
 
     # visualize_graph(self, graph)
     o_scope = {o_idx: 0}
     d_idxs = {}
-    o_scope_paths = {}
+    # every heap entry carries a label (node, parent label) instead of a copy of its path.
+    o_scope_paths = ScopePaths(o_idx)
+    label_nodes = o_scope_paths.label_nodes
+    label_parents = o_scope_paths.label_parents
+    node_labels = o_scope_paths.node_labels
 
-    forward_q = [(0, o_idx, [o_idx])]
+    forward_q = [(0, o_idx, 0)]
 
     furthest_dest_weight = 0
 
     while forward_q:
-        weight, node, visited = heappop(forward_q)
-        for neighbor in list(o_graph.neighbors(node)):
+        weight, node, label = heappop(forward_q)
+        parent_label = label_parents[label]
+        previous_node = None if parent_label == -1 else label_nodes[parent_label]
+        for neighbor, edge_weight, _ in o_graph.neighbor_edges(node):
 
             turn_cost = 0
-            if turn_penalty and len(visited) >= 2 :
-                turn_cost = turn_penalty_value(network, visited[-2], node, neighbor)
+            if turn_penalty and (previous_node is not None):
+                turn_cost = turn_cost_value(previous_node, node, neighbor)
 
             # TODO: remove duplicate checking of condition
-            neighbor_weight = weight + o_graph.edges[(node, neighbor)]["weight"] + turn_cost
+            neighbor_weight = weight + edge_weight + turn_cost
             if neighbor in o_scope :  # equivalent to if in seen
                 if (neighbor_weight >= o_scope[neighbor]):
-                    #current_is_better += 1
                     continue
                 o_scope[neighbor] = neighbor_weight
-                if return_paths:
-                    o_scope_paths[neighbor] = visited + [neighbor]
                 if (neighbor in destinations) and (neighbor_weight <= search_radius):
                     furthest_dest_weight = max(furthest_dest_weight, neighbor_weight)
                     d_idxs[neighbor] = neighbor_weight
-                # found_better_updates += 1
-                heappush(forward_q, (neighbor_weight, neighbor, visited + [neighbor]))
+                label_nodes.append(neighbor)
+                label_parents.append(label)
+                node_labels[neighbor] = len(label_nodes) - 1
+                heappush(forward_q, (neighbor_weight, neighbor, len(label_nodes) - 1))
                 continue
                 
             
@@ -475,7 +707,7 @@ def turn_o_scope(
             if neighbor_weight > (search_radius*detour_ratio) :
                 continue
 
-            if len(list(o_graph.neighbors(neighbor))) == 1:
+            if o_graph.neighbor_count(neighbor) == 1:
                 continue
 
 
@@ -483,42 +715,323 @@ def turn_o_scope(
                 furthest_dest_weight = max(furthest_dest_weight, neighbor_weight)
                 d_idxs[neighbor] = neighbor_weight
             o_scope[neighbor] = neighbor_weight
-            if return_paths:
-                o_scope_paths[neighbor] = visited + [neighbor]
-            heappush(forward_q, (neighbor_weight, neighbor, visited + [neighbor]))
+            label_nodes.append(neighbor)
+            label_parents.append(label)
+            node_labels[neighbor] = len(label_nodes) - 1
+            heappush(forward_q, (neighbor_weight, neighbor, len(label_nodes) - 1))
+    if not return_paths:
+        return d_idxs, o_scope, {}
     return d_idxs, o_scope, o_scope_paths
 
+
+def edge_state_o_scope(
+    network: Network,
+    o_idx,
+    search_radius: float,
+    detour_ratio: float,
+    o_graph=None,
+    return_paths=True
+    ):
+    """
+    Turn-penalized version of `turn_o_scope` that searches over edge states: a state is a node and the node it was
+    entered from, so each way into a node keeps its own distance and the turn penalty out of it is exact. A node's
+    distance in `o_scope` is the best over its states. Immediate U-turns are not allowed: they are never penalized,
+    and a path can't use them anyway as it can't visit a node twice.
+
+    Returns the same (d_idxs, o_scope, o_scope_paths) as `turn_o_scope`.
+    """
+    if o_graph is None:
+        o_graph = network.virtual_node_graph(network.d_graph, o_idx)
+    destinations = network.destination_ids
+    turn_cost_value = network.turn_costs().penalty
+    scope_limit = search_radius * detour_ratio
+
+    o_scope = {o_idx: 0}
+    d_idxs = {}
+    o_scope_paths = ScopePaths(o_idx)
+    label_nodes = o_scope_paths.label_nodes
+    label_parents = o_scope_paths.label_parents
+    node_labels = o_scope_paths.node_labels
+    # best weight of each (node, previous node) state, the origin's state has no previous node (-1)
+    state_weights = {(o_idx, -1): 0}
+
+    forward_q = [(0, o_idx, 0)]
+
+    while forward_q:
+        weight, node, label = heappop(forward_q)
+        parent_label = label_parents[label]
+        previous_node = -1 if parent_label == -1 else label_nodes[parent_label]
+        if weight > state_weights[(node, previous_node)]:
+            # a better way into this node through the same previous node was found since this was queued
+            continue
+
+        for neighbor, edge_weight, _ in o_graph.neighbor_edges(node):
+            if (neighbor == previous_node) or (neighbor == o_idx):
+                continue
+
+            neighbor_weight = weight + edge_weight
+            if previous_node != -1:
+                neighbor_weight += turn_cost_value(previous_node, node, neighbor)
+
+            state = (neighbor, node)
+            if (state in state_weights) and (neighbor_weight >= state_weights[state]):
+                continue
+
+            if neighbor_weight > scope_limit:
+                continue
+
+            if o_graph.neighbor_count(neighbor) == 1:
+                continue
+
+            state_weights[state] = neighbor_weight
+            label_nodes.append(neighbor)
+            label_parents.append(label)
+            heappush(forward_q, (neighbor_weight, neighbor, len(label_nodes) - 1))
+
+            if (neighbor not in o_scope) or (neighbor_weight < o_scope[neighbor]):
+                o_scope[neighbor] = neighbor_weight
+                node_labels[neighbor] = len(label_nodes) - 1
+                if (neighbor in destinations) and (neighbor_weight <= search_radius):
+                    d_idxs[neighbor] = neighbor_weight
+
+    if not return_paths:
+        return d_idxs, o_scope, {}
+    return d_idxs, o_scope, o_scope_paths
+
+
+class ScopePaths:
+    """
+    Shortest paths from the origin found by `turn_o_scope`, kept as a tree of labels: every label is a node and
+    the label it was reached from. `paths[node]` rebuilds the path from the origin to `node` as a list,
+    `ancestors(node)` walks it back lazily, so only the paths actually used are ever materialized.
+    """
+
+    def __init__(self, o_idx):
+        self.label_nodes = [o_idx]
+        self.label_parents = [-1]
+        # label of the current shortest path to each node.
+        self.node_labels = {}
+        return
+
+    def ancestors(self, node):
+        """
+        Yields the nodes on the shortest path to `node`, from its predecessor back to the origin.
+        """
+        label = self.label_parents[self.node_labels[node]]
+        while label != -1:
+            yield self.label_nodes[label]
+            label = self.label_parents[label]
+
+    def __getitem__(self, node):
+        path = list(self.ancestors(node))
+        path.reverse()
+        path.append(node)
+        return path
+
+    def __contains__(self, node):
+        return node in self.node_labels
+
+    def __len__(self):
+        return len(self.node_labels)
+
+    def keys(self):
+        return self.node_labels.keys()
+
+
+class PathTrie:
+    """
+    Paths found by `wandering_messenger`, stored as a parent-pointer trie in flat arrays: trie node `t` extends the
+    path of trie node `parents[t]` (-1 for the origin) by the edge `edge_ids[t]`, and has `depths[t]` edges. Paths
+    sharing a prefix share its trie nodes, so a path costs one trie node for each edge it does not share with an
+    earlier path. Paths are grouped by destination: the paths to `destinations[i]` are the indices
+    `offsets[i]:offsets[i+1]`, path `p` ends at trie node `path_nodes[p]` and has a length of `path_weights[p]`.
+    Within a destination, paths are kept in the order they were found. `pruned_branches` counts the branches the
+    search dropped as they could not reach any remaining destination.
+    """
+
+    def __init__(self, destinations, offsets, edge_ids, parents, depths, path_nodes, path_weights, pruned_branches=0):
+        self.destinations = destinations
+        self.offsets = offsets
+        self.edge_ids = edge_ids
+        self.parents = parents
+        self.depths = depths
+        self.path_nodes = path_nodes
+        self.path_weights = path_weights
+        self.pruned_branches = pruned_branches
+        self.destination_columns = {d_idx: column for column, d_idx in enumerate(destinations)}
+        return
+
+    @classmethod
+    def from_paths(cls, destinations, edge_ids, parents, depths, path_destinations, path_nodes, path_weights, pruned_branches=0):
+        """
+        Builds a trie from paths in the order they were found, `path_destinations[p]` being the position of the
+        destination of path `p` in `destinations`.
+        """
+        order = np.argsort(path_destinations, kind="stable")
+        offsets = np.zeros(len(destinations) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(path_destinations, minlength=len(destinations)), out=offsets[1:])
+        return cls(destinations, offsets, edge_ids, parents, depths, path_nodes[order], path_weights[order], pruned_branches=pruned_branches)
+
+    def paths(self, d_idx):
+        """
+        Returns the range of path indices of the paths to `d_idx`.
+        """
+        column = self.destination_columns.get(d_idx)
+        if column is None:
+            return range(0)
+        return range(self.offsets[column], self.offsets[column + 1])
+
+    def weights(self, d_idx):
+        """
+        Returns the lengths of the paths to `d_idx`, a view into `path_weights`.
+        """
+        d_paths = self.paths(d_idx)
+        return self.path_weights[d_paths.start:d_paths.stop]
+
+    def edges(self, path):
+        """
+        Yields the edge ids of `path`, from the destination back to the origin.
+        """
+        trie_node = self.path_nodes[path]
+        while trie_node != -1:
+            yield self.edge_ids[trie_node]
+            trie_node = self.parents[trie_node]
+
+    def edge_lists(self, paths):
+        """
+        Returns the edge ids of every path in `paths` (an array or a range of path indices), from the origin to the
+        destination, as flat arrays: the edge ids of the `i`th path are `edge_ids[offsets[i]:offsets[i+1]]`.
+        """
+        trie_nodes = self.path_nodes[paths].copy()
+        lengths = self.depths[trie_nodes]
+        offsets = np.zeros(lengths.shape[0] + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        edge_ids = np.empty(offsets[-1], dtype=self.edge_ids.dtype)
+        # walking all paths back from their last edge at once, one edge per step.
+        positions = offsets[1:] - 1
+        for step in range(int(lengths.max()) if lengths.shape[0] > 0 else 0):
+            walking = lengths > step
+            edge_ids[positions[walking] - step] = self.edge_ids[trie_nodes[walking]]
+            trie_nodes[walking] = self.parents[trie_nodes[walking]]
+        return offsets, edge_ids
+
+    def edge_sums(self, path_values):
+        """
+        Sums `path_values` (a value or a row of values per path) over the paths through every trie node: values are
+        added at the trie node each path ends at, then handed to parent trie nodes one depth at a time. Returns the
+        edge ids of the trie nodes and their sums; an edge can appear at several trie nodes.
+        """
+        if np.ndim(path_values) == 1:
+            node_sums = np.bincount(self.path_nodes, weights=path_values, minlength=self.edge_ids.shape[0])
+        else:
+            node_sums = np.zeros((self.edge_ids.shape[0], path_values.shape[1]), dtype=np.float64)
+            np.add.at(node_sums, self.path_nodes, path_values)
+        for depth_nodes in reversed(self.depth_levels()[1:]):
+            np.add.at(node_sums, self.parents[depth_nodes], node_sums[depth_nodes])
+        return self.edge_ids, node_sums
+
+    def path_sums(self, node_values):
+        """
+        Sums `node_values`, a value or a row of values for every trie node, over the trie nodes of every path: values
+        are added to trie nodes from their parent one depth at a time, so each path ends at the sum over its edges.
+        Returns an array with a value or a row of values for every path, the same as a dot product of each path's
+        edge incidence with `node_values`.
+        """
+        prefix_sums = np.array(node_values, dtype=np.float64)
+        for depth_nodes in self.depth_levels()[1:]:
+            prefix_sums[depth_nodes] += prefix_sums[self.parents[depth_nodes]]
+        return prefix_sums[self.path_nodes]
+
+    def depth_levels(self):
+        """
+        Returns the trie nodes of every depth, from depth 1. Parents of a depth are all at the depth above it.
+        """
+        if self.depths.shape[0] == 0:
+            return []
+        depth_order = np.argsort(self.depths, kind="stable")
+        depth_bounds = np.searchsorted(self.depths[depth_order], np.arange(1, self.depths.max() + 2))
+        return [depth_order[start:end] for start, end in zip(depth_bounds[:-1], depth_bounds[1:])]
+
+    def segment_count(self):
+        """
+        Returns the number of edges over all paths, as if every path was stored on its own.
+        """
+        return int(self.depths[self.path_nodes].sum())
+
+    @property
+    def nbytes(self):
+        return self.edge_ids.nbytes + self.parents.nbytes + self.depths.nbytes + self.path_nodes.nbytes + self.path_weights.nbytes + self.offsets.nbytes
+
+    def __getitem__(self, path):
+        path_edges = list(self.edges(path))
+        path_edges.reverse()
+        return path_edges
+
+    def __len__(self):
+        return len(self.path_nodes)
+
+
+class DistanceMatrix:
+    """
+    Node to destination distances found by `bfs_subgraph_generation`, stored in compressed sparse row form: the
+    destinations kept for row `r` (node `nodes[r]`) are `destinations[columns[offsets[r]:offsets[r+1]]]`, with
+    distances in `values[...]`. `distance_matrix[node]` returns a {d_idx: distance} dict for one node, built on first
+    access.
+    """
+
+    def __init__(self, nodes, destinations, offsets, columns, values):
+        self.nodes = nodes
+        self.destinations = destinations
+        self.offsets = offsets
+        self.columns = columns
+        self.values = values
+        self.node_rows = {node: row for row, node in enumerate(nodes) if offsets[row + 1] > offsets[row]}
+        self.row_dicts = {}
+        return
+
+    @classmethod
+    def from_triples(cls, nodes, destinations, rows, columns, values):
+        """
+        Builds a matrix from (node row, destination column, distance) triples, a row of `nodes` and a column of
+        `destinations` each.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int32)
+        values = np.asarray(values, dtype=np.float64)
+        order = np.lexsort((columns, rows))
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(nodes)), out=offsets[1:])
+        return cls(nodes, destinations, offsets, columns[order], values[order])
+
+    def __getitem__(self, node):
+        row_dict = self.row_dicts.get(node)
+        if row_dict is None:
+            row = self.node_rows.get(node)
+            if row is None:
+                return {}
+            start = self.offsets[row]
+            end = self.offsets[row + 1]
+            destinations = self.destinations
+            row_dict = {destinations[column]: value for column, value in zip(self.columns[start:end].tolist(), self.values[start:end].tolist())}
+            self.row_dicts[node] = row_dict
+        return row_dict
+
+    def __contains__(self, node):
+        return node in self.node_rows
+
+    def __len__(self):
+        return len(self.node_rows)
+
+    def keys(self):
+        return self.node_rows.keys()
+
+
 def turn_penalty_value(network: Network, previous_node, current_node, next_node):
     """
-    TODO: fill out the spec
+    Returns the turn penalty of going from `previous_node` to `next_node` through `current_node`, read from the
+    network's turn cost table (see `Network.turn_costs()`)
     """
-    node_gdf = network.nodes
-    edge_gdf = network.edges
-    '''
-    previous_segment = edge_gdf[
-        (edge_gdf['start'] == previous_node) & (edge_gdf['end'] == current_node) | 
-        (edge_gdf['end'] == previous_node) & (edge_gdf['start'] == current_node) 
-    ]
-
-    next_segment = edge_gdf[
-        (edge_gdf['start'] == current_node) & (edge_gdf['end'] == next_node) | 
-        (edge_gdf['end'] == current_node) & (edge_gdf['start'] == next_node) 
-    ]
-    '''
-
-    
-    angle = angle_deviation_between_two_lines(
-        [
-            node_gdf.at[previous_node, "geometry"],
-            node_gdf.at[current_node, "geometry"],
-            node_gdf.at[next_node, "geometry"]
-        ]
-    )
-    angle = min(angle, abs(angle - 180))
-    if angle > network.turn_threshold_degree:
-        return network.turn_penalty_amount
-    else:
-        return 0
+    return network.turn_costs().penalty(previous_node, current_node, next_node)
 
 def angle_deviation_between_two_lines(point_sequence, raw_angle=False):
     a = point_sequence[0].coords[0]
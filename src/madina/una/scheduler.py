@@ -0,0 +1,244 @@
+import heapq
+import multiprocessing as mp
+
+import numpy as np
+
+from ..zonal import Network
+from ..zonal import SharedArrays, register_worker_lock, worker_lock
+
+
+def estimate_origin_costs(
+    network: Network,
+    origin_ids,
+    search_radius: float,
+    detour_ratio: float = 1.0,
+    cell_count: int = 8,
+):
+    """
+    Estimates the relative cost of searching from each origin, from cheap signals: street nodes within
+    `search_radius` (the scope a search explores) and destinations within `search_radius`, weighted by how many
+    paths fit in their detour: the number of alternative paths grows about exponentially with the slack
+    `distance * (detour_ratio - 1)`, measured in edges.
+
+    Nodes are binned in square cells `search_radius / cell_count` wide, and each origin sums the cells whose center
+    is within `search_radius`, so the estimate takes linear time and memory in the number of nodes.
+
+    :param network: A network with inserted origins and destinations.
+    :type network: Network
+    :param origin_ids: ids of origin nodes to estimate costs for.
+    :param search_radius: search radius of the analysis.
+    :type search_radius: float
+    :param detour_ratio: detour ratio of the analysis, 1 when only shortest paths are searched.
+    :type detour_ratio: float
+    :param cell_count: number of cells per search radius.
+    :type cell_count: int
+    :returns: a float array of costs, aligned with `origin_ids`.
+    """
+    node_gdf = network.nodes
+    origin_ids = np.asarray(origin_ids, dtype=np.int64)
+    node_x = node_gdf.geometry.x.values
+    node_y = node_gdf.geometry.y.values
+    node_types = node_gdf["type"].values
+    positions = node_gdf.index.get_indexer(origin_ids)
+    origin_x = node_x[positions]
+    origin_y = node_y[positions]
+
+    cell_size = search_radius / cell_count
+    min_x = node_x.min()
+    min_y = node_y.min()
+    column_count = int((node_x.max() - min_x) // cell_size) + 1
+
+    def cell_keys(x, y):
+        return ((x - min_x) // cell_size).astype(np.int64) + ((y - min_y) // cell_size).astype(np.int64) * column_count
+
+    # occupied cells only, so memory follows the number of nodes and not the extent.
+    def cell_counts(node_type):
+        keys, counts = np.unique(cell_keys(node_x[node_types == node_type], node_y[node_types == node_type]), return_counts=True)
+        return keys, counts
+
+    street_keys, street_counts = cell_counts("street_node")
+    destination_keys, destination_counts = cell_counts("destination")
+
+    def cell_lookup(keys, counts, query_keys):
+        if keys.shape[0] == 0:
+            return np.zeros(query_keys.shape[0])
+        found = np.minimum(np.searchsorted(keys, query_keys), keys.shape[0] - 1)
+        return np.where(keys[found] == query_keys, counts[found], 0)
+
+    edge_length = network.edges["length"].mean()
+    origin_columns = ((origin_x - min_x) // cell_size).astype(np.int64)
+    origin_rows = ((origin_y - min_y) // cell_size).astype(np.int64)
+    costs = np.ones(origin_ids.shape[0])
+    for column_offset in range(-cell_count, cell_count + 1):
+        for row_offset in range(-cell_count, cell_count + 1):
+            columns = origin_columns + column_offset
+            rows = origin_rows + row_offset
+            distances = np.hypot(min_x + (columns + 0.5) * cell_size - origin_x, min_y + (rows + 0.5) * cell_size - origin_y)
+            in_reach = (distances <= search_radius) & (columns >= 0) & (columns < column_count) & (rows >= 0)
+            if not in_reach.any():
+                continue
+            query_keys = columns + rows * column_count
+            costs += in_reach * cell_lookup(street_keys, street_counts, query_keys)
+            costs += in_reach * cell_lookup(destination_keys, destination_counts, query_keys) * np.exp(
+                distances * (detour_ratio - 1) / edge_length
+            )
+    return costs
+
+
+class OriginScheduler:
+    """
+    Hands origins to worker processes in batches, balanced by an estimate of each origin's cost (see
+    `estimate_origin_costs()`). Origins are dealt, most expensive first, to the worker with the least cost so far,
+    and each worker takes batches of about `batch_fraction` of its remaining cost from the head of its own queue,
+    so batches shrink as a worker runs out of work. A worker whose queue is empty steals the cheaper half of the
+    queue with the most remaining cost, from its tail, so long running origins don't leave cores idle at the end.
+
+    Queues live in shared memory and are only touched under a lock, once per batch. Workers use the scheduler
+    like a queue: `get()` returns the next origin id, and "done" when no origin is left. The lock can only reach
+    workers when they start, so executors must run `initialize_worker` in each worker, or, for workers that are
+    already running (a `ComputePool`), the scheduler uses the lock they were started with (`lock`, `lock_name`).
+
+    :Example:
+        >>> scheduler = OriginScheduler(origin_ids, costs=costs, num_workers=4)
+        >>> with scheduler, ProcessPoolExecutor(max_workers=4, initializer=scheduler.initialize_worker) as executor:
+        >>>     executor.submit(betweenness_exposure, self=shared_zonal, origin_queue=scheduler, ...)
+    """
+
+    def __init__(self, origin_ids, costs=None, num_workers: int = 1, batch_fraction: float = 0.125, lock=None, lock_name: str = None):
+        origin_ids = np.asarray(origin_ids, dtype=np.int64)
+        costs = np.ones(origin_ids.shape[0]) if costs is None else np.maximum(np.asarray(costs, dtype=np.float64), 1e-9)
+
+        # longest processing time first: each origin goes to the worker with the least cost so far.
+        worker_origins = [[] for _ in range(num_workers)]
+        worker_costs = [(0.0, worker_index) for worker_index in range(num_workers)]
+        for position in np.argsort(-costs, kind="stable"):
+            worker_cost, worker_index = heapq.heappop(worker_costs)
+            worker_origins[worker_index].append(position)
+            heapq.heappush(worker_costs, (worker_cost + costs[position], worker_index))
+
+        queue = np.array([position for positions in worker_origins for position in positions], dtype=np.int64)
+        queue_ends = np.cumsum([len(positions) for positions in worker_origins])
+        deques = np.column_stack([queue_ends - [len(positions) for positions in worker_origins], queue_ends])
+
+        self.shared = SharedArrays({
+            "origins": origin_ids[queue],
+            "cumulative_costs": np.concatenate([[0.0], np.cumsum(costs[queue])]),
+            # [head, tail) of each worker's queue, in "origins"
+            "deques": deques.astype(np.int64).reshape(num_workers, 2),
+            # [claimed worker slots, origins done]
+            "counters": np.zeros(2, dtype=np.int64),
+        }, writeable=True)
+        self.lock = mp.Lock() if lock is None else lock
+        self.lock_name = self.shared.memory.name if lock_name is None else lock_name
+        self.num_workers = num_workers
+        self.batch_fraction = batch_fraction
+        self.origin_count = origin_ids.shape[0]
+        self._reset_worker_state()
+        return
+
+    def _reset_worker_state(self):
+        self.slot = None
+        self.batch = []
+        self.batch_position = 0
+        return
+
+    def initialize_worker(self):
+        """
+        Registers the scheduler's lock in a worker process, pass it as `initializer` to executors.
+        """
+        register_worker_lock(self.lock_name, self.lock)
+        return
+
+    @classmethod
+    def _restore(cls, shared, lock, lock_name, num_workers, batch_fraction, origin_count):
+        scheduler = cls.__new__(cls)
+        scheduler.shared = shared
+        scheduler.lock = lock
+        scheduler.lock_name = lock_name
+        scheduler.num_workers = num_workers
+        scheduler.batch_fraction = batch_fraction
+        scheduler.origin_count = origin_count
+        scheduler._reset_worker_state()
+        return scheduler
+
+    @classmethod
+    def _attached(cls, shared, lock_name, num_workers, batch_fraction, origin_count):
+        return cls._restore(shared, worker_lock(lock_name), lock_name, num_workers, batch_fraction, origin_count)
+
+    def __reduce__(self):
+        # the lock can only be pickled while starting a worker process, later on, tasks refer to the lock the
+        # worker registered when it started.
+        if mp.context.get_spawning_popen() is not None:
+            return (OriginScheduler._restore, (self.shared, self.lock, self.lock_name, self.num_workers, self.batch_fraction, self.origin_count))
+        return (OriginScheduler._attached, (self.shared, self.lock_name, self.num_workers, self.batch_fraction, self.origin_count))
+
+    def next_batch(self):
+        """
+        Claims the next batch of origins for this worker, stealing from another worker when its own queue is empty.
+        Returns an empty list when no origin is left.
+        """
+        with self.lock:
+            deques = self.shared["deques"]
+            counters = self.shared["counters"]
+            cumulative_costs = self.shared["cumulative_costs"]
+            if self.slot is None:
+                self.slot = int(counters[0]) % self.num_workers
+                counters[0] += 1
+            counters[1] += len(self.batch)
+
+            head, tail = deques[self.slot]
+            if head == tail:
+                remaining_costs = cumulative_costs[deques[:, 1]] - cumulative_costs[deques[:, 0]]
+                victim = int(np.argmax(remaining_costs))
+                victim_head, victim_tail = deques[victim]
+                if victim_head == victim_tail:
+                    return []
+                # the victim keeps the more expensive half of its remaining cost, at the head of its queue.
+                half_cost = (cumulative_costs[victim_head] + cumulative_costs[victim_tail]) / 2
+                split = min(max(int(np.searchsorted(cumulative_costs, half_cost)), victim_head), victim_tail - 1)
+                deques[victim, 1] = split
+                deques[self.slot] = (split, victim_tail)
+                head, tail = split, victim_tail
+
+            target_cost = cumulative_costs[head] + (cumulative_costs[tail] - cumulative_costs[head]) * self.batch_fraction
+            batch_end = min(max(int(np.searchsorted(cumulative_costs, target_cost, side="right")) - 1, head + 1), tail)
+            deques[self.slot, 0] = batch_end
+            return self.shared["origins"][head:batch_end].tolist()
+
+    def get(self):
+        """
+        Returns the next origin id for this worker, or "done" when no origin is left.
+        """
+        if self.batch_position == len(self.batch):
+            self.batch = self.next_batch()
+            self.batch_position = 0
+            if len(self.batch) == 0:
+                return "done"
+        origin_idx = self.batch[self.batch_position]
+        self.batch_position += 1
+        return origin_idx
+
+    def task_done(self):
+        # queue compatibility, origins are counted when a worker claims its next batch.
+        return
+
+    @property
+    def done_count(self):
+        """
+        Number of origins in batches workers have finished.
+        """
+        return int(self.shared["counters"][1])
+
+    def close(self):
+        """
+        Frees the shared queues, call once workers are done.
+        """
+        self.shared.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,323 @@
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from ..zonal import Zonal
+from ..zonal import ComputePool
+from .paths import turn_o_scope, bfs_subgraph_generation, ScopeGraph, wandering_messenger, PathTrie
+from .betweenness import destination_chunk_size, run_workers
+from .scheduler import estimate_origin_costs
+from .checkpoint import Checkpoint, sparse_delta, add_sparse_delta
+
+
+# parameters a sweep can vary, and their defaults, the same as `betweenness()`'s. paths are searched once, at the
+# largest search radius and detour ratio, and filtered for sets with smaller ones.
+SWEEP_PARAMETERS = {
+    "search_radius": None,  # the sweep's search radius when None
+    "detour_ratio": None,  # the sweep's detour ratio when None
+    "beta": 0.003,
+    "decay": False,
+    "decay_method": "exponent",  # "exponent" | "power"
+    "path_detour_penalty": "equal",  # "exponent" | "power" | "equal"
+    "closest_destination": True,
+    "destination_weight": None,  # a column of the destination layer, the destinations' weight when None
+}
+
+
+def sweep_parameter_arrays(parameter_sets, search_radius, detour_ratio):
+    """
+    Returns the parameters of every set in `parameter_sets`, filled with defaults, as arrays with a value for every
+    set, so paths are weighted for all sets at once.
+    """
+    parameter_sets = [{**SWEEP_PARAMETERS, **parameter_set} for parameter_set in parameter_sets]
+    return {
+        "search_radius": np.array([search_radius if parameter_set["search_radius"] is None else parameter_set["search_radius"] for parameter_set in parameter_sets], dtype=np.float64),
+        "detour_ratio": np.array([detour_ratio if parameter_set["detour_ratio"] is None else parameter_set["detour_ratio"] for parameter_set in parameter_sets], dtype=np.float64),
+        "beta": np.array([parameter_set["beta"] for parameter_set in parameter_sets], dtype=np.float64),
+        "decay": np.array([parameter_set["decay"] for parameter_set in parameter_sets], dtype=bool),
+        "power_decay": np.array([parameter_set["decay_method"] == "power" for parameter_set in parameter_sets], dtype=bool),
+        "exponent_penalty": np.array([parameter_set["path_detour_penalty"] == "exponent" for parameter_set in parameter_sets], dtype=bool),
+        "power_penalty": np.array([parameter_set["path_detour_penalty"] == "power" for parameter_set in parameter_sets], dtype=bool),
+        "closest_destination": np.array([parameter_set["closest_destination"] for parameter_set in parameter_sets], dtype=bool),
+    }
+
+
+def sweep_destination_weights(self: Zonal, parameter_sets):
+    """
+    Returns a DataFrame indexed by destination node id, with the destination weights of every parameter set as
+    columns: the weight destinations were inserted with, or a column of their layer given as "destination_weight".
+    """
+    node_gdf = self.network.nodes
+    destination_gdf = node_gdf[node_gdf["type"] == "destination"]
+    destination_weights = pd.DataFrame(index=destination_gdf.index)
+    for set_index, parameter_set in enumerate(parameter_sets):
+        weight_attribute = parameter_set.get("destination_weight")
+        if weight_attribute is None:
+            destination_weights[set_index] = destination_gdf["weight"].astype(np.float64)
+            continue
+        weights = pd.Series(np.nan, index=destination_gdf.index)
+        for layer_name, layer_destinations in destination_gdf.groupby("source_layer"):
+            weights[layer_destinations.index] = self[layer_name].gdf[weight_attribute].reindex(layer_destinations["source_id"].values).values
+        destination_weights[set_index] = weights.fillna(0).astype(np.float64)
+    return destination_weights
+
+
+def sweep_destination_probabilities(destination_distances, destination_weights, sweep_parameters):
+    """
+    Returns the probability of trips to every destination (rows, sorted by distance) under every parameter set
+    (columns): the Huff model of `betweenness_exposure()`, or all trips to the closest destination, among the
+    destinations within the set's search radius.
+    """
+    in_radius = destination_distances[:, None] <= sweep_parameters["search_radius"][None, :]
+    gravities = in_radius * destination_weights / np.exp(destination_distances[:, None] * sweep_parameters["beta"][None, :])
+    gravity_sums = gravities.sum(axis=0)
+    # an origin whose reachable destinations all have no weight generates no trips.
+    destination_probabilities = np.divide(gravities, gravity_sums, out=np.zeros_like(gravities), where=gravity_sums > 0)
+    closest_destination = sweep_parameters["closest_destination"]
+    destination_probabilities[:, closest_destination] = 0.0
+    destination_probabilities[0, closest_destination] = in_radius[0, closest_destination]
+    return destination_probabilities
+
+
+def sweep_path_contributions(path_trie: PathTrie, destination_distances, destination_probabilities, closest_destination_distance, origin_weight, sweep_parameters):
+    """
+    Returns the betweenness contribution of every path in `path_trie` (rows) under every parameter set (columns),
+    weighted the same way `betweenness_exposure()` weights paths, among the paths within the set's detour ratio.
+    `destination_distances` and `destination_probabilities` have a row for every destination of the trie, in order.
+    """
+    path_counts = np.diff(path_trie.offsets)
+    path_columns = np.repeat(np.arange(path_counts.shape[0]), path_counts)
+    # the same tolerance as path enumeration, so a set gets the paths it would have enumerated on its own.
+    within_detour = (path_trie.path_weights[:, None] - destination_distances[path_columns][:, None] * sweep_parameters["detour_ratio"][None, :]) <= 0.00001
+    # This fixes numerical issues  when path length = 0
+    path_weights = np.maximum(path_trie.path_weights, 0.01)[:, None]
+    beta = sweep_parameters["beta"][None, :]
+
+    path_detour_penalties = within_detour * np.where(
+        sweep_parameters["exponent_penalty"][None, :],
+        np.exp(-beta * path_weights),
+        np.where(sweep_parameters["power_penalty"][None, :], 1.0 / (path_weights ** 2.0), 1.0),
+    )
+    # penalties are normalized among the paths of each destination.
+    reached = path_counts > 0
+    penalty_sums = np.ones((path_counts.shape[0], beta.shape[1]))
+    if reached.any():
+        penalty_sums[reached] = np.add.reduceat(path_detour_penalties, path_trie.offsets[:-1][reached], axis=0)
+    path_sums = penalty_sums[path_columns]
+    path_probabilities = np.divide(path_detour_penalties, path_sums, out=np.zeros_like(path_detour_penalties), where=path_sums > 0)
+
+    path_decays = np.where(
+        sweep_parameters["decay"][None, :],
+        np.where(sweep_parameters["power_decay"][None, :], 1.0 / (path_weights ** 2.0), np.exp(-beta * closest_destination_distance)),
+        1.0,
+    )
+    return destination_probabilities[path_columns] * path_probabilities * path_decays * origin_weight
+
+
+def betweenness_sweep_worker(
+    self: Zonal,
+    core_index=None,
+    origin_queue=None,
+    search_radius=1000,
+    detour_ratio=1.05,
+    turn_penalty=False,
+    sweep_parameters=None,
+    destination_weights=None,
+    worker_memory_budget=512,
+    checkpoint: Checkpoint = None,
+):
+    """
+    Worker of `paralell_betweenness_sweep()`: enumerates the paths of every origin it gets from `origin_queue` once,
+    within `search_radius` and `detour_ratio`, the largest of all sets, and adds their betweenness under every
+    parameter set to an edge by parameter set array.
+    """
+    edge_gdf = self.network.edges
+    node_gdf = self.network.nodes
+    edge_positions = self.network.edge_positions()
+    set_count = sweep_parameters["beta"].shape[0]
+    batch_betweenness_tracker = np.zeros((edge_gdf.shape[0], set_count), dtype=np.float64)
+
+    memory_budget = worker_memory_budget * 1024 ** 2
+    initial_chunk_size = 100
+    path_bytes_per_scope_node = None
+
+    processed_origins = []
+    while True:
+        if (checkpoint is not None) and (len(processed_origins) > 0) and checkpoint.due():
+            checkpoint.save({"origin_ids": processed_origins, "edge_betweenness": sparse_delta(batch_betweenness_tracker)})
+            batch_betweenness_tracker[:] = 0
+            processed_origins = []
+
+        origin_idx = origin_queue.get()
+        if origin_idx == "done":
+            break
+        processed_origins.append(origin_idx)
+
+        try:
+            origin_weight = node_gdf.at[origin_idx, "weight"]
+            if origin_weight == 0:
+                continue
+
+            o_graph = self.network.virtual_node_graph(self.network.d_graph, origin_idx)
+            d_idxs, o_scope, o_scope_paths = turn_o_scope(
+                network=self.network,
+                o_idx=origin_idx,
+                search_radius=search_radius,
+                detour_ratio=detour_ratio,
+                turn_penalty=turn_penalty,
+                o_graph=o_graph,
+                return_paths=True
+            )
+            if len(d_idxs) == 0:
+                continue
+
+            d_idxs = dict(sorted(d_idxs.items(), key=lambda item: item[1]))
+            destination_ids = np.array(list(d_idxs.keys()))
+            destination_distances = np.array(list(d_idxs.values()), dtype=np.float64)
+            destination_probabilities = sweep_destination_probabilities(
+                destination_distances,
+                destination_weights.loc[destination_ids].to_numpy(),
+                sweep_parameters,
+            )
+            # only destinations some parameter set sends trips to are searched.
+            searched = np.flatnonzero(destination_probabilities.any(axis=1))
+            # the scope's edges, shared by the searches of all chunks
+            scope_graph = ScopeGraph(origin_idx, o_graph, o_scope)
+        except Exception as ex:
+            print (f"CORE: {core_index}: [betweenness_sweep_worker]: error finding destinations for origin {origin_idx = }, {len(processed_origins) = }, skipping origin")
+            print(str(ex))
+            traceback.print_exc()
+            continue
+
+        chunk_start = 0
+        chunk_size = None
+        path_bytes_per_destination = None
+        while chunk_start < searched.shape[0]:
+            if path_bytes_per_destination is not None:
+                chunk_size = destination_chunk_size(memory_budget, len(o_scope), path_bytes_per_destination, max_chunk_size=2 * chunk_size)
+            elif path_bytes_per_scope_node is not None:
+                chunk_size = destination_chunk_size(memory_budget, len(o_scope), path_bytes_per_scope_node * len(o_scope))
+            else:
+                chunk_size = destination_chunk_size(memory_budget, len(o_scope), 0, max_chunk_size=initial_chunk_size)
+            chunk = searched[chunk_start:chunk_start + chunk_size]
+            chunk_start += chunk_size
+            try:
+                d_idx_chunck = {destination_ids[position]: destination_distances[position] for position in chunk}
+                scope_nodes, distance_matrix, _ = bfs_subgraph_generation(
+                    o_idx=origin_idx,
+                    detour_ratio=detour_ratio,
+                    o_graph=o_graph,
+                    d_idxs=d_idx_chunck,
+                    o_scope=o_scope,
+                    o_scope_paths=o_scope_paths,
+                    scope_graph=scope_graph,
+                )
+                path_trie = wandering_messenger(
+                    network=self.network,
+                    o_graph=o_graph,
+                    o_idx=origin_idx,
+                    d_idxs={d_idx: distance * detour_ratio for d_idx, distance in d_idx_chunck.items()},
+                    distance_matrix=distance_matrix,
+                    turn_penalty=turn_penalty,
+                    od_scope=scope_nodes
+                )
+                path_contributions = sweep_path_contributions(
+                    path_trie,
+                    destination_distances[chunk],
+                    destination_probabilities[chunk],
+                    destination_distances[0],
+                    origin_weight,
+                    sweep_parameters,
+                )
+                trie_edge_ids, trie_edge_betweenness = path_trie.edge_sums(path_contributions)
+                trie_edge_positions = edge_positions[trie_edge_ids]
+                for set_index in range(set_count):
+                    batch_betweenness_tracker[:, set_index] += np.bincount(trie_edge_positions, weights=trie_edge_betweenness[:, set_index], minlength=edge_gdf.shape[0])
+
+                # contributions take memory with paths, one value per parameter set.
+                path_bytes_per_destination = (path_trie.nbytes + path_contributions.nbytes) / chunk.shape[0]
+                path_bytes_per_scope_node = path_bytes_per_destination / len(o_scope)
+            except Exception as ex:
+                print (f"CORE: {core_index}: [betweenness_sweep_worker]: error assigning path betweenness for origin {origin_idx = }, {len(processed_origins) = }, skipping destination chunck")
+                print(str(ex))
+                traceback.print_exc()
+                continue
+
+    return {"origin_ids": processed_origins, "edge_betweenness": sparse_delta(batch_betweenness_tracker)}
+
+
+def paralell_betweenness_sweep(
+    self: Zonal,
+    parameter_sets,
+    search_radius=1000,
+    detour_ratio=1.05,
+    turn_penalty=False,
+    num_cores=4,
+    worker_memory_budget=512,
+    checkpoint_directory=None,
+    checkpoint_interval=60,
+    pool: ComputePool = None,
+):
+    """
+    Runs `betweenness_sweep_worker()` on all origins, and returns an array of edge betweenness, with a row for every
+    edge of the network and a column for every parameter set. `search_radius` and `detour_ratio` are used by sets
+    that don't have their own.
+    """
+    node_gdf = self.network.nodes
+    edge_gdf = self.network.edges
+    origins = node_gdf[node_gdf["type"] == "origin"]
+    num_procs = num_cores if pool is None else pool.num_cores
+
+    sweep_parameters = sweep_parameter_arrays(parameter_sets, search_radius, detour_ratio)
+    destination_weights = sweep_destination_weights(self, parameter_sets)
+    # paths are searched once, for the set that reaches furthest.
+    search_radius = sweep_parameters["search_radius"].max()
+    detour_ratio = sweep_parameters["detour_ratio"].max()
+    origin_costs = estimate_origin_costs(self.network, origins.index, search_radius, detour_ratio=detour_ratio)
+
+    def submit_workers(executor, scheduler, shared_zonal):
+        return [
+            executor.submit(
+                betweenness_sweep_worker,
+                self=shared_zonal,
+                core_index=core_index,
+                origin_queue=scheduler,
+                search_radius=search_radius,
+                detour_ratio=detour_ratio,
+                turn_penalty=turn_penalty,
+                sweep_parameters=sweep_parameters,
+                destination_weights=destination_weights,
+                worker_memory_budget=worker_memory_budget,
+                checkpoint=checkpoint,
+            ) for core_index in range(scheduler.num_workers)
+        ]
+
+    checkpoint_parameters = {
+        "function": "betweenness_sweep",
+        "search_radius": search_radius,
+        "detour_ratio": detour_ratio,
+        "turn_penalty": turn_penalty,
+        "parameter_sets": parameter_sets,
+        "origin_count": origins.shape[0],
+        "edge_count": edge_gdf.shape[0],
+    }
+    edge_betweenness = np.zeros((edge_gdf.shape[0], sweep_parameters["beta"].shape[0]), dtype=np.float64)
+
+    def merge_part(part):
+        add_sparse_delta(edge_betweenness, part["edge_betweenness"])
+        return
+
+    with Checkpoint(checkpoint_directory, parameters=checkpoint_parameters, interval=checkpoint_interval) as checkpoint:
+        run_workers(
+            self,
+            origins.index,
+            origin_costs,
+            num_procs,
+            submit_workers,
+            checkpoint,
+            merge_part,
+            pool=pool
+        )
+
+    return edge_betweenness
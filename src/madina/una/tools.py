@@ -1,11 +1,16 @@
+from __future__ import annotations
 import math
 import numpy as np
+import pandas as pd
 import geopandas as gpd
 
 from shapely import GeometryCollection
 from .paths import turn_o_scope, path_generator
 from .betweenness import paralell_betweenness_exposure, parallel_access
-from ..zonal import Zonal
+from .sweep import paralell_betweenness_sweep, SWEEP_PARAMETERS
+from .instrumentation import Instrumentation
+from .contributions import ContributionMatrix
+from ..zonal import Zonal, ComputePool
 
 def validate_zonal_ready(zonal: Zonal):
     if not isinstance(zonal, Zonal):
@@ -31,6 +36,62 @@ def validate_zonal_ready(zonal: Zonal):
         raise ValueError("Zonal object does not have a d_graph, call zonal..create_graph() to create graphs first.")
     return
 
+def validate_pool(zonal: Zonal, pool: ComputePool):
+    if pool is None:
+        return
+
+    if not isinstance(pool, ComputePool):
+        raise TypeError(f"Parameter 'pool' must be {ComputePool}. {type(pool)} was given.")
+
+    if pool.zonal is not zonal:
+        raise ValueError("Parameter 'pool': was created for another zonal object, create a pool with zonal.compute_pool()")
+    return
+
+
+def validate_checkpoint(checkpoint_directory: str, checkpoint_interval: float):
+    if (checkpoint_directory is not None) and (not isinstance(checkpoint_directory, str)):
+        raise TypeError(f"Parameter 'checkpoint_directory' must be a string. {type(checkpoint_directory)} was given.")
+
+    if not isinstance(checkpoint_interval, (int, float)):
+        raise TypeError(f"Parameter 'checkpoint_interval' must be either {int, float}. {type(checkpoint_interval)} was given.")
+    elif checkpoint_interval < 0:
+        raise ValueError(f"Parameter 'checkpoint_interval': Cannot be negative. checkpoint_interval={checkpoint_interval} was given.")
+    return
+
+
+def validate_sweep_parameter_sets(zonal: Zonal, parameter_sets):
+    if not isinstance(parameter_sets, list) or (len(parameter_sets) == 0) or not all(isinstance(parameter_set, dict) for parameter_set in parameter_sets):
+        raise TypeError(f"Parameter 'parameter_sets' must be a non-empty list of dicts. {type(parameter_sets)} was given.")
+
+    node_gdf = zonal.network.nodes
+    destination_layers = node_gdf[node_gdf["type"] == "destination"]["source_layer"].unique()
+    for parameter_set in parameter_sets:
+        for key, value in parameter_set.items():
+            if key not in SWEEP_PARAMETERS:
+                raise ValueError(f"Parameter 'parameter_sets': '{key}' cannot be swept, keys must be in {list(SWEEP_PARAMETERS)}. {parameter_set} was given.")
+            if (key == "search_radius") and (value is not None) and (not isinstance(value, (int, float)) or value < 0):
+                raise ValueError(f"Parameter 'parameter_sets': 'search_radius' must be a non-negative number. {parameter_set} was given.")
+            if (key == "detour_ratio") and (value is not None) and (not isinstance(value, (int, float)) or value < 1):
+                raise ValueError(f"Parameter 'parameter_sets': 'detour_ratio' must be a number no less than 1. {parameter_set} was given.")
+            if (key == "beta") and (not isinstance(value, (int, float)) or value < 0):
+                raise ValueError(f"Parameter 'parameter_sets': 'beta' must be a non-negative number. {parameter_set} was given.")
+            if (key in ["decay", "closest_destination"]) and (not isinstance(value, bool)):
+                raise TypeError(f"Parameter 'parameter_sets': '{key}' must either be a boolean True or False. {parameter_set} was given.")
+            if (key == "decay_method") and (value not in ["exponent", "power"]):
+                raise ValueError(f"Parameter 'parameter_sets': 'decay_method' must be one of ['exponent', 'power']. {parameter_set} was given.")
+            if (key == "path_detour_penalty") and (value not in ["equal", "power", "exponent"]):
+                raise ValueError(f"Parameter 'parameter_sets': 'path_detour_penalty' must be one of ['equal', 'power', 'exponent']. {parameter_set} was given.")
+            if (key == "destination_weight") and (value is not None):
+                for layer_name in destination_layers:
+                    if value not in zonal[layer_name].gdf.columns:
+                        raise ValueError(f"Parameter 'parameter_sets': 'destination_weight' '{value}' not in layer {layer_name}'s columns. options are: {list(zonal[layer_name].gdf.columns)}")
+    return
+
+
+def validate_instrumentation(instrumentation: Instrumentation):
+    if (instrumentation is not None) and (not isinstance(instrumentation, Instrumentation)):
+        raise TypeError(f"Parameter 'instrumentation' must be {Instrumentation}. {type(instrumentation)} was given.")
+    return
 
 
 def accessibility(
@@ -49,6 +110,10 @@ def accessibility(
     save_closest_facility_distance_as: str = None, 
     turn_penalty: bool = False,
     num_cores: int = 1,
+    checkpoint_directory: str = None,
+    checkpoint_interval: float = 60,
+    instrumentation: Instrumentation = None,
+    pool: ComputePool = None,
 ) -> None:
     """Measures accessibility metrics like reach and gravity to reachable destinations within a search radius to all origins in the network. 
 
@@ -82,6 +147,14 @@ def accessibility(
     :type turn_penalty: bool, optional
     :param num_cores: By default, only use a single core, set to as many cores as you want to use for running parallel calculations., defaults to 1
     :type num_cores: int, optional
+    :param checkpoint_directory: A directory where workers save the origins they finished every `checkpoint_interval` seconds. Calling again with the same directory and parameters resumes an interrupted run, skipping finished origins. Nothing is saved when not provided: origins of a worker that dies are all handed to other workers, and the run cannot be resumed, defaults to None
+    :type checkpoint_directory: str, optional
+    :param checkpoint_interval: Seconds between checkpoints of each worker, defaults to 60
+    :type checkpoint_interval: float, optional
+    :param instrumentation: An `Instrumentation` that collects counters (nodes in scope, heap pushes, paths enumerated, pruned branches, ...) and stage timers of every origin from all workers. Look at `instrumentation.origin_table()` and `instrumentation.summary()` after the call. Nothing is collected when not provided, defaults to None
+    :type instrumentation: Instrumentation, optional
+    :param pool: A pool of workers kept alive across calls, created by `zonal.compute_pool()`. When provided, its workers are used instead of starting `num_cores` new ones, and only what changed since the previous call is sent to them, defaults to None
+    :type pool: ComputePool, optional
     """    
     node_gdf = zonal.network.nodes
     origin_gdf = node_gdf[node_gdf["type"] == "origin"]
@@ -163,6 +236,10 @@ def accessibility(
     if not isinstance(turn_penalty, bool):
         raise TypeError(f"Parameter 'turn_penalty' must either be a boolean True or False, {type(turn_penalty)} was given.")
 
+    validate_checkpoint(checkpoint_directory, checkpoint_interval)
+    validate_instrumentation(instrumentation)
+    validate_pool(zonal, pool)
+
     
     parallel_access(
         zonal,
@@ -175,6 +252,10 @@ def accessibility(
         closest_facility=closest_facility,
         turn_penalty=turn_penalty,
         num_cores=num_cores,
+        checkpoint_directory=checkpoint_directory,
+        checkpoint_interval=checkpoint_interval,
+        instrumentation=instrumentation,
+        pool=pool,
     )
 
 
@@ -301,21 +382,16 @@ def service_area(
     for o_idx in o_idxs:
 
         
-        zonal.network.add_node_to_graph(o_graph, o_idx)
-
-
         d_idxs, o_scope, o_scope_paths = turn_o_scope(
             network=zonal.network,
             o_idx=o_idx,
             search_radius=search_radius,
             detour_ratio=1.00, 
             turn_penalty=turn_penalty,
-            o_graph=o_graph,
+            o_graph=zonal.network.virtual_node_graph(o_graph, o_idx),
             return_paths=False
         )
 
-        zonal.network.remove_node_to_graph(o_graph, o_idx)
-
         if (len(d_idxs)) == 0:
             continue
 
@@ -452,8 +528,17 @@ def betweenness(
     save_gravity_as: str = None,
     save_elastic_weight_as: str = None,
     keep_diagnostics: bool = False, 
-    path_exposure_attribute: str = None,
-    save_path_exposure_as: str = None,
+    path_exposure_attribute: str | list[str] = None,
+    save_path_exposure_as: str | list[str] = None,
+    stream_paths: bool = False,
+    chunking_method: str = "concentric",
+    worker_memory_budget: float = 512,
+    checkpoint_directory: str = None,
+    checkpoint_interval: float = 60,
+    instrumentation: Instrumentation = None,
+    path_record_directory: str = None,
+    contribution_matrix_file: str = None,
+    pool: ComputePool = None,
 ):
     """Generate trips between origins and destinations along network segment, accounting for a search radius, decay, detour, destination competition, turn penalty and elastic trip generation.
 
@@ -461,7 +546,7 @@ def betweenness(
     :type zonal: Zonal
     :param search_radius: The maximum distance to search for reachable destinatations. In the same unit as the network CRS.
     :type search_radius: float
-    :param detour_ratio: A percentage of detour over the shortest path between an origin and a destination when allocating trips across alternative paths. Defaults to 1 and only allocate trips along the shortest path. Must be greater than or equal to one. if set to a large number, could result in severe performance issues and memory overflow
+    :param detour_ratio: A percentage of detour over the shortest path between an origin and a destination when allocating trips across alternative paths. Defaults to 1 and only allocate trips along the shortest path, then betweenness is accumulated over shortest paths without enumerating them, unless `turn_penalty`, `path_exposure_attribute` or `path_record_directory` is provided. Must be greater than or equal to one. if set to a large number, could result in severe performance issues and memory overflow
     :type detour_ratio: float, optional
     :param decay: If ennabled, trip generation is decayed according to the chosen decay function and beta parameter, defaults to False
     :type decay: bool, optional
@@ -489,12 +574,30 @@ def betweenness(
     :type save_gravity_as: str, optional
     :param save_elastic_weight_as: specify a name for the column in the origin layer where the KNN-adjusted origin weight is stored, defaults to None
     :type save_elastic_weight_as: str, optional
-    :param keep_diagnostics: If set to true, store performance and memory statistics in the network, defaults to False
+    :param keep_diagnostics: If set to true, store performance and memory statistics of every origin, as collected by `Instrumentation`, in the origin layer, in columns named after `save_betweenness_as` (or "betweenness") and the statistic, defaults to False
     :type keep_diagnostics: bool, optional
-    :param path_exposure_attribute: If provided, calculates an exposure to a network value for trips originatinbg from an origin en route to destinations, defaults to None
-    :type path_exposure_attribute: str, optional 
-    :param save_path_exposure_as: if path exposure attribute is proviided, this is a name for a column in the origin layer that captures origin's exposure to the network exposure attribute, defaults to None
-    :type save_path_exposure_as: str, optional
+    :param path_exposure_attribute: If provided, calculates an exposure to a network value for trips originatinbg from an origin en route to destinations. A list of attributes computes exposure to each of them from the same paths, defaults to None
+    :type path_exposure_attribute: str | list[str], optional 
+    :param save_path_exposure_as: if path exposure attribute is proviided, this is a name for a column in the origin layer that captures origin's exposure to the network exposure attribute. When `path_exposure_attribute` is a list, a list of names, one for each attribute, defaults to None
+    :type save_path_exposure_as: str | list[str], optional
+    :param stream_paths: If set to true, paths are not kept in memory: they are enumerated twice, once to find path probabilities and once to add betweenness to network segments. Memory stays flat however many paths there are, at the cost of enumerating paths twice. Useful with large detour ratios. Ignored when `path_exposure_attribute` or `path_record_directory` is provided, defaults to False
+    :type stream_paths: bool, optional
+    :param chunking_method: How an origin's destinations are grouped into chunks that are searched one at a time, to keep memory within `worker_memory_budget`. One of ["concentric", "random", "pizza", "none"]: "concentric" chunks destinations from the closest to the furthest, "random" chunks them in random order, "pizza" chunks them clockwise around the origin, and "none" searches all destinations at once, ignoring the budget, defaults to "concentric"
+    :type chunking_method: str, optional
+    :param worker_memory_budget: Memory, in megabytes, each worker can use to search an origin's destinations. Chunk sizes adapt to fit the budget, from the number of nodes in the origin's search scope and the memory paths took in previous chunks, defaults to 512
+    :type worker_memory_budget: float, optional
+    :param checkpoint_directory: A directory where workers save the origins they finished every `checkpoint_interval` seconds. Calling again with the same directory and parameters resumes an interrupted run, skipping finished origins. Nothing is saved when not provided: origins of a worker that dies are all handed to other workers, and the run cannot be resumed, defaults to None
+    :type checkpoint_directory: str, optional
+    :param checkpoint_interval: Seconds between checkpoints of each worker, defaults to 60
+    :type checkpoint_interval: float, optional
+    :param instrumentation: An `Instrumentation` that collects counters (nodes in scope, heap pushes, paths enumerated, pruned branches, ...) and stage timers of every origin from all workers. Look at `instrumentation.origin_table()` and `instrumentation.summary()` after the call. Nothing is collected when not provided, defaults to None
+    :type instrumentation: Instrumentation, optional
+    :param path_record_directory: A directory where workers write a record of every path they route trips along: its origin, destination, path id, length, decay, probability, betweenness, exposure and edge ids. Records are streamed to parquet files as they are found, so they don't need to fit in memory, read them with `read_path_records()`, optionally with path geometries. The directory can't have path records of another run, unless it is resumed with its `checkpoint_directory`. Paths are not streamed when provided, see `stream_paths`. Needs `pyarrow`, installed with `pip install madina[path_records]`, defaults to None
+    :type path_record_directory: str, optional
+    :param contribution_matrix_file: A `.npz` file where a `ContributionMatrix` is saved: what every origin adds to the betweenness of every network edge for a unit origin weight. Load it with `ContributionMatrix.load()` to get flows under other origin weights without searching paths again, or the origins that load an edge. Zero weight origins are routed too when provided, defaults to None
+    :type contribution_matrix_file: str, optional
+    :param pool: A pool of workers kept alive across calls, created by `zonal.compute_pool()`. When provided, its workers are used instead of starting `num_cores` new ones, and only what changed since the previous call is sent to them, defaults to None
+    :type pool: ComputePool, optional
     """
 
     validate_zonal_ready(zonal)
@@ -578,21 +681,55 @@ def betweenness(
 
 
     if path_exposure_attribute is not None:
-        if not isinstance(path_exposure_attribute, str):
-            raise TypeError(f"Parameter 'path_exposure_attribute' must be a string. {type(path_exposure_attribute)} was given.")
+        exposure_attributes = [path_exposure_attribute] if isinstance(path_exposure_attribute, str) else path_exposure_attribute
+        if not isinstance(exposure_attributes, list) or (len(exposure_attributes) == 0) or not all(isinstance(attribute, str) for attribute in exposure_attributes):
+            raise TypeError(f"Parameter 'path_exposure_attribute' must be a string or a non-empty list of strings. {type(path_exposure_attribute)} was given.")
         
-        if path_exposure_attribute not in zonal[zonal.network.edge_source_layer].gdf.columns:
-            raise ValueError(f"Parameter 'path_exposure_attribute' not in layer {zonal.network.edge_source_layer}'s columns. options are: {list(zonal[zonal.network.edge_source_layer].gdf.columns)}")
+        for attribute in exposure_attributes:
+            if attribute not in zonal[zonal.network.edge_source_layer].gdf.columns:
+                raise ValueError(f"Parameter 'path_exposure_attribute': '{attribute}' not in layer {zonal.network.edge_source_layer}'s columns. options are: {list(zonal[zonal.network.edge_source_layer].gdf.columns)}")
 
     if save_path_exposure_as is not None:
-        if not isinstance(save_path_exposure_as, str):
-            raise TypeError(f"Parameter 'save_path_exposure_as' must be a string. {type(save_path_exposure_as)} was given.")
         if path_exposure_attribute is None:
             raise ValueError(f"Parameter 'path_exposure_attribute' must be provided if `save_path_exposure_as` is provided")
+        if isinstance(path_exposure_attribute, str):
+            if not isinstance(save_path_exposure_as, str):
+                raise TypeError(f"Parameter 'save_path_exposure_as' must be a string. {type(save_path_exposure_as)} was given.")
+        elif not isinstance(save_path_exposure_as, list) or not all(isinstance(name, str) for name in save_path_exposure_as):
+            raise TypeError(f"Parameter 'save_path_exposure_as' must be a list of strings when 'path_exposure_attribute' is a list. {type(save_path_exposure_as)} was given.")
+        elif len(save_path_exposure_as) != len(path_exposure_attribute):
+            raise ValueError(f"Parameter 'save_path_exposure_as' must have a name for each attribute in 'path_exposure_attribute', {len(save_path_exposure_as)} names were given for {len(path_exposure_attribute)} attributes.")
+
+    if not isinstance(stream_paths, bool):
+        raise TypeError(f"Parameter 'stream_paths' must either be a boolean True or False, {type(stream_paths)} was given.")
+
+    if chunking_method not in ["concentric", "random", "pizza", "none"]:
+        if not isinstance(chunking_method, str):
+            raise TypeError(f"Parameter 'chunking_method' must be a string. {type(chunking_method)} was given.")
+        else:
+            raise ValueError(f"Parameter 'chunking_method': must be one of ['concentric', 'random', 'pizza', 'none']. chunking_method={chunking_method} was given.")
+
+    if not isinstance(worker_memory_budget, (int, float)):
+        raise TypeError(f"Parameter 'worker_memory_budget' must be either {int, float}. {type(worker_memory_budget)} was given.")
+    elif worker_memory_budget <= 0:
+        raise ValueError(f"Parameter 'worker_memory_budget': Must be positive. worker_memory_budget={worker_memory_budget} was given.")
+
+    validate_checkpoint(checkpoint_directory, checkpoint_interval)
+    validate_instrumentation(instrumentation)
+    validate_pool(zonal, pool)
+
+    if (path_record_directory is not None) and (not isinstance(path_record_directory, str)):
+        raise TypeError(f"Parameter 'path_record_directory' must be a string. {type(path_record_directory)} was given.")
+
+    if (contribution_matrix_file is not None) and (not isinstance(contribution_matrix_file, str)):
+        raise TypeError(f"Parameter 'contribution_matrix_file' must be a string. {type(contribution_matrix_file)} was given.")
 
     zonal.network.knn_weight = knn_weight
     zonal.network.knn_plateau = knn_plateau
 
+    if keep_diagnostics and (instrumentation is None):
+        instrumentation = Instrumentation()
+
     betweenness_output = paralell_betweenness_exposure(
         zonal,
         search_radius=search_radius,
@@ -606,27 +743,33 @@ def betweenness(
         elastic_weight=elastic_weight,
         turn_penalty=turn_penalty,
         path_exposure_attribute=path_exposure_attribute,
-        return_path_record=False, 
+        return_path_record=path_record_directory is not None, 
         destniation_cap=None, 
+        stream_paths=stream_paths,
+        chunking_method=chunking_method,
+        worker_memory_budget=worker_memory_budget,
+        checkpoint_directory=checkpoint_directory,
+        checkpoint_interval=checkpoint_interval,
+        instrumentation=instrumentation,
+        path_record_directory=path_record_directory,
+        return_contribution_matrix=contribution_matrix_file is not None,
+        pool=pool,
     )
 
+    if contribution_matrix_file is not None:
+        betweenness_output["contribution_matrix"].save(contribution_matrix_file)
+
     if save_betweenness_as is not None:
         edge_layer_name = zonal.network.edge_source_layer
         edge_gdf = zonal.network.edges
 
-        # if the name is already a column, drop it to avoid 'GeoDataFrame cannot contain duplicated column names' error.
-        if save_betweenness_as in zonal[edge_layer_name].gdf.columns:
-            zonal[edge_layer_name].gdf.drop(columns=[save_betweenness_as], inplace=True)
-
-        zonal[edge_layer_name].gdf = zonal[edge_layer_name].gdf.join(
-        edge_gdf[['parent_street_id', 'betweenness']].drop_duplicates(subset='parent_street_id').set_index('parent_street_id')).rename(
-        columns={"betweenness": save_betweenness_as})
-
-        #TODO: The index became a float after te join, probably due to the type of 'parent_street_id' in the edge gdf.
-        zonal[edge_layer_name].gdf.index = zonal[edge_layer_name].gdf.index.astype(int)
+        zonal[edge_layer_name].gdf[save_betweenness_as] = zonal.network.edge_values_to_streets(
+            edge_gdf['betweenness'].values,
+            zonal[edge_layer_name].gdf.index.values
+        )
 
 
-    if (save_reach_as is not None) or (save_gravity_as is not None) or (save_elastic_weight_as is not None): 
+    if (save_reach_as is not None) or (save_gravity_as is not None) or (save_elastic_weight_as is not None) or (save_path_exposure_as is not None) or keep_diagnostics:
         origin_gdf = betweenness_output['origin_gdf']
         origin_layer = origin_gdf.iloc[0]['source_layer']
 
@@ -641,7 +784,11 @@ def betweenness(
             saved_attributes['knn_weight'] = save_elastic_weight_as
         
         if (save_path_exposure_as is not None) and (path_exposure_attribute is not None):
-            saved_attributes['expected_hazzard_meters'] = save_path_exposure_as
+            if isinstance(path_exposure_attribute, str):
+                saved_attributes['expected_hazzard_meters'] = save_path_exposure_as
+            else:
+                for attribute, name in zip(path_exposure_attribute, save_path_exposure_as):
+                    saved_attributes[f'expected_hazzard_meters_{attribute}'] = name
 
         for key, value in saved_attributes.items():
             origin_gdf[key] = origin_gdf[key].fillna(0)
@@ -651,9 +798,10 @@ def betweenness(
 
         
         if keep_diagnostics:
+            origin_gdf = origin_gdf.join(betweenness_output["origin_instrumentation"])
             for column_name in origin_gdf.columns:
                 if (column_name not in saved_attributes.keys()) and (column_name not in ["source_id"]):
-                    saved_attributes[column_name] = save_betweenness_as + "_" + column_name
+                    saved_attributes[column_name] = ("betweenness" if save_betweenness_as is None else save_betweenness_as) + "_" + column_name
                     if saved_attributes[column_name] in zonal[origin_layer].gdf.columns:
                         zonal[origin_layer].gdf.drop(columns=[saved_attributes[column_name]], inplace=True)
             zonal[origin_layer].gdf = zonal[origin_layer].gdf.join(origin_gdf.drop(columns=['geometry']).set_index("source_id").rename(columns=saved_attributes))
@@ -664,3 +812,226 @@ def betweenness(
     return
 
 
+
+def betweenness_sweep(
+    zonal: Zonal,
+    search_radius: float,
+    parameter_sets: list[dict],
+    detour_ratio: float = 1,
+    turn_penalty: bool = False,
+    num_cores: int = 1,
+    save_betweenness_as: list[str] = None,
+    worker_memory_budget: float = 512,
+    checkpoint_directory: str = None,
+    checkpoint_interval: float = 60,
+    pool: ComputePool = None,
+) -> np.ndarray:
+    """Runs `betweenness()` for several parameter sets at once. Paths depend only on the network, `search_radius`, `detour_ratio` and `turn_penalty`, so they are enumerated once per origin, and weighted under every parameter set in one pass, instead of searching again for each set. Useful for calibrating `beta`, decay and destination weights. Sets can also have their own search radius and detour ratio: paths are then enumerated once, at the largest of each, and each set only keeps destinations within its search radius and paths within its detour ratio.
+
+    :param zonal: A zonal object populated with a network, origins, destinations and a graph
+    :type zonal: Zonal
+    :param search_radius: The maximum distance to search for reachable destinatations, for sets that don't have their own. In the same unit as the network CRS.
+    :type search_radius: float
+    :param parameter_sets: A list of parameter sets, each a dict with any of the keys "search_radius", "detour_ratio", "beta", "decay", "decay_method", "path_detour_penalty" (one of ['equal', 'power', 'exponent']), "closest_destination" and "destination_weight" (a column of the destination layer to weigh destinations with, instead of the weight they were inserted with). Missing keys take the defaults of `betweenness()`, and the `search_radius` and `detour_ratio` of the sweep. For instance [{"beta": 0.001}, {"beta": 0.002}, {"beta": 0.002, "decay": True}, {"search_radius": 400, "detour_ratio": 1.1}]
+    :type parameter_sets: list[dict]
+    :param detour_ratio: A percentage of detour over the shortest path between an origin and a destination when allocating trips across alternative paths, for sets that don't have their own, defaults to 1
+    :type detour_ratio: float, optional
+    :param turn_penalty: If True, turn penalty is enabled, defaults to False
+    :type turn_penalty: bool, optional
+    :param num_cores: number of cores to use, defaults to 1
+    :type num_cores: int, optional
+    :param save_betweenness_as: A name for every parameter set, to save its betweenness as a column of the network's street layer, defaults to None
+    :type save_betweenness_as: list[str], optional
+    :param worker_memory_budget: Memory, in megabytes, each worker can use to search an origin's destinations, see `betweenness()`. Paths take more memory as they carry a value for every parameter set, defaults to 512
+    :type worker_memory_budget: float, optional
+    :param checkpoint_directory: A directory to checkpoint the sweep to, see `betweenness()`, defaults to None
+    :type checkpoint_directory: str, optional
+    :param checkpoint_interval: Seconds between checkpoints of each worker, defaults to 60
+    :type checkpoint_interval: float, optional
+    :param pool: A pool of workers kept alive across calls, created by `zonal.compute_pool()`, defaults to None
+    :type pool: ComputePool, optional
+    :return: An array of betweenness with a row for every edge of `zonal.network.edges` and a column for every parameter set
+    :rtype: np.ndarray
+    """
+    validate_zonal_ready(zonal)
+
+    if not isinstance(search_radius, (int, float)):
+        raise TypeError(f"Parameter 'search_radius' must be either {int, float}. {type(search_radius)} was given.")
+    elif search_radius < 0:
+        raise ValueError(f"Parameter 'search_radius': Cannot be negative. search_radius={search_radius} was given.")
+
+    if not isinstance(detour_ratio, (int, float)):
+        raise TypeError(f"Parameter 'detour_ratio' must be either {int, float}. {type(detour_ratio)} was given.")
+    elif detour_ratio < 1:
+        raise ValueError(f"Parameter 'detour_ratio': Cannot be less than 1. detour_ratio={detour_ratio} was given.")
+
+    if not isinstance(turn_penalty, bool):
+        raise TypeError(f"Parameter 'turn_penalty' must either be a boolean True or False, {type(turn_penalty)} was given.")
+
+    validate_sweep_parameter_sets(zonal, parameter_sets)
+
+    if save_betweenness_as is not None:
+        if not isinstance(save_betweenness_as, list) or not all(isinstance(name, str) for name in save_betweenness_as):
+            raise TypeError(f"Parameter 'save_betweenness_as' must be a list of strings. {type(save_betweenness_as)} was given.")
+        if len(save_betweenness_as) != len(parameter_sets):
+            raise ValueError(f"Parameter 'save_betweenness_as' must have a name for every parameter set, {len(save_betweenness_as)} names were given for {len(parameter_sets)} parameter sets.")
+
+    if not isinstance(worker_memory_budget, (int, float)):
+        raise TypeError(f"Parameter 'worker_memory_budget' must be either {int, float}. {type(worker_memory_budget)} was given.")
+    elif worker_memory_budget <= 0:
+        raise ValueError(f"Parameter 'worker_memory_budget': Must be positive. worker_memory_budget={worker_memory_budget} was given.")
+
+    validate_checkpoint(checkpoint_directory, checkpoint_interval)
+    validate_pool(zonal, pool)
+
+    edge_betweenness = paralell_betweenness_sweep(
+        zonal,
+        parameter_sets,
+        search_radius=search_radius,
+        detour_ratio=detour_ratio,
+        turn_penalty=turn_penalty,
+        num_cores=num_cores,
+        worker_memory_budget=worker_memory_budget,
+        checkpoint_directory=checkpoint_directory,
+        checkpoint_interval=checkpoint_interval,
+        pool=pool,
+    )
+
+    if save_betweenness_as is not None:
+        edge_layer_name = zonal.network.edge_source_layer
+        for set_index, name in enumerate(save_betweenness_as):
+            zonal[edge_layer_name].gdf[name] = zonal.network.edge_values_to_streets(
+                edge_betweenness[:, set_index],
+                zonal[edge_layer_name].gdf.index.values
+            )
+    return edge_betweenness
+
+
+def betweenness_update(
+    zonal: Zonal,
+    contribution_matrix: ContributionMatrix | str,
+    modified_edge_ids: list,
+    num_cores: int = 1,
+    save_betweenness_as: str = None,
+    contribution_matrix_file: str = None,
+    worker_memory_budget: float = 512,
+    checkpoint_directory: str = None,
+    checkpoint_interval: float = 60,
+    instrumentation: Instrumentation = None,
+    pool: ComputePool = None,
+) -> ContributionMatrix:
+    """Updates betweenness after edges of `zonal.network.edges` change, for instance a street closure or a new link, by only recomputing the origins the change can affect, instead of running `betweenness()` again for every origin. Those origins are found from the search scopes kept in the contribution matrix of the previous run, their previous contributions are taken off edge betweenness, and their new ones added. Origins are recomputed with the parameters of the run the matrix was made with, and betweenness is weighted with its origin weights.
+
+    Edges can change weight (set it to `np.inf` to close an edge), be removed from `zonal.network.edges`, or be added to it between existing nodes. Origins and destinations on an edge whose weight changed keep their place along it. Edges with origins or destinations on them can't be removed, close them instead. The network's graph is rebuilt from `zonal.network.edges`.
+
+    :param zonal: A zonal object with the network the contribution matrix was made with, with edges changed since
+    :type zonal: Zonal
+    :param contribution_matrix: The contribution matrix of the previous run, or the file it was saved to, see `betweenness()`'s `contribution_matrix_file`
+    :type contribution_matrix: ContributionMatrix | str
+    :param modified_edge_ids: Ids of edges that changed weight, were removed or were added since the matrix was made
+    :type modified_edge_ids: list
+    :param num_cores: number of cores to use, defaults to 1
+    :type num_cores: int, optional
+    :param save_betweenness_as: A name to save updated betweenness as a column of the network's street layer, defaults to None
+    :type save_betweenness_as: str, optional
+    :param contribution_matrix_file: A `.npz` file to save the updated contribution matrix to, for later updates, defaults to None
+    :type contribution_matrix_file: str, optional
+    :param worker_memory_budget: Memory, in megabytes, each worker can use to search an origin's destinations, see `betweenness()`, defaults to 512
+    :type worker_memory_budget: float, optional
+    :param checkpoint_directory: A directory to checkpoint recomputed origins to, see `betweenness()`, defaults to None
+    :type checkpoint_directory: str, optional
+    :param checkpoint_interval: Seconds between checkpoints of each worker, defaults to 60
+    :type checkpoint_interval: float, optional
+    :param instrumentation: An `Instrumentation` that collects counters and stage timers of every recomputed origin, see `betweenness()`. `instrumentation.origin_table()` has a row for every origin affected by the change, defaults to None
+    :type instrumentation: Instrumentation, optional
+    :param pool: A pool of workers kept alive across calls, created by `zonal.compute_pool()`, defaults to None
+    :type pool: ComputePool, optional
+    :return: The updated contribution matrix, on the changed edges
+    :rtype: ContributionMatrix
+    :Example:
+        >>> una.betweenness(cambridge, search_radius=800, detour_ratio=1.15, contribution_matrix_file="contributions.npz")
+        >>> cambridge.network.edges.loc[closed_edge_ids, "weight"] = np.inf
+        >>> contribution_matrix = una.betweenness_update(cambridge, "contributions.npz", closed_edge_ids, save_betweenness_as="closure_flow")
+    """
+    validate_zonal_ready(zonal)
+
+    if isinstance(contribution_matrix, str):
+        contribution_matrix = ContributionMatrix.load(contribution_matrix)
+    elif not isinstance(contribution_matrix, ContributionMatrix):
+        raise TypeError(f"Parameter 'contribution_matrix' must be a {ContributionMatrix} or a file name. {type(contribution_matrix)} was given.")
+
+    if isinstance(modified_edge_ids, (int, np.integer)) or not all(isinstance(edge_id, (int, np.integer)) for edge_id in modified_edge_ids):
+        raise TypeError("Parameter 'modified_edge_ids' must be a list of edge ids.")
+    modified_edge_ids = np.asarray(list(modified_edge_ids), dtype=np.int64)
+
+    if (save_betweenness_as is not None) and (not isinstance(save_betweenness_as, str)):
+        raise TypeError(f"Parameter 'save_betweenness_as' must be a string. {type(save_betweenness_as)} was given.")
+
+    if (contribution_matrix_file is not None) and (not isinstance(contribution_matrix_file, str)):
+        raise TypeError(f"Parameter 'contribution_matrix_file' must be a string. {type(contribution_matrix_file)} was given.")
+
+    validate_checkpoint(checkpoint_directory, checkpoint_interval)
+    validate_instrumentation(instrumentation)
+    validate_pool(zonal, pool)
+
+    node_gdf = zonal.network.nodes
+    edge_gdf = zonal.network.edges
+    origin_gdf = node_gdf[node_gdf["type"] == "origin"]
+    if not np.array_equal(np.sort(origin_gdf.index.values.astype(np.int64)), np.sort(contribution_matrix.origin_ids)):
+        raise ValueError("Parameter 'contribution_matrix': was made with other origins than the ones in the zonal's network.")
+
+    inserted = (node_gdf["type"] != "street_node").values
+    removed_edge_ids = np.setdiff1d(np.intersect1d(modified_edge_ids, contribution_matrix.edge_ids), edge_gdf.index.values)
+    if np.isin(node_gdf["nearest_edge_id"].values[inserted], removed_edge_ids).any():
+        raise ValueError("Parameter 'modified_edge_ids': edges with origins or destinations on them can't be removed, set their weight to np.inf to close them instead.")
+
+    # origins and destinations on an edge keep their place along it when its weight changes. On a closed edge, they
+    # keep their distances so the edge can be reopened, its fragments are unreachable anyway.
+    changed_edge_ids = edge_gdf.index[edge_gdf.index.isin(modified_edge_ids) & edge_gdf.index.isin(contribution_matrix.edge_ids)]
+    on_changed_edges = inserted & node_gdf["nearest_edge_id"].isin(changed_edge_ids).values
+    node_edge_weights = edge_gdf["weight"].reindex(node_gdf["nearest_edge_id"].values[on_changed_edges]).values.astype(np.float64)
+    weights_to_start = node_gdf["weight_to_start"].values[on_changed_edges].astype(np.float64)
+    weights_to_end = node_gdf["weight_to_end"].values[on_changed_edges].astype(np.float64)
+    node_edge_lengths = weights_to_start + weights_to_end
+    rescaled = np.isfinite(node_edge_weights) & (node_edge_lengths > 0)
+    new_weights_to_start = np.divide(weights_to_start, node_edge_lengths, out=np.zeros_like(weights_to_start), where=rescaled) * np.where(rescaled, node_edge_weights, 0)
+    node_gdf.loc[on_changed_edges, "weight_to_start"] = np.where(rescaled, new_weights_to_start, weights_to_start)
+    node_gdf.loc[on_changed_edges, "weight_to_end"] = np.where(rescaled, np.where(rescaled, node_edge_weights, 0) - new_weights_to_start, weights_to_end)
+
+    zonal.network.create_graph(light_graph=True, od_graph=zonal.network.od_graph is not None, engine=zonal.network.graph_engine)
+
+    affected_origins = contribution_matrix.affected_origins(modified_edge_ids, edge_gdf, node_gdf)
+
+    parameters = dict(contribution_matrix.parameters)
+    zonal.network.knn_weight = parameters.pop("knn_weight", None)
+    zonal.network.knn_plateau = parameters.pop("knn_plateau", 0)
+    if affected_origins.shape[0] > 0:
+        betweenness_output = paralell_betweenness_exposure(
+            zonal,
+            **parameters,
+            num_cores=num_cores,
+            worker_memory_budget=worker_memory_budget,
+            checkpoint_directory=checkpoint_directory,
+            checkpoint_interval=checkpoint_interval,
+            return_contribution_matrix=True,
+            origin_ids=affected_origins,
+            instrumentation=instrumentation,
+            pool=pool,
+        )
+        origin_contribution_matrix = betweenness_output["contribution_matrix"]
+    else:
+        origin_contribution_matrix = ContributionMatrix.from_rows([], origin_gdf.iloc[:0], edge_gdf)
+
+    contribution_matrix, edge_betweenness = contribution_matrix.update(origin_contribution_matrix)
+    edge_gdf["betweenness"] = edge_betweenness
+
+    if save_betweenness_as is not None:
+        edge_layer_name = zonal.network.edge_source_layer
+        zonal[edge_layer_name].gdf[save_betweenness_as] = zonal.network.edge_values_to_streets(
+            edge_betweenness,
+            zonal[edge_layer_name].gdf.index.values
+        )
+
+    if contribution_matrix_file is not None:
+        contribution_matrix.save(contribution_matrix_file)
+    return contribution_matrix
@@ -18,7 +18,7 @@ import shapely.geometry as geo
 from datetime import datetime
 from pydeck.types import String
 from pathlib import Path
-from .tools import betweenness, accessibility
+from .tools import betweenness, accessibility, betweenness_sweep
 from ..zonal import Zonal, VERSION, RELEASE_DATE
 
 class Logger():
@@ -286,12 +286,33 @@ class Logger():
         r.to_html(file_name)
         return r
 
+def radius_detour_group(pairings: pd.DataFrame, pairing_idx):
+    """
+    Returns the indices of the pairing at `pairing_idx` and the pairings right after it that only differ from it in
+    'Radius', 'Detour' and 'Flow_Name', so their flows come from one path search. Pairings with elastic weights or an
+    exposure attribute are not grouped, as `betweenness_sweep()` doesn't estimate them.
+    """
+    def sweepable(pairing):
+        has_exposure = ('Exposure_Attribute' in pairing.index) and pd.notna(pairing['Exposure_Attribute'])
+        return (not pairing['Elastic_Weights']) and (not has_exposure)
+
+    shared_columns = [column for column in pairings.columns if column not in ['Radius', 'Detour', 'Flow_Name']]
+    group = [pairing_idx]
+    if not sweepable(pairings.loc[pairing_idx]):
+        return group
+    for next_idx in pairings.index[pairings.index.get_loc(pairing_idx) + 1:]:
+        if not pairings.loc[next_idx, shared_columns].equals(pairings.loc[pairing_idx, shared_columns]):
+            break
+        group.append(next_idx)
+    return group
+
 def betweenness_flow_simulation(
         city_name=None,
         data_folder=None,
         output_folder=None,
         pairings_file="pairings.csv",
         num_cores=8,
+        sweep_radius_detour=False,
     ) -> None:
     """A workflow to generate trips between pairs of origins and destonations along a network. for detailed description of the workflow, please reference this page: https://madinadocs.readthedocs.io/en/latest/ped_flow.html to learn more about preparing data and constructing a pairing table needed for this workflow
 
@@ -305,6 +326,8 @@ def betweenness_flow_simulation(
     :type pairings_file: str, optional
     :param num_cores: the number of cores to be used in multiprocessing to speed up the simulation, defaults to 8
     :type num_cores: int, optional
+    :param sweep_radius_detour: If set to true, consecutive pairings that only differ in 'Radius' and 'Detour' are estimated together by `betweenness_sweep()`: paths are searched once at the largest radius and detour, and filtered for the others. Origin records of these pairings don't have reach, gravity or diagnostics, defaults to False
+    :type sweep_radius_detour: bool, optional
     """
     
 
@@ -332,88 +355,122 @@ def betweenness_flow_simulation(
     logger.log(f"network FIle Loaded, Projection: {shaqra.layers['streets'].gdf.crs}")
 
 
-    for pairing_idx, pairing in pairings.iterrows():
+    # workers stay alive across pairings, and keep the street network as long as it doesn't change.
+    with shaqra.compute_pool(num_cores=num_cores) as pool:
+        swept_pairings = set()
+        for pairing_idx, pairing in pairings.iterrows():
+            # already estimated with an earlier pairing of the same radius and detour sweep.
+            if pairing_idx in swept_pairings:
+                continue
+
+            # Setting up a street network if this is the first pairing, or if the network weight changed from previous pairing
+            if (pairing_idx == 0) or (pairings.at[pairing_idx, 'Network_Cost'] != pairings.at[pairing_idx-1, 'Network_Cost']):
+                shaqra.create_street_network(
+                    source_layer='streets', 
+                    node_snapping_tolerance=0.00001,  #todo: remove parameter once a finalized default is set.
+                    weight_attribute=pairings.at[pairing_idx, 'Network_Cost'] if pairings.at[pairing_idx, 'Network_Cost'] != "Geometric" else None
+                )
+                logger.log("network topology created", pairing)
+                clean_network_nodes = shaqra.network.nodes.copy(deep=True)
+            else:
+                # either generate a new network, or flush nodes.
+                shaqra.network.nodes = clean_network_nodes.copy(deep=True)
 
-        # Setting up a street network if this is the first pairing, or if the network weight changed from previous pairing
-        if (pairing_idx == 0) or (pairings.at[pairing_idx, 'Network_Cost'] != pairings.at[pairing_idx-1, 'Network_Cost']):
-            shaqra.create_street_network(
-                source_layer='streets', 
-                node_snapping_tolerance=0.00001,  #todo: remove parameter once a finalized default is set.
-                weight_attribute=pairings.at[pairing_idx, 'Network_Cost'] if pairings.at[pairing_idx, 'Network_Cost'] != "Geometric" else None
+            shaqra.set_turn_parameters(
+                turn_penalty_amount=pairing['Turn_Penalty'], 
+                turn_threshold_degree=pairing['Turn_Threshold'],
             )
-            logger.log("network topology created", pairing)
-            clean_network_nodes = shaqra.network.nodes.copy(deep=True)
-        else:
-            # either generate a new network, or flush nodes.
-            shaqra.network.nodes = clean_network_nodes.copy(deep=True)
-
-        shaqra.set_turn_parameters(
-            turn_penalty_amount=pairing['Turn_Penalty'], 
-            turn_threshold_degree=pairing['Turn_Threshold'],
-        )
 
 
-        # Loading layers, if they're not already loaded.
-        if pairing["Origin_Name"] not in shaqra.layers:
-            shaqra.load_layer(
-                name=pairing["Origin_Name"],
-                source=os.path.join(data_folder, pairing["Origin_File"])
-            )
-            logger.log(f"{pairing['Origin_Name']} file {pairing['Origin_File']} Loaded, Projection: {shaqra.layers[pairing['Origin_Name']].gdf.crs}", pairing)
+            # Loading layers, if they're not already loaded.
+            if pairing["Origin_Name"] not in shaqra.layers:
+                shaqra.load_layer(
+                    name=pairing["Origin_Name"],
+                    source=os.path.join(data_folder, pairing["Origin_File"])
+                )
+                logger.log(f"{pairing['Origin_Name']} file {pairing['Origin_File']} Loaded, Projection: {shaqra.layers[pairing['Origin_Name']].gdf.crs}", pairing)
 
-        if pairing["Destination_Name"] not in shaqra.layers:
-            shaqra.load_layer(
-                name=pairing["Destination_Name"],
-                source=os.path.join(data_folder, pairing["Destination_File"])
-            )
-            logger.log(f"{pairing['Destination_Name']} file {pairing['Destination_File']} Loaded, Projection: {shaqra.layers[pairing['Destination_Name']].gdf.crs}", pairing)
+            if pairing["Destination_Name"] not in shaqra.layers:
+                shaqra.load_layer(
+                    name=pairing["Destination_Name"],
+                    source=os.path.join(data_folder, pairing["Destination_File"])
+                )
+                logger.log(f"{pairing['Destination_Name']} file {pairing['Destination_File']} Loaded, Projection: {shaqra.layers[pairing['Destination_Name']].gdf.crs}", pairing)
 
         
 
-        shaqra.insert_node(
-            layer_name=pairing['Origin_Name'], 
-            label='origin', 
-            weight_attribute=pairing['Origin_Weight'] if pairing['Origin_Weight'] != "Count" else None
-        )
-        shaqra.insert_node(
-            layer_name=pairing['Destination_Name'], 
-            label='destination', 
-            weight_attribute=pairing['Destination_Weight'] if pairing['Destination_Weight'] != "Count" else None
-        )
+            shaqra.insert_node(
+                layer_name=pairing['Origin_Name'], 
+                label='origin', 
+                weight_attribute=pairing['Origin_Weight'] if pairing['Origin_Weight'] != "Count" else None
+            )
+            shaqra.insert_node(
+                layer_name=pairing['Destination_Name'], 
+                label='destination', 
+                weight_attribute=pairing['Destination_Weight'] if pairing['Destination_Weight'] != "Count" else None
+            )
 
-        logger.log("Origins and Destinations Inserted.", pairing)
-
-        shaqra.create_graph()
-
-        logger.log("NetworkX Graphs Created.", pairing)
-
-
-
-        betweenness(
-            zonal=shaqra,
-            search_radius=pairing['Radius'],
-            detour_ratio=pairing['Detour'],
-            decay=False if pairing['Elastic_Weights'] else pairing['Decay'],  # elastic weight already reduces origin weight factoring in decay. if this pairing uses elastic weights, don't decay again,,
-            decay_method=pairing['Decay_Mode'],
-            beta=pairing['Beta'],
-            num_cores=min(shaqra[pairing['Origin_Name']].gdf.shape[0], num_cores),
-            closest_destination=pairing['Closest_destination'],
-            elastic_weight=pairing['Elastic_Weights'],
-            knn_weight=pairing['KNN_Weight'],
-            knn_plateau=pairing['Plateau'], 
-            turn_penalty=pairing['Turns'],
-            save_betweenness_as=pairing['Flow_Name'], 
-            save_reach_as='reach_'+pairing['Flow_Name'], 
-            save_gravity_as='gravity_'+pairing['Flow_Name'],
-            save_elastic_weight_as='elastic_weight_'+pairing['Flow_Name'] if pairing['Elastic_Weights'] else None,
-            keep_diagnostics=True, 
-            path_exposure_attribute=pairing['Exposure_Attribute']  if 'Exposure_Attribute' in pairing.index else None,
-            save_path_exposure_as="exposure_"+pairing['Flow_Name'] if 'Exposure_Attribute' in pairing.index else None,
-        )
+            logger.log("Origins and Destinations Inserted.", pairing)
+
+            shaqra.create_graph()
+
+            logger.log("NetworkX Graphs Created.", pairing)
+
+
+            sweep_group = radius_detour_group(pairings, pairing_idx) if sweep_radius_detour else [pairing_idx]
+            if len(sweep_group) > 1:
+                edge_betweenness = betweenness_sweep(
+                    zonal=shaqra,
+                    search_radius=float(pairing['Radius']),
+                    detour_ratio=float(pairing['Detour']),
+                    parameter_sets=[
+                        {
+                            "search_radius": float(pairings.at[group_idx, 'Radius']),
+                            "detour_ratio": float(pairings.at[group_idx, 'Detour']),
+                            "beta": float(pairing['Beta']),
+                            "decay": bool(pairing['Decay']),
+                            "decay_method": pairing['Decay_Mode'],
+                            "closest_destination": bool(pairing['Closest_destination']),
+                        } for group_idx in sweep_group
+                    ],
+                    turn_penalty=bool(pairing['Turns']),
+                    num_cores=min(shaqra[pairing['Origin_Name']].gdf.shape[0], num_cores),
+                    save_betweenness_as=[pairings.at[group_idx, 'Flow_Name'] for group_idx in sweep_group],
+                    pool=pool,
+                )
+                logger.log(f"Betweenness estimated for {len(sweep_group)} radius and detour pairings.", pairing)
+                for set_index, group_idx in enumerate(sweep_group):
+                    shaqra.network.edges['betweenness'] = edge_betweenness[:, set_index]
+                    logger.pairing_end(shaqra, pairings.loc[group_idx])
+                swept_pairings.update(sweep_group)
+                continue
+
+            betweenness(
+                zonal=shaqra,
+                search_radius=pairing['Radius'],
+                detour_ratio=pairing['Detour'],
+                decay=False if pairing['Elastic_Weights'] else pairing['Decay'],  # elastic weight already reduces origin weight factoring in decay. if this pairing uses elastic weights, don't decay again,,
+                decay_method=pairing['Decay_Mode'],
+                beta=pairing['Beta'],
+                num_cores=min(shaqra[pairing['Origin_Name']].gdf.shape[0], num_cores),
+                closest_destination=pairing['Closest_destination'],
+                elastic_weight=pairing['Elastic_Weights'],
+                knn_weight=pairing['KNN_Weight'],
+                knn_plateau=pairing['Plateau'], 
+                turn_penalty=pairing['Turns'],
+                save_betweenness_as=pairing['Flow_Name'], 
+                save_reach_as='reach_'+pairing['Flow_Name'], 
+                save_gravity_as='gravity_'+pairing['Flow_Name'],
+                save_elastic_weight_as='elastic_weight_'+pairing['Flow_Name'] if pairing['Elastic_Weights'] else None,
+                keep_diagnostics=True, 
+                path_exposure_attribute=pairing['Exposure_Attribute']  if 'Exposure_Attribute' in pairing.index else None,
+                save_path_exposure_as="exposure_"+pairing['Flow_Name'] if 'Exposure_Attribute' in pairing.index else None,
+                pool=pool,
+            )
 
 
-        logger.log("Betweenness estimated.", pairing)
-        logger.pairing_end(shaqra, pairing)
+            logger.log("Betweenness estimated.", pairing)
+            logger.pairing_end(shaqra, pairing)
     logger.simulation_end(shaqra)
     return 
 
@@ -459,90 +516,93 @@ def KNN_accessibility(
 
 
 
-    for pairing_idx, pairing in pairings.iterrows():
-        if (pairing_idx == 0) or (pairings.at[pairing_idx, 'Network_File'] != pairings.at[pairing_idx-1, 'Network_File']):
-            shaqra.load_layer(
-                name='streets',
-                source=os.path.join(data_folder,  pairings.at[0, "Network_File"])
-            )
-            logger.log(f"network FIle Loaded, Projection: {shaqra.layers['streets'].gdf.crs}", pairing)
+    # workers stay alive across pairings, and keep the street network as long as it doesn't change.
+    with shaqra.compute_pool(num_cores=num_cores) as pool:
+        for pairing_idx, pairing in pairings.iterrows():
+            if (pairing_idx == 0) or (pairings.at[pairing_idx, 'Network_File'] != pairings.at[pairing_idx-1, 'Network_File']):
+                shaqra.load_layer(
+                    name='streets',
+                    source=os.path.join(data_folder,  pairings.at[0, "Network_File"])
+                )
+                logger.log(f"network FIle Loaded, Projection: {shaqra.layers['streets'].gdf.crs}", pairing)
 
 
-        if (pairing_idx == 0) or (pairings.at[pairing_idx, 'Network_Cost'] != pairings.at[pairing_idx-1, 'Network_Cost']) or (pairings.at[pairing_idx, 'Network_File'] != pairings.at[pairing_idx-1, 'Network_File']): 
-            shaqra.create_street_network(
-                source_layer='streets',
-                weight_attribute=pairings.at[pairing_idx, 'Network_Cost'] if pairings.at[pairing_idx, 'Network_Cost'] != "Geometric" else None,
-                node_snapping_tolerance=0.00001,  #todo: remove parameter once a finalized default is set.
-                redundant_edge_treatment='discard',
-            )
-            logger.log("network topology created", pairing)
-        else:
-            shaqra.clear_nodes()
+            if (pairing_idx == 0) or (pairings.at[pairing_idx, 'Network_Cost'] != pairings.at[pairing_idx-1, 'Network_Cost']) or (pairings.at[pairing_idx, 'Network_File'] != pairings.at[pairing_idx-1, 'Network_File']): 
+                shaqra.create_street_network(
+                    source_layer='streets',
+                    weight_attribute=pairings.at[pairing_idx, 'Network_Cost'] if pairings.at[pairing_idx, 'Network_Cost'] != "Geometric" else None,
+                    node_snapping_tolerance=0.00001,  #todo: remove parameter once a finalized default is set.
+                    redundant_edge_treatment='discard',
+                )
+                logger.log("network topology created", pairing)
+            else:
+                shaqra.clear_nodes()
 
 
 
-        # Loading layers, if they're not already loaded.
-        if pairing["Origin_Name"] not in shaqra.layers:
-            shaqra.load_layer(
-                name=pairing["Origin_Name"],
-                source=os.path.join(data_folder, pairing["Origin_File"])
-            )
-            logger.log(f"{pairing['Origin_Name']} file {pairing['Origin_File']} Loaded, Projection: {shaqra.layers[pairing['Origin_Name']].gdf.crs}", pairing)
+            # Loading layers, if they're not already loaded.
+            if pairing["Origin_Name"] not in shaqra.layers:
+                shaqra.load_layer(
+                    name=pairing["Origin_Name"],
+                    source=os.path.join(data_folder, pairing["Origin_File"])
+                )
+                logger.log(f"{pairing['Origin_Name']} file {pairing['Origin_File']} Loaded, Projection: {shaqra.layers[pairing['Origin_Name']].gdf.crs}", pairing)
 
 
-        if pairing["Destination_Name"] not in shaqra.layers:
-            shaqra.load_layer(
-                name=pairing["Destination_Name"],
-                source=os.path.join(data_folder, pairing["Destination_File"])
-            )
-            logger.log(f"{pairing['Destination_Name']} file {pairing['Destination_File']} Loaded, Projection: {shaqra.layers[pairing['Destination_Name']].gdf.crs}", pairing)
+            if pairing["Destination_Name"] not in shaqra.layers:
+                shaqra.load_layer(
+                    name=pairing["Destination_Name"],
+                    source=os.path.join(data_folder, pairing["Destination_File"])
+                )
+                logger.log(f"{pairing['Destination_Name']} file {pairing['Destination_File']} Loaded, Projection: {shaqra.layers[pairing['Destination_Name']].gdf.crs}", pairing)
 
         
 
-        shaqra.insert_node(
-            layer_name=pairing['Origin_Name'], 
-            label='origin', 
-            weight_attribute=pairing['Origin_Weight'] if pairing['Origin_Weight'] != "Count" else None
-        )
-        shaqra.insert_node(
-            layer_name=pairing['Destination_Name'], 
-            label='destination', 
-            weight_attribute=pairing['Destination_Weight'] if pairing['Destination_Weight'] != "Count" else None
-        )
-
-        logger.log("Origins and Destinations Inserted.", pairing)
-        shaqra.create_graph()
-        logger.log("NetworkX Graphs Created.", pairing)
-
-        if pairing['Turns']:
-            shaqra.set_turn_parameters(
-                turn_penalty_amount=pairing['Turn_Penalty'], 
-                turn_threshold_degree=pairing['Turn_Threshold'],
+            shaqra.insert_node(
+                layer_name=pairing['Origin_Name'], 
+                label='origin', 
+                weight_attribute=pairing['Origin_Weight'] if pairing['Origin_Weight'] != "Count" else None
+            )
+            shaqra.insert_node(
+                layer_name=pairing['Destination_Name'], 
+                label='destination', 
+                weight_attribute=pairing['Destination_Weight'] if pairing['Destination_Weight'] != "Count" else None
             )
 
-        accessibility(
-            zonal=shaqra,
-            search_radius=pairing['Radius'],
-            destination_weight = None,
-            alpha=1,
-            beta=pairing['Beta'], 
-            save_reach_as=pairing['Flow_Name']+"_reach", 
-            save_gravity_as=pairing['Flow_Name']+"_gravity",
-            knn_weights=pairing['KNN_Weight'],
-            knn_plateau=pairing['Plateau'],
-            save_knn_access_as=pairing['Flow_Name']+"_knn_access",
-            closest_facility = False,
-            save_closest_facility_as=None, 
-            save_closest_facility_distance_as=None, 
-            turn_penalty=pairing['Turns'],
-            num_cores=num_cores,
-        )
+            logger.log("Origins and Destinations Inserted.", pairing)
+            shaqra.create_graph()
+            logger.log("NetworkX Graphs Created.", pairing)
+
+            if pairing['Turns']:
+                shaqra.set_turn_parameters(
+                    turn_penalty_amount=pairing['Turn_Penalty'], 
+                    turn_threshold_degree=pairing['Turn_Threshold'],
+                )
+
+            accessibility(
+                zonal=shaqra,
+                search_radius=pairing['Radius'],
+                destination_weight = None,
+                alpha=1,
+                beta=pairing['Beta'], 
+                save_reach_as=pairing['Flow_Name']+"_reach", 
+                save_gravity_as=pairing['Flow_Name']+"_gravity",
+                knn_weights=pairing['KNN_Weight'],
+                knn_plateau=pairing['Plateau'],
+                save_knn_access_as=pairing['Flow_Name']+"_knn_access",
+                closest_facility = False,
+                save_closest_facility_as=None, 
+                save_closest_facility_distance_as=None, 
+                turn_penalty=pairing['Turns'],
+                num_cores=num_cores,
+                pool=pool,
+            )
 
-        # Save the origin layer.
+            # Save the origin layer.
     
-        Path(logger.output_folder).mkdir(parents=True, exist_ok=True)
-        shaqra[pairing['Origin_Name']].gdf.to_csv(os.path.join(logger.output_folder, "origin_record.csv"))
-        logger.log("accissibility calculated.", pairing)    
+            Path(logger.output_folder).mkdir(parents=True, exist_ok=True)
+            shaqra[pairing['Origin_Name']].gdf.to_csv(os.path.join(logger.output_folder, "origin_record.csv"))
+            logger.log("accissibility calculated.", pairing)    
 
     shaqra[pairing['Origin_Name']].gdf['total_knn_access']= shaqra[pairing['Origin_Name']].gdf[[flow_name+"_knn_access" for flow_name in pairings['Flow_Name']]].sum(axis=1)
     total_knn_access = shaqra[pairing['Origin_Name']].gdf['total_knn_access']
@@ -2,3 +2,5 @@ from .zonal import *
 from .layer import *
 from .network import *
 from .network_utils import *
+from .graph import *
+from .shared import *
@@ -0,0 +1,581 @@
+import math
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+import networkx as nx
+
+
+class CSRGraph:
+    """
+    An undirected, weighted graph stored in compressed sparse row (CSR) form: for node `n`, its neighbors,
+    edge weights and edge ids are `neighbors[offsets[n]:offsets[n+1]]`, `weights[...]` and `edge_ids[...]`.
+    Node ids are used directly as array positions, so the network's integer node index maps to the arrays with
+    no lookup table.
+
+    Internal class, meant to represent `Network.light_graph`. A `CSRGraph` is immutable, edits (inserting origins
+    and destinations) go to an `OverlayGraph` on top of it, see `overlay()`.
+    """
+
+    def __init__(self, offsets: np.ndarray, neighbors: np.ndarray, weights: np.ndarray, edge_ids: np.ndarray):
+        self.offsets = offsets
+        self.neighbors_array = neighbors
+        self.weights = weights
+        self.edge_ids = edge_ids
+        self.node_count = offsets.shape[0] - 1
+        self.graph = {}
+        return
+
+    @classmethod
+    def from_slots(cls, sources, targets, weights, edge_ids, node_count: int):
+        """
+        Builds a graph from directed adjacency entries (slots), every undirected edge must be given in both
+        directions. The adjacency of each node keeps the order in which its slots were given.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        order = np.argsort(sources, kind="stable")
+        offsets = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=node_count), out=offsets[1:])
+        return cls(
+            offsets,
+            np.asarray(targets, dtype=np.int64)[order],
+            np.asarray(weights, dtype=np.float64)[order],
+            np.asarray(edge_ids, dtype=np.int64)[order]
+        )
+
+    @classmethod
+    def from_edges(cls, starts, ends, weights, edge_ids, node_count: int = None):
+        """
+        Builds a graph from parallel arrays describing each edge. Mirrors `nx.Graph.add_edge` semantics: a repeated
+        (start, end) pair keeps the position of its first occurrence and the weight and id of its last, and a looped
+        edge is listed once in its node's adjacency.
+
+        Args:
+            starts: start node of each edge
+            ends: end node of each edge
+            weights: weight of each edge
+            edge_ids: id of each edge
+            node_count: size of the node id space, defaults to the largest node id + 1
+
+        Returns:
+            a `CSRGraph`
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        edge_ids = np.asarray(edge_ids, dtype=np.int64)
+
+        if node_count is None:
+            node_count = int(max(starts.max(initial=-1), ends.max(initial=-1))) + 1
+
+        # collapse repeated node pairs: position of the first occurrence, attributes of the last.
+        low = np.minimum(starts, ends)
+        high = np.maximum(starts, ends)
+        pair_keys = low * node_count + high
+        _, first, inverse = np.unique(pair_keys, return_index=True, return_inverse=True)
+        last = np.zeros(first.shape[0], dtype=np.int64)
+        last[inverse] = np.arange(pair_keys.shape[0])
+        order = np.argsort(first, kind="stable")
+        first = first[order]
+        last = last[order]
+
+        return cls.from_slots(*edge_slots(starts[first], ends[first], weights[last], edge_ids[last]), node_count=node_count)
+
+    def __contains__(self, node):
+        return (0 <= node < self.node_count) and (self.offsets[node + 1] > self.offsets[node])
+
+    def __str__(self):
+        return f"CSRGraph with {self.node_count:,} node slots and {self.neighbors_array.shape[0]:,} adjacency entries"
+
+    def _check_node(self, node):
+        # node ids are array positions: an id out of range, or of a node without edges, would read another node's
+        # row instead of failing like a networkx graph does.
+        if node not in self:
+            raise KeyError(f"node {node} is not in the graph")
+
+    def _adjacency(self, node):
+        start = self.offsets[node]
+        end = self.offsets[node + 1]
+        return zip(self.neighbors_array[start:end].tolist(), self.weights[start:end].tolist(), self.edge_ids[start:end].tolist())
+
+    def neighbor_edges(self, node):
+        """
+        Returns a list of (neighbor, weight, edge_id) tuples for all edges adjacent to `node`
+        """
+        self._check_node(node)
+        return list(self._adjacency(node))
+
+    def neighbors(self, node):
+        """
+        Returns a list of neighbors of `node`
+        """
+        self._check_node(node)
+        return self.neighbors_array[self.offsets[node]:self.offsets[node + 1]].tolist()
+
+    def neighbor_count(self, node):
+        """
+        Returns the number of distinct neighbors of `node`, a looped edge counts once.
+        """
+        self._check_node(node)
+        return int(self.offsets[node + 1] - self.offsets[node])
+
+    def nodes(self):
+        """
+        Returns an array of all nodes that have at least one edge.
+        """
+        return np.flatnonzero(np.diff(self.offsets))
+
+    def overlay(self):
+        """
+        Returns an empty, editable `OverlayGraph` on top of this graph. The arrays are shared, not copied.
+        """
+        return OverlayGraph(self)
+
+    def copy(self):
+        """
+        Returns an editable copy of this graph. As the arrays are never modified, this is an `OverlayGraph` that
+        shares them.
+        """
+        graph = self.overlay()
+        graph.graph = copy_graph_attributes(self.graph)
+        return graph
+
+    def to_networkx(self):
+        """
+        Returns an equivalent `NetworkXGraph`, handy for visualization and for tools that expect NetworkX.
+        """
+        graph = NetworkXGraph()
+        for node in self.nodes().tolist():
+            for neighbor, weight, edge_id in self.neighbor_edges(node):
+                graph.add_edge(node, neighbor, weight=weight, id=edge_id)
+        graph.graph.update(self.graph)
+        return graph
+
+
+class OverlayGraph:
+    """
+    An editable view of an immutable `CSRGraph` (the base street graph). Inserted origin/destination nodes and the
+    edge fragments they split off live in a delta on top of the base:
+        - `layer`: an optional `CSRGraph` holding the full adjacency of every node touched by a bulk insertion (the
+          inserted nodes, and the ends of the edges they split). Built once by `from_fragments`, and shared between
+          copies.
+        - `patches`: {node: {neighbor: (weight, edge_id)}} for nodes edited afterwards (e.g. inserting an origin),
+          copied out of the layer or the base on first edit (copy-on-write). None marks a removed node.
+    Lookups check `patches`, then `layer`, then `base`, so copies of a graph only duplicate their patches.
+    """
+
+    def __init__(self, base: CSRGraph, layer: CSRGraph = None, layer_nodes: np.ndarray = None):
+        self.base = base
+        self.layer = layer
+        # boolean mask of nodes whose adjacency is held by `layer`
+        self.layer_nodes = layer_nodes
+        self.node_count = base.node_count
+        self.patches = {}
+        self.graph = {}
+        return
+
+    @classmethod
+    def from_fragments(cls, base: CSRGraph, split_edge_ids, starts, ends, weights, edge_ids):
+        """
+        Builds an overlay where the base edges with ids in `split_edge_ids` are replaced by the given edge fragments.
+
+        Args:
+            base: the base graph
+            split_edge_ids: ids of the base edges that got split by inserted nodes
+            starts, ends, weights, edge_ids: parallel arrays, one entry per fragment.
+
+        Returns:
+            an `OverlayGraph`
+        """
+        fragment_sources, fragment_targets, fragment_weights, fragment_edge_ids = edge_slots(starts, ends, weights, edge_ids)
+        touched = np.zeros(base.node_count, dtype=bool)
+        touched[fragment_sources] = True
+
+        # the remaining base adjacency of touched nodes, minus the slots of split edges.
+        base_sources = np.repeat(np.arange(base.node_count), np.diff(base.offsets))
+        kept = touched[base_sources] & ~np.isin(base.edge_ids, split_edge_ids)
+
+        layer = CSRGraph.from_slots(
+            np.concatenate([base_sources[kept], fragment_sources]),
+            np.concatenate([base.neighbors_array[kept], fragment_targets]),
+            np.concatenate([base.weights[kept], fragment_weights]),
+            np.concatenate([base.edge_ids[kept], fragment_edge_ids]),
+            node_count=base.node_count
+        )
+        return cls(base, layer, touched)
+
+    def _source(self, node):
+        # the immutable graph that holds the adjacency of node
+        if (self.layer is not None) and (0 <= node < self.node_count) and self.layer_nodes[node]:
+            return self.layer
+        return self.base
+
+    def __contains__(self, node):
+        if node in self.patches:
+            return self.patches[node] is not None
+        return node in self._source(node)
+
+    def __str__(self):
+        layer_nodes = 0 if self.layer is None else int(self.layer_nodes.sum())
+        return f"OverlayGraph on {str(self.base)}, with {layer_nodes:,} inserted layer nodes and {len(self.patches):,} edited nodes"
+
+    def neighbor_edges(self, node):
+        """
+        Returns a list of (neighbor, weight, edge_id) tuples for all edges adjacent to `node`
+        """
+        if node in self.patches:
+            return [(neighbor, weight, edge_id) for neighbor, (weight, edge_id) in self._patched_adjacency(node).items()]
+        return self._source(node).neighbor_edges(node)
+
+    def neighbors(self, node):
+        """
+        Returns a list of neighbors of `node`
+        """
+        if node in self.patches:
+            return list(self._patched_adjacency(node))
+        return self._source(node).neighbors(node)
+
+    def neighbor_count(self, node):
+        """
+        Returns the number of distinct neighbors of `node`, a looped edge counts once.
+        """
+        if node in self.patches:
+            return len(self._patched_adjacency(node))
+        return self._source(node).neighbor_count(node)
+
+    def _patched_adjacency(self, node):
+        # removed nodes are patched with None.
+        adjacency = self.patches[node]
+        if adjacency is None:
+            raise KeyError(f"node {node} is not in the graph")
+        return adjacency
+
+    def nodes(self):
+        """
+        Returns an array of all nodes that have at least one edge.
+        """
+        has_edges = np.diff(self.base.offsets) > 0
+        if self.layer is not None:
+            has_edges = np.where(self.layer_nodes, np.diff(self.layer.offsets) > 0, has_edges)
+        nodes = set(np.flatnonzero(has_edges).tolist())
+        for node, adjacency in self.patches.items():
+            if adjacency is None:
+                nodes.discard(node)
+            else:
+                nodes.add(node)
+        return np.array(sorted(nodes), dtype=np.int64)
+
+    def _patch(self, node):
+        """
+        Copy-on-write: copies the adjacency of `node` out of the shared arrays before it gets edited.
+        """
+        if node not in self.patches:
+            if node in self._source(node):
+                self.patches[node] = {neighbor: (weight, edge_id) for neighbor, weight, edge_id in self._source(node).neighbor_edges(node)}
+            else:
+                self.patches[node] = {}
+        elif self.patches[node] is None:
+            self.patches[node] = {}
+        return self.patches[node]
+
+    def add_edge(self, u, v, weight=0.0, id=None):
+        u = int(u)
+        v = int(v)
+        self._patch(u)[v] = (float(weight), id)
+        self._patch(v)[u] = (float(weight), id)
+        return
+
+    def remove_edge(self, u, v):
+        u = int(u)
+        v = int(v)
+        if v not in self._patch(u):
+            raise nx.NetworkXError(f"The edge {u}-{v} is not in the graph")
+        del self.patches[u][v]
+        if u != v:
+            del self._patch(v)[u]
+        return
+
+    def remove_node(self, node):
+        node = int(node)
+        if node not in self:
+            raise nx.NetworkXError(f"The node {node} is not in the graph.")
+        for neighbor in self.neighbors(node):
+            if neighbor != node:
+                del self._patch(neighbor)[node]
+        self.patches[node] = None
+        return
+
+    def copy(self):
+        """
+        Returns an editable copy of this graph, sharing the base and layer arrays. Only the edited nodes are copied.
+        """
+        graph = OverlayGraph(self.base, self.layer, self.layer_nodes)
+        graph.patches = {node: (None if adjacency is None else dict(adjacency)) for node, adjacency in self.patches.items()}
+        graph.graph = copy_graph_attributes(self.graph)
+        return graph
+
+    def to_networkx(self):
+        """
+        Returns an equivalent `NetworkXGraph`, handy for visualization and for tools that expect NetworkX.
+        """
+        graph = NetworkXGraph()
+        for node in self.nodes().tolist():
+            for neighbor, weight, edge_id in self.neighbor_edges(node):
+                graph.add_edge(node, neighbor, weight=weight, id=edge_id)
+        graph.graph.update(self.graph)
+        return graph
+
+
+class NetworkXGraph(nx.Graph):
+    """
+    A NetworkX graph that exposes the same adjacency accessors as `CSRGraph`, so UNA tools could run on either engine.
+    """
+
+    def neighbor_edges(self, node):
+        """
+        Returns a list of (neighbor, weight, edge_id) tuples for all edges adjacent to `node`
+        """
+        return [(neighbor, data["weight"], data["id"]) for neighbor, data in self._adj[node].items()]
+
+    def neighbor_count(self, node):
+        """
+        Returns the number of distinct neighbors of `node`, a looped edge counts once.
+        """
+        return len(self._adj[node])
+
+
+class VirtualNodeGraph:
+    """
+    A read-only view of a graph with one extra node spliced into the edge fragment between two of its nodes, the same
+    way `Network.add_node_to_graph` would insert it, but without editing the graph. The view only holds the adjacency
+    of the three nodes involved, every other lookup goes to the viewed graph, so a view is cheap to make and any number
+    of them can share one graph. Made by `Network.virtual_node_graph`.
+    """
+
+    def __init__(self, graph, node, previous, previous_weight, following, following_weight, edge_id):
+        self.viewed_graph = graph
+        self.node = node
+        self.graph = graph.graph
+
+        adjacency = {}
+        for graph_node, other_end in ((previous, following), (following, previous)):
+            if graph_node not in adjacency:
+                adjacency[graph_node] = {neighbor: (weight, neighbor_edge_id) for neighbor, weight, neighbor_edge_id in graph.neighbor_edges(graph_node)}
+            adjacency[graph_node].pop(other_end, None)
+        adjacency[node] = {}
+        for start, end, weight in ((previous, node, previous_weight), (node, following, following_weight)):
+            adjacency[start][end] = (weight, edge_id)
+            adjacency[end][start] = (weight, edge_id)
+        self.adjacency = {graph_node: [(neighbor, weight, neighbor_edge_id) for neighbor, (weight, neighbor_edge_id) in node_adjacency.items()] for graph_node, node_adjacency in adjacency.items()}
+        return
+
+    def __contains__(self, node):
+        return (node in self.adjacency) or (node in self.viewed_graph)
+
+    def __str__(self):
+        return f"VirtualNodeGraph of node {self.node} on {str(self.viewed_graph)}"
+
+    def neighbor_edges(self, node):
+        """
+        Returns a list of (neighbor, weight, edge_id) tuples for all edges adjacent to `node`
+        """
+        if node in self.adjacency:
+            return self.adjacency[node]
+        return self.viewed_graph.neighbor_edges(node)
+
+    def neighbors(self, node):
+        """
+        Returns a list of neighbors of `node`
+        """
+        return [neighbor for neighbor, _, _ in self.neighbor_edges(node)]
+
+    def neighbor_count(self, node):
+        """
+        Returns the number of distinct neighbors of `node`, a looped edge counts once.
+        """
+        if node in self.adjacency:
+            return len(self.adjacency[node])
+        return self.viewed_graph.neighbor_count(node)
+
+
+class EdgeChainIndex:
+    """
+    For every edge that has inserted nodes, keeps them sorted by their offset along the edge (distance from the
+    edge's end node): {edge_id: ([offsets], [nodes])}. Inserted nodes split their edge into a chain following this
+    order, so inserting or removing a node only touches its two neighbors on the chain.
+    """
+
+    def __init__(self, chains: dict = None):
+        self.chains = {} if chains is None else chains
+        return
+
+    @classmethod
+    def from_arrays(cls, edge_ids, offsets, nodes):
+        """
+        Builds an index from parallel arrays, one entry per inserted node. Nodes with equal offsets on the same edge
+        keep the order they were given in.
+        """
+        edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.float64)
+        nodes = np.asarray(nodes, dtype=np.int64)
+        order = np.lexsort((np.arange(edge_ids.shape[0]), offsets, edge_ids))
+        edge_ids = edge_ids[order]
+        splits = np.flatnonzero(edge_ids[1:] != edge_ids[:-1]) + 1
+        chains = {}
+        for edge_id, edge_offsets, edge_nodes in zip(
+            edge_ids[np.concatenate([[0], splits])].tolist() if edge_ids.shape[0] else [],
+            np.split(offsets[order], splits),
+            np.split(nodes[order], splits)
+        ):
+            chains[edge_id] = (edge_offsets.tolist(), edge_nodes.tolist())
+        return cls(chains)
+
+    def __contains__(self, edge_id):
+        return edge_id in self.chains
+
+    def __len__(self):
+        return sum(len(nodes) for _, nodes in self.chains.values())
+
+    def insert(self, edge_id, offset, node):
+        """
+        Inserts `node` at `offset` on `edge_id`, after any node with the same offset.
+
+        Returns:
+            (previous, next): the (offset, node) entries before and after `node` on the chain, None when `node` is
+            first or last.
+        """
+        offsets, nodes = self.chains.setdefault(edge_id, ([], []))
+        position = bisect_right(offsets, offset)
+        offsets.insert(position, offset)
+        nodes.insert(position, node)
+        return self._chain_neighbors(offsets, nodes, position)
+
+    def neighbors(self, edge_id, offset):
+        """
+        Returns the (offset, node) entries a node inserted at `offset` on `edge_id` would have before and after it
+        on the chain, without inserting it. None when there is no node on that side.
+        """
+        if edge_id not in self.chains:
+            return None, None
+        offsets, nodes = self.chains[edge_id]
+        position = bisect_right(offsets, offset)
+        return (
+            (offsets[position - 1], nodes[position - 1]) if position > 0 else None,
+            (offsets[position], nodes[position]) if position < len(nodes) else None
+        )
+
+    def remove(self, edge_id, node, offset=None):
+        """
+        Removes `node` from the chain of `edge_id`. When its `offset` is given, the node is looked up by bisection.
+
+        Returns:
+            (previous, next): the (offset, node) entries that were before and after `node` on the chain, None when
+            `node` was first or last.
+        """
+        offsets, nodes = self.chains[edge_id]
+        position = nodes.index(node, 0 if offset is None else bisect_left(offsets, offset))
+        neighbors = self._chain_neighbors(offsets, nodes, position)
+        del offsets[position]
+        del nodes[position]
+        if len(nodes) == 0:
+            del self.chains[edge_id]
+        return neighbors
+
+    @staticmethod
+    def _chain_neighbors(offsets, nodes, position):
+        return (
+            (offsets[position - 1], nodes[position - 1]) if position > 0 else None,
+            (offsets[position + 1], nodes[position + 1]) if position + 1 < len(nodes) else None
+        )
+
+    def copy(self):
+        return EdgeChainIndex({edge_id: (list(offsets), list(nodes)) for edge_id, (offsets, nodes) in self.chains.items()})
+
+
+class TurnCostTable:
+    """
+    Turn penalties for node triples (previous, current, next), the cost of going from `previous` to `next` through
+    `current`. Angles are computed from node coordinate arrays rather than geometries, and each triple is computed
+    once: all turns between street edges in bulk by `precompute`, turns involving inserted nodes on first use.
+    Internal class, made and cached by `Network.turn_costs()`.
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, turn_threshold_degree: float, turn_penalty_amount: float):
+        self.x = x
+        self.y = y
+        self.x_list = x.tolist()
+        self.y_list = y.tolist()
+        self.turn_threshold_degree = turn_threshold_degree
+        self.turn_penalty_amount = turn_penalty_amount
+        # {(previous, current, next): penalty}
+        self.costs = {}
+        return
+
+    def precompute(self, previous_nodes, current_nodes, next_nodes):
+        """
+        Computes penalties for arrays of triples in one vectorized pass.
+        """
+        previous_nodes = np.asarray(previous_nodes, dtype=np.int64)
+        current_nodes = np.asarray(current_nodes, dtype=np.int64)
+        next_nodes = np.asarray(next_nodes, dtype=np.int64)
+        x = self.x
+        y = self.y
+        angle = np.arctan2(y[next_nodes] - y[current_nodes], x[next_nodes] - x[current_nodes]) - np.arctan2(y[previous_nodes] - y[current_nodes], x[previous_nodes] - x[current_nodes])
+        # same arithmetic as `math.degrees`
+        angle = angle / (math.pi / 180)
+        angle = np.where(angle < 0, angle + 360, angle)
+        # how far is this turn from being a 180?
+        angle = np.abs(np.round(angle) - 180)
+        # U-turns count as going straight
+        angle = np.minimum(angle, np.abs(angle - 180))
+        penalty = self.turn_penalty_amount
+        self.costs.update(zip(
+            zip(previous_nodes.tolist(), current_nodes.tolist(), next_nodes.tolist()),
+            [penalty if is_turn else 0 for is_turn in (angle > self.turn_threshold_degree).tolist()]
+        ))
+        return
+
+    def penalty(self, previous_node, current_node, next_node):
+        """
+        Returns the turn penalty of going from `previous_node` to `next_node` through `current_node`
+        """
+        key = (previous_node, current_node, next_node)
+        cost = self.costs.get(key)
+        if cost is None:
+            x = self.x_list
+            y = self.y_list
+            angle = math.degrees(
+                math.atan2(y[next_node] - y[current_node], x[next_node] - x[current_node]) - math.atan2(y[previous_node] - y[current_node], x[previous_node] - x[current_node])
+            )
+            angle = angle + 360 if angle < 0 else angle
+            angle = abs(round(angle) - 180)
+            angle = min(angle, abs(angle - 180))
+            cost = self.turn_penalty_amount if angle > self.turn_threshold_degree else 0
+            self.costs[key] = cost
+        return cost
+
+
+def edge_slots(starts, ends, weights, edge_ids):
+    """
+    Expands undirected edges into directed adjacency entries, interleaved so each node's adjacency follows edge
+    order. A looped edge gives a single entry.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    keep = np.ones(starts.shape[0] * 2, dtype=bool)
+    keep[1::2] = starts != ends
+    return (
+        np.stack([starts, ends], axis=1).ravel()[keep],
+        np.stack([ends, starts], axis=1).ravel()[keep],
+        np.repeat(np.asarray(weights, dtype=np.float64), 2)[keep],
+        np.repeat(np.asarray(edge_ids, dtype=np.int64), 2)[keep],
+    )
+
+
+def copy_graph_attributes(attributes: dict):
+    return {key: (value.copy() if isinstance(value, (list, dict, set, EdgeChainIndex)) else value) for key, value in attributes.items()}
+
+
+GRAPH_ENGINES = {
+    "csr": CSRGraph,
+    "networkx": NetworkXGraph,
+}
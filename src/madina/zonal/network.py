@@ -1,7 +1,10 @@
+from __future__ import annotations
 import numpy as np
 import networkx as nx
 from geopandas import GeoDataFrame
 from .layer import Layer
+from .network_utils import _chain_offsets, _fragment_weights
+from .graph import CSRGraph, OverlayGraph, NetworkXGraph, EdgeChainIndex, VirtualNodeGraph, TurnCostTable, copy_graph_attributes, GRAPH_ENGINES
 
 
 class Network:
@@ -26,7 +29,11 @@ class Network:
         self.light_graph = None
         self.d_graph = None
         self.od_graph = None
+        self.graph_engine = "csr"
         self.street_node_ids = None
+        self.destination_ids = None
+        self.turn_cost_table = None
+        self.chain_offset_table = None
         return
     
     def set_node_value(self, idx, label, new_value):
@@ -36,7 +43,7 @@ class Network:
         self.nodes.at[idx, label] = new_value
         return
 
-    def create_graph(self, light_graph=False, d_graph=True, od_graph=False):
+    def create_graph(self, light_graph=False, d_graph=True, od_graph=False, engine="csr"):
         """
         Creates the corresponding graphs in the network object based on the current nodes and edges
         `light_graph` - contains only network nodes and edges
@@ -47,194 +54,439 @@ class Network:
             light_graph: if true, create `self.light_graph`
             d_graph: if true, create `self.d_graph`
             od_graph: if true, create `self.od_graph`
+            engine: graph backend, one of `GRAPH_ENGINES`: "csr" (NumPy arrays, default) or "networkx"
 
         Returns:
             none
         """
-        
+        if engine not in GRAPH_ENGINES:
+            raise ValueError(f"Parameter 'engine': must be one of {list(GRAPH_ENGINES.keys())}. engine={engine} was given.")
+        if ((engine != self.graph_engine) or (self.light_graph is None)) and not light_graph:
+            # graphs of different engines can't be derived from each other, and d_graph/od_graph are built on top of light_graph.
+            light_graph = True
+        self.graph_engine = engine
+        # nodes might have changed since turn costs and chain offsets were computed.
+        self.turn_cost_table = None
+        self.chain_offset_table = None
+
         self.street_node_ids = set(self.nodes[self.nodes["type"] == 'street_node'].index)
+        self.destination_ids = set(self.nodes[self.nodes["type"] == 'destination'].index)
 
         if light_graph:
-            street_node_gdf = self.nodes[self.nodes["type"] == "street_node"]
-            ## no need to filter edges, because in light graph, they haven't been inseted
-            self.light_graph = nx.Graph()
-            for idx in self.edges.index:
-                self.light_graph.add_edge(
-                    int(self.edges.at[idx, "start"]),
-                    int(self.edges.at[idx, "end"]),
-                    weight=max(self.edges.at[idx, "weight"], 0),
-                    #type=self.edges.at[idx, "type"],
-                    id=idx
-                )
-
-            for idx in street_node_gdf.index:
-                self.light_graph.nodes[int(idx)]['type'] = street_node_gdf.at[idx, "type"]
+            self.light_graph = self._build_graph()
+            if engine == "networkx":
+                nx.set_node_attributes(self.light_graph, {int(idx): "street_node" for idx in self.street_node_ids if idx in self.light_graph}, "type")
 
         if d_graph:
             d_list = list(self.nodes[self.nodes["type"] == "destination"].index)
-            graph = self.light_graph.copy() # TODO: Consider deep copies?
-            self.update_light_graph(graph, add_nodes=d_list)
-            self.d_graph = graph
+            self.d_graph = self._build_graph(d_list)
+            self.d_graph.graph["added_nodes"] = d_list
 
         if od_graph:
             od_list = list(self.nodes[self.nodes["type"].isin(["origin", "destination"])].index)
-            graph = self.light_graph.copy()
-            self.update_light_graph(graph, add_nodes=od_list)
-            self.od_graph = graph
+            self.od_graph = self._build_graph(od_list)
+            self.od_graph.graph["added_nodes"] = od_list
 
         return
 
-    def visualize_graph(self):
+    def _build_graph(self, inserted_nodes: list = []):
         """
-        Creates an HTML map of the `zonal` object.
+        Builds a graph of the current `graph_engine` in one bulk pass, with `inserted_nodes` splitting the edges they
+        are on. For the "csr" engine, the street graph is a `CSRGraph`, and graphs with inserted nodes are
+        `OverlayGraph` views on top of `self.light_graph` that only hold the split edges.
         """
-        raise NotImplementedError
-    
-    def add_node_to_graph(self, graph: nx.Graph, node_idx):
-        try:
-            #print ("here...", graph, node_idx, graph.graph["added_nodes"])
-            node_gdf = self.nodes 
+        split_edge_ids, starts, ends, weights, edge_ids = self._inserted_node_fragments(inserted_nodes)
 
-            if node_idx in graph.graph["added_nodes"]:
-                print(f'{node_idx = } is already added...\t{graph.graph["added_nodes"] = }')
+        if (self.graph_engine == "csr") and (len(inserted_nodes) > 0):
+            return OverlayGraph.from_fragments(self.light_graph, split_edge_ids, starts, ends, weights, edge_ids)
 
-            graph.graph["added_nodes"].append(node_idx)
-            graph_nodes = graph.graph["added_nodes"]
+        street_edges = ~np.isin(self.edges.index.values, split_edge_ids)
+        starts = np.concatenate([self.edges["start"].values[street_edges].astype(np.int64), starts])
+        ends = np.concatenate([self.edges["end"].values[street_edges].astype(np.int64), ends])
+        weights = np.concatenate([np.maximum(self.edges["weight"].values[street_edges].astype(np.float64), 0), weights])
+        edge_ids = np.concatenate([self.edges.index.values[street_edges].astype(np.int64), edge_ids])
 
-            edge_id = int(node_gdf.at[node_idx, "nearest_edge_id"])
+        if self.graph_engine == "csr":
+            return CSRGraph.from_edges(starts, ends, weights, edge_ids, node_count=int(self.nodes.index.max()) + 1)
 
-            #neigoboring_nodes = list(set(node_gdf[node_gdf['nearest_edge_id'] == edge_id].index).intersection(graph_nodes))
-            
-            #graph_nodex_gdf = node_gdf.loc[graph_nodes, 'nearest_edge_id']
-            #neigoboring_nodes = list(graph_nodex_gdf[graph_nodex_gdf == edge_id].index)
-            
-            neigoboring_nodes = [graph_node for graph_node in graph_nodes if node_gdf.at[graph_node, 'nearest_edge_id'] == edge_id]
+        graph = NetworkXGraph()
+        graph.add_edges_from(
+            (start, end, {"weight": weight, "id": edge_id})
+            for start, end, weight, edge_id in zip(starts.tolist(), ends.tolist(), weights.tolist(), edge_ids.tolist())
+        )
+        return graph
+
+    def _inserted_node_fragments(self, inserted_nodes: list = []):
+        """
+        Vectorized equivalent of calling `update_light_graph(graph, add_nodes=inserted_nodes)` on the light graph:
+        every edge with inserted nodes is replaced by the chain of fragments connecting its end node, the inserted
+        nodes sorted by `weight_to_end`, and its start node.
+
+        Args:
+            inserted_nodes: origin/destination node ids to insert in the graph.
+
+        Returns:
+            split_edge_ids: ids of the edges that have inserted nodes
+            starts, ends, weights, edge_ids: parallel arrays, one entry per fragment.
+        """
+        if len(inserted_nodes) == 0:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, empty, np.array([], dtype=np.float64), empty
+
+        edge_ids = self.edges.index
+        edge_starts = self.edges["start"].values.astype(np.int64)
+        edge_ends = self.edges["end"].values.astype(np.int64)
+        edge_weights = self.edges["weight"].values.astype(np.float64)
+
+        inserted = self.nodes.loc[inserted_nodes, ["nearest_edge_id", "edge_start_node", "edge_end_node", "weight_to_start", "weight_to_end"]]
+        node_ids = inserted.index.values.astype(np.int64)
+        node_edges = inserted["nearest_edge_id"].values.astype(np.int64)
+        node_edge_starts = inserted["edge_start_node"].values.astype(np.int64)
+        node_edge_ends = inserted["edge_end_node"].values.astype(np.int64)
+        node_to_start = inserted["weight_to_start"].values.astype(np.float64)
+        node_to_end = inserted["weight_to_end"].values.astype(np.float64)
+
+        split_edges, node_counts = np.unique(node_edges, return_counts=True)
+        single = np.isin(node_edges, split_edges[node_counts == 1])
+
+        # a node alone on its edge splits it in two: (end, node) and (node, start)
+        single_starts = np.concatenate([node_edge_ends[single], node_ids[single]])
+        single_ends = np.concatenate([node_ids[single], node_edge_starts[single]])
+        single_edge_ids = np.concatenate([node_edges[single], node_edges[single]])
+        single_weights = _fragment_weights(
+            np.concatenate([node_to_end[single], node_to_start[single]]),
+            edge_weights[edge_ids.get_indexer(single_edge_ids)]
+        )
+
+        # several nodes on an edge form a chain from the edge's end to its start, sorted by distance from the end.
+        chained = ~single
+        chain_edges = node_edges[chained]
+        chain_distances = self.chain_offsets(node_ids[chained])
+
+        chain_edge_ids = np.unique(chain_edges)
+        chain_edge_positions = edge_ids.get_indexer(chain_edge_ids)
+        # chain ends are added as members with distances 0 and segment_weight: [chain start, nodes..., chain end]
+        member_edges = np.concatenate([chain_edge_ids, chain_edges, chain_edge_ids])
+        member_nodes = np.concatenate([edge_ends[chain_edge_positions], node_ids[chained], edge_starts[chain_edge_positions]])
+        member_distances = np.concatenate([np.zeros(chain_edge_ids.shape[0]), chain_distances, edge_weights[chain_edge_positions]])
+        member_rank = np.concatenate([np.zeros(chain_edge_ids.shape[0]), np.ones(chain_edges.shape[0]), np.full(chain_edge_ids.shape[0], 2)])
+        order = np.lexsort((member_rank, member_distances, member_edges))
+        member_edges = member_edges[order]
+        member_nodes = member_nodes[order]
+        member_distances = member_distances[order]
+
+        same_edge = member_edges[:-1] == member_edges[1:]
+        chain_starts = member_nodes[:-1][same_edge]
+        chain_ends = member_nodes[1:][same_edge]
+        chain_fragment_edge_ids = member_edges[:-1][same_edge]
+        chain_weights = _fragment_weights(
+            member_distances[1:][same_edge] - member_distances[:-1][same_edge],
+            edge_weights[edge_ids.get_indexer(chain_fragment_edge_ids)]
+        )
+
+        return (
+            split_edges,
+            np.concatenate([single_starts, chain_starts]),
+            np.concatenate([single_ends, chain_ends]),
+            np.concatenate([single_weights, chain_weights]),
+            np.concatenate([single_edge_ids, chain_fragment_edge_ids]),
+        )
 
+    def chain_offsets(self, node_ids):
+        """
+        Returns the positions of inserted nodes `node_ids` along their edge, as a distance from the edge's end node,
+        see `_chain_offsets`. Positions of all inserted nodes are computed once, the sequence of a node on its edge
+        following node ids, and kept until `create_graph` is called or nodes are added.
+        """
+        table = self.chain_offset_table
+        if (table is None) or (table.shape[0] != int(self.nodes.index.max()) + 1):
+            inserted = self.nodes[self.nodes["type"] != "street_node"]
+            node_ids_inserted = inserted.index.values.astype(np.int64)
+            edge_ids = inserted["nearest_edge_id"].values.astype(np.int64)
+            order = np.lexsort((node_ids_inserted, edge_ids))
+            sorted_edges = edge_ids[order]
+            group_starts = np.flatnonzero(np.concatenate([[True], sorted_edges[1:] != sorted_edges[:-1]])) if sorted_edges.shape[0] > 0 else np.zeros(0, dtype=np.int64)
+            group_sizes = np.diff(np.append(group_starts, sorted_edges.shape[0]))
+            sequences = np.empty(sorted_edges.shape[0], dtype=np.int64)
+            sequences[order] = np.arange(sorted_edges.shape[0]) - np.repeat(group_starts, group_sizes)
+
+            table = np.full(int(self.nodes.index.max()) + 1, np.nan)
+            table[node_ids_inserted] = _chain_offsets(
+                inserted["weight_to_end"].values.astype(np.float64),
+                self.edges.loc[edge_ids, "weight"].values.astype(np.float64),
+                sequences
+            )
+            self.chain_offset_table = table
+        return table[np.asarray(node_ids, dtype=np.int64)]
+
+    def turn_costs(self):
+        """
+        Returns the network's `TurnCostTable`, building it on first use, with the turns between all pairs of street
+        edges precomputed. The table is rebuilt when the turn parameters or the nodes change, and is dropped by
+        `Zonal.set_turn_parameters` and `create_graph`.
+        """
+        table = self.turn_cost_table
+        if (
+            (table is not None) and
+            (table.turn_threshold_degree == self.turn_threshold_degree) and
+            (table.turn_penalty_amount == self.turn_penalty_amount) and
+            (table.x.shape[0] == int(self.nodes.index.max()) + 1)
+        ):
+            return table
+
+        node_ids = self.nodes.index.values.astype(np.int64)
+        x = np.full(int(node_ids.max()) + 1, np.nan)
+        y = np.full(int(node_ids.max()) + 1, np.nan)
+        x[node_ids] = self.nodes.geometry.x.values
+        y[node_ids] = self.nodes.geometry.y.values
+        table = TurnCostTable(x, y, self.turn_threshold_degree, self.turn_penalty_amount)
+
+        # every street intersection: all (neighbor, node, neighbor) triples, U-turns included.
+        starts = self.edges["start"].values.astype(np.int64)
+        ends = self.edges["end"].values.astype(np.int64)
+        pairs = np.unique(np.stack([np.concatenate([starts, ends]), np.concatenate([ends, starts])], axis=1), axis=0)
+        nodes, first, degrees = np.unique(pairs[:, 0], return_index=True, return_counts=True)
+        triple_counts = degrees ** 2
+        triple_nodes = np.repeat(np.arange(nodes.shape[0]), triple_counts)
+        triple_rank = np.arange(triple_counts.sum()) - np.repeat(np.cumsum(triple_counts) - triple_counts, triple_counts)
+        table.precompute(
+            pairs[first[triple_nodes] + triple_rank // degrees[triple_nodes], 1],
+            nodes[triple_nodes],
+            pairs[first[triple_nodes] + triple_rank % degrees[triple_nodes], 1]
+        )
 
-            #print (neigoboring_nodes, edge_id, graph_nodes)
-        except Exception as e:
-            print(e.__doc__)
-            print(str(e))
-            print (e.__traceback__)
-            import traceback
-            traceback.print_exc()
+        self.turn_cost_table = table
+        return table
 
+    def edge_positions(self):
+        """
+        Returns an array that maps an edge id to the row position of the edge in `self.edges`, so per edge values can
+        be kept in flat arrays aligned with `self.edges`. Ids that are not an edge (dropped when splitting
+        parallel edges) map to -1.
+        """
+        edge_ids = self.edges.index.values.astype(np.int64)
+        positions = np.full(int(edge_ids.max()) + 1, -1, dtype=np.int64)
+        positions[edge_ids] = np.arange(edge_ids.shape[0])
+        return positions
 
+    def edge_values_to_streets(self, edge_values: np.ndarray, street_ids):
+        """
+        Maps per edge values onto the streets of `self.edge_source_layer`. Edges split from a street share its
+        `parent_street_id`; a street takes the value of its first edge, as split edges carry the same value.
 
+        Args:
+            edge_values: an array of values aligned with `self.edges`
+            street_ids: ids of the streets to map values to, like the index of the source layer
 
+        Returns:
+            an array of values aligned with `street_ids`, `np.nan` for streets that are not in the network
+        """
+        parent_street_ids, first_positions = np.unique(self.edges["parent_street_id"].values, return_index=True)
+        street_ids = np.asarray(street_ids)
+        street_positions = np.minimum(np.searchsorted(parent_street_ids, street_ids), parent_street_ids.shape[0] - 1)
+        found = parent_street_ids[street_positions] == street_ids
+        street_values = np.full(street_ids.shape[0], np.nan)
+        street_values[found] = np.asarray(edge_values, dtype=np.float64)[first_positions[street_positions[found]]]
+        return street_values
 
+    def visualize_graph(self):
+        """
+        Creates an HTML map of the `zonal` object.
+        """
+        raise NotImplementedError
+    
+    def add_node_to_graph(self, graph: OverlayGraph | NetworkXGraph, node_idx):
+        """
+        Inserts `node_idx` in `graph`, splitting the edge fragment it falls on. The graph's edge chain index (see
+        `_edge_chain_index`) gives the node's two neighbors on its edge, so the cost of an insertion doesn't grow with
+        the number of nodes already in the graph.
 
+        Args:
+            graph: The given graph object to be edited
+            node_idx: an origin or destination node id
 
-        if len(neigoboring_nodes) == 1:
+        Returns:
+            none
+        """
+        node_idx = int(node_idx)
+        if node_idx in graph:
+            print(f'{node_idx = } is already added to {str(graph)}')
+            return
+
+        chains = self._edge_chain_index(graph)
+        edge_id = int(self.nodes.at[node_idx, "nearest_edge_id"])
+        edge_end = int(self.nodes.at[node_idx, "edge_end_node"])
+        edge_start = int(self.nodes.at[node_idx, "edge_start_node"])
+        segment_weight = self.edges.at[edge_id, "weight"]
+        offset = float(self.chain_offsets([node_idx])[0])
+
+        previous, following = chains.insert(edge_id, offset, node_idx)
+        graph.graph["added_nodes"].append(node_idx)
+
+        if (previous is None) and (following is None):
             # newly inserted node is the only one on this segment
             graph.add_edge(
-                int(self.nodes.at[node_idx, "edge_end_node"]),
-                int(node_idx),
-                weight=max(self.nodes.at[node_idx, "weight_to_end"], 0),
+                edge_end,
+                node_idx,
+                weight=float(_fragment_weights(self.nodes.at[node_idx, "weight_to_end"], segment_weight)),
                 id=edge_id
             )
             graph.add_edge(
-                int(node_idx),
-                int(self.nodes.at[node_idx, "edge_start_node"]),
-                weight=max(self.nodes.at[node_idx, 'weight_to_start'], 0),
+                node_idx,
+                edge_start,
+                weight=float(_fragment_weights(self.nodes.at[node_idx, "weight_to_start"], segment_weight)),
                 id=edge_id
             )
-            graph.remove_edge(self.nodes.at[node_idx, "edge_end_node"], int(self.nodes.at[node_idx, "edge_start_node"]))
-            
-        else:
-            # TODO: instead of removing all nodes and adding them again, try inserting in right location. removing one edge and adding two edges.
-            # start a chain addition of neighbors, starting from the 'left',
-            # so, need to sort based on distance from left
-            segment_weight = self.edges.at[edge_id, "weight"]
-
-            chain_start = self.nodes.at[node_idx, "edge_end_node"]
-            chain_end = self.nodes.at[node_idx, "edge_start_node"]
-
-            chain_distances = [self.nodes.at[node, "weight_to_end"] for node in neigoboring_nodes]
-
-            #a small epselon perturbation is added to each node whenits weight is 0, or subtracted if the weight is segment_weight (this happens when nodes snap to an end of a segment. This epselon error ensure the node is inside the chain.)
-            chain_distances = [(0.0000001*(weight_sec+1)) if weight == 0 else weight for weight_sec, weight in enumerate(chain_distances)]
-            chain_distances = [segment_weight - (0.0000001*(weight_sec+1)) if weight == segment_weight else weight for weight_sec, weight in enumerate(chain_distances)]
-            #chain_distances = [0.0000001 if weight == 0 else weight for weight in chain_distances]
-            #chain_distances = [segment_weight - 0.0000001 if weight == segment_weight else weight for weight in chain_distances]
-
-
-            chain_nodes = np.array([chain_start] + neigoboring_nodes + [chain_end])
-            chain_distances = np.array([0] + chain_distances + [segment_weight])
-            
-            sorting_index = np.argsort(chain_distances)
-            chain_nodes = chain_nodes[sorting_index]
-            chain_distances = chain_distances[sorting_index]
-
-            # remove existing nodes
-            neigoboring_nodes.remove(node_idx)
-            for node in neigoboring_nodes:
-                graph.remove_node(node)
+            graph.remove_edge(edge_end, edge_start)
+            return
 
-            accumilated_weight = 0
+        # split the chain fragment between the two neighbors of the new node.
+        previous_offset, previous_node = (0, edge_end) if previous is None else previous
+        next_offset, next_node = (segment_weight, edge_start) if following is None else following
+        graph.remove_edge(previous_node, next_node)
+        graph.add_edge(previous_node, node_idx, weight=float(_fragment_weights(offset - previous_offset, segment_weight)), id=edge_id)
+        graph.add_edge(node_idx, next_node, weight=float(_fragment_weights(next_offset - offset, segment_weight)), id=edge_id)
+
+        if edge_start == edge_end:
+            # on a looped edge, both ends of the chain attach to the same node and share one (node, neighbor) pair,
+            # relink the whole chain in case that pair was just removed.
+            chain_offset, chain_nodes = chains.chains[edge_id]
+            chain_offset = [0] + chain_offset + [segment_weight]
+            chain_nodes = [edge_end] + chain_nodes + [edge_start]
             for seq in range(len(chain_nodes) - 1):
                 graph.add_edge(
-                    int(chain_nodes[seq]),
-                    int(chain_nodes[seq + 1]),
-                    # TODO: change this to either defaults to distance or a specified column for a weight..
-                    weight=max(chain_distances[seq + 1] - chain_distances[seq], 0),
-                    ##avoiding small negative numbers due to numerical error when two nodes are superimposed.
+                    chain_nodes[seq],
+                    chain_nodes[seq + 1],
+                    weight=float(_fragment_weights(chain_offset[seq + 1] - chain_offset[seq], segment_weight)),
                     id=edge_id
                 )
-                accumilated_weight += (chain_distances[seq + 1] - chain_distances[seq])
-    
         return
 
-    def remove_node_to_graph(self, graph: nx.Graph, node_idx):
-        #print ("Deleting...")
-        node_idx = int(node_idx)
-        original_edge_id = self.nodes.at[node_idx, "nearest_edge_id"]
+    def remove_node_to_graph(self, graph: OverlayGraph | NetworkXGraph, node_idx):
+        """
+        Removes `node_idx` from `graph`, joining its two neighbors on its edge back together. Reverses
+        `add_node_to_graph`.
 
+        Args:
+            graph: The given graph object to be edited
+            node_idx: an origin or destination node id previously added to `graph`
 
-        if node_idx not in graph.nodes:
+        Returns:
+            none
+        """
+        node_idx = int(node_idx)
+        if node_idx not in graph:
             print(f"attempting to remove node {node_idx} that's not in graph {str(graph)}")
             return
 
-        neighbors = list(graph.adj[node_idx])
-        
-        if len(neighbors) != 2:
-            #print(f"attempting to remove a node {node_idx = } that's not degree 2, adjacent to: {graph.adj[node_idx]}")
-            # dealing with looped edges, as the start and end are the same node, making len(neighbors)=1 as we can't represent duplicate neighbors when not using multigraph
-            if self.edges.at[original_edge_id, 'start'] == self.edges.at[original_edge_id, 'end']:
-                start = self.edges.at[original_edge_id, 'start']
-                end = self.edges.at[original_edge_id, 'end']
-                weight = self.edges.at[original_edge_id, 'weight']
-                #print ("fixed looped node edge on removal")
-            else:
-                ## TODO: Check if there are cases that lead to this outcome
-                return
-        else:
-            start = int(neighbors[0])
-            end = int(neighbors[1])
-            weight = graph.adj[node_idx][start]["weight"] + graph.adj[node_idx][end]["weight"]
+        chains = self._edge_chain_index(graph)
+        edge_id = int(self.nodes.at[node_idx, "nearest_edge_id"])
+        segment_weight = self.edges.at[edge_id, "weight"]
+        offset = float(self.chain_offsets([node_idx])[0])
 
-        
+        previous, following = chains.remove(edge_id, node_idx, offset)
+
+        if (previous is None) and (following is None):
+            # last node on this segment, restore the original edge
+            start = int(self.edges.at[edge_id, "start"])
+            end = int(self.edges.at[edge_id, "end"])
+            weight = float(np.maximum(segment_weight, 0))
+        else:
+            previous_offset, start = (0, int(self.nodes.at[node_idx, "edge_end_node"])) if previous is None else previous
+            next_offset, end = (segment_weight, int(self.nodes.at[node_idx, "edge_start_node"])) if following is None else following
+            weight = float(_fragment_weights(next_offset - previous_offset, segment_weight))
 
         # remove node after we got the attributes we needed..
         graph.remove_node(node_idx)
-        graph.graph["added_nodes"].remove(node_idx)
+        added_nodes = graph.graph["added_nodes"]
+        # nodes are usually removed in the reverse order they were added, avoid scanning the whole list.
+        if added_nodes[-1] == node_idx:
+            added_nodes.pop()
+        else:
+            added_nodes.remove(node_idx)
         graph.add_edge(
             start,
             end,
             weight=weight,
-            id=original_edge_id
+            id=edge_id
         )
-        #print (graph.graph["added_nodes"])
+        return
 
+    def virtual_node_graph(self, graph: OverlayGraph | NetworkXGraph, node_idx):
+        """
+        Returns a read-only view of `graph` with `node_idx` inserted as `add_node_to_graph` would, leaving `graph`
+        unchanged. Searches from an origin can run on such a view, so the shared `d_graph` is never mutated and
+        several origins can be searched concurrently against one graph.
 
-        return
+        Args:
+            graph: The graph to view, typically `d_graph`
+            node_idx: an origin node id, not already in `graph`
 
-    def update_light_graph(self, graph: nx.Graph, add_nodes: list = [], remove_nodes: list = []):
+        Returns:
+            a `VirtualNodeGraph`
+        """
+        node_idx = int(node_idx)
+        chains = self._edge_chain_index(graph)
+        edge_id = int(self.nodes.at[node_idx, "nearest_edge_id"])
+        edge_end = int(self.nodes.at[node_idx, "edge_end_node"])
+        edge_start = int(self.nodes.at[node_idx, "edge_start_node"])
+        segment_weight = self.edges.at[edge_id, "weight"]
+        offset = float(self.chain_offsets([node_idx])[0])
+
+        previous, following = chains.neighbors(edge_id, offset)
+
+        if (previous is None) and (following is None):
+            # the node would be the only one on this segment
+            return VirtualNodeGraph(
+                graph,
+                node_idx,
+                edge_end,
+                float(_fragment_weights(self.nodes.at[node_idx, "weight_to_end"], segment_weight)),
+                edge_start,
+                float(_fragment_weights(self.nodes.at[node_idx, "weight_to_start"], segment_weight)),
+                edge_id
+            )
+
+        if edge_start == edge_end:
+            # a looped edge that already has nodes needs its whole chain relinked, edit a copy instead.
+            view = graph.copy()
+            view.graph = copy_graph_attributes(graph.graph)
+            self.add_node_to_graph(view, node_idx)
+            return view
+
+        previous_offset, previous_node = (0, edge_end) if previous is None else previous
+        next_offset, next_node = (segment_weight, edge_start) if following is None else following
+        return VirtualNodeGraph(
+            graph,
+            node_idx,
+            previous_node,
+            float(_fragment_weights(offset - previous_offset, segment_weight)),
+            next_node,
+            float(_fragment_weights(next_offset - offset, segment_weight)),
+            edge_id
+        )
+
+    def _edge_chain_index(self, graph: OverlayGraph | NetworkXGraph):
+        """
+        Returns the `EdgeChainIndex` of the nodes in `graph.graph["added_nodes"]`, building it on first use. It is
+        kept up to date by `add_node_to_graph` and `remove_node_to_graph`.
+        """
+        if "edge_chains" not in graph.graph:
+            added_nodes = graph.graph.setdefault("added_nodes", [])
+            edge_ids = self.nodes.loc[added_nodes, "nearest_edge_id"].values.astype(np.int64)
+            graph.graph["edge_chains"] = EdgeChainIndex.from_arrays(
+                edge_ids,
+                self.chain_offsets(added_nodes),
+                added_nodes
+            )
+        return graph.graph["edge_chains"]
+
+    def update_light_graph(self, graph: OverlayGraph | NetworkXGraph, add_nodes: list = [], remove_nodes: list = []):
         """
         Updates the given graph object by adding nodes to and removing nodes from it.
 
         Args:
-            graph: The given networkx Graph object to be edited
+            graph: The given graph object to be edited
             add_nodes: a list of nodes to be added
             remove_nodes: a list of nodes to be removed
 
@@ -244,6 +496,8 @@ class Network:
         
         if "added_nodes" not in graph.graph:
             graph.graph["added_nodes"] = []
+        # chains are rebuilt on next use, see `_edge_chain_index`
+        graph.graph.pop("edge_chains", None)
 
         node_gdf = self.nodes
 
@@ -281,18 +535,19 @@ class Network:
                 if len(insert_neighbors) == 0:
                     continue
                     #self.nodes.at[node_idx, ""]
+                segment_weight = self.edges.at[edge_id, "weight"]
                 if len(neighbors) == 1:
                     node_idx = neighbors[0]
                     graph.add_edge(
                         int(self.nodes.at[node_idx, "edge_end_node"]),
                         int(node_idx),
-                        weight=max(self.nodes.at[node_idx, "weight_to_end"], 0),
+                        weight=float(_fragment_weights(self.nodes.at[node_idx, "weight_to_end"], segment_weight)),
                         id=edge_id
                     )
                     graph.add_edge(
                         int(node_idx),
                         int(self.nodes.at[node_idx, "edge_start_node"]),
-                        weight=max(self.nodes.at[node_idx, 'weight_to_start'], 0),
+                        weight=float(_fragment_weights(self.nodes.at[node_idx, 'weight_to_start'], segment_weight)),
                         id=edge_id
                     )
                     graph.remove_edge(self.nodes.at[node_idx, "edge_end_node"], int(self.nodes.at[node_idx, "edge_start_node"]))
@@ -300,13 +555,12 @@ class Network:
                 else:
                     # start a chain addition of neighbors, starting from the 'left',
                     # so, need to sort based on distance from left
-                    segment_weight = self.edges.at[edge_id, "weight"]
 
                     chain_start = self.nodes.at[neighbors[0], "edge_end_node"]
                     chain_end = self.nodes.at[neighbors[0], "edge_start_node"]
 
                     chain_distances = [self.nodes.at[node, "weight_to_end"] for node in neighbors]
-                    #a small epselon perturbation is added to each node whenits weight is 0, or subtracted if the weight is segment_weight (this happens when nodes snap to an end of a segment. This epselon error ensure the node is inside the chain.)
+                    #a small epsilon perturbation is added to each node when its weight is 0, or subtracted if the weight is segment_weight (this happens when nodes snap to an end of a segment. This epsilon error ensure the node is inside the chain.)
                     chain_distances = [0.0000001 if weight == 0 else weight for weight in chain_distances]
                     chain_distances = [segment_weight - 0.0000001 if weight == segment_weight else weight for weight in chain_distances]
 
@@ -333,8 +587,7 @@ class Network:
                             int(chain_nodes[seq]),
                             int(chain_nodes[seq + 1]),
                             # TODO: change this to either defaults to distance or a specified column for a weight..
-                            weight=max(chain_distances[seq + 1] - chain_distances[seq], 0),
-                            ##avoiding small negative numbers due to numerical error when two nodes are superimposed.
+                            weight=float(_fragment_weights(chain_distances[seq + 1] - chain_distances[seq], segment_weight)),
                             id=edge_id
                         )
                         accumilated_weight += (chain_distances[seq + 1] - chain_distances[seq])
@@ -342,20 +595,18 @@ class Network:
         # Removing nodes
         for node_idx in remove_nodes:
             node_idx = int(node_idx)
-            if node_idx not in graph.nodes:
+            if node_idx not in graph:
                 print(f"attempting to remove node {node_idx} that's not in graph {str(graph)}")
                 continue
 
-            if len(graph.adj[node_idx]) != 2:
-                print(f"attempting to remove a node {node_idx = } that's not degree 2, adjacent to: {graph.adj[node_idx]}")
+            neighbor_edges = graph.neighbor_edges(node_idx)
+            if len(neighbor_edges) != 2:
+                print(f"attempting to remove a node {node_idx = } that's not degree 2, adjacent to: {neighbor_edges}")
                 continue
 
-            neighbors = list(graph.adj[node_idx])
-
-            start = int(neighbors[0])
-            end = int(neighbors[1])
-            weight = graph.adj[node_idx][start]["weight"] \
-                    + graph.adj[node_idx][end]["weight"]
+            start = int(neighbor_edges[0][0])
+            end = int(neighbor_edges[1][0])
+            weight = neighbor_edges[0][1] + neighbor_edges[1][1]
 
             original_edge_id = self.nodes.at[node_idx, "nearest_edge_id"]
 
@@ -405,5 +656,3 @@ class Network:
 
     def network_to_layer(self):
         return Layer('network_nodes', self.nodes, True, '', ''), Layer('network_edges', self.edges, True, '', '')
-
-
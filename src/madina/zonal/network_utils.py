@@ -91,7 +91,7 @@ def vectorized_node_edge_builder(point_xy):
     point_segment_ids = np.array(
         [edge_ids, edge_ids]).reshape([point_count, 1])
 
-    # sorting points by x then by y. This is to make it effecient to link the similarly sorted unique nodes with each point occurance
+    # sorting points by x then by y. This is to make it effecient to link the similarly sorted unique nodes with each point occurrence
     # sort by x then by y ## np.lexsort is not supported with njit
     sorter = np.lexsort((point_xy[1, :], point_xy[0, :]))
     sorted_point_xy = point_xy[:, sorter]
@@ -108,8 +108,8 @@ def vectorized_node_edge_builder(point_xy):
 
     # node data
     node_points = unique_nodes[0]
-    node_first_occurance = unique_nodes[1]
-    node_indexer = sorter[node_first_occurance]
+    node_first_occurrence = unique_nodes[1]
+    node_indexer = sorter[node_first_occurrence]
 
     node_dgree = np.array(unique_nodes[2], dtype=np.int32)
     # connected_edges = np.empty(node_count, dtype=np.array)
@@ -119,13 +119,13 @@ def vectorized_node_edge_builder(point_xy):
     edge_end_node = np.zeros(edge_count, dtype=np.int32)
 
     # this is to make sure if the last point occurs for the first time, we'll have a proper
-    if node_first_occurance[-1] != (point_count - 1):
-        np.append(node_first_occurance, point_count - 1)
+    if node_first_occurrence[-1] != (point_count - 1):
+        np.append(node_first_occurrence, point_count - 1)
 
     range_start = 0
     i = 0
     node_index = 0
-    for range_end in (list(node_first_occurance[1:]) + [node_first_occurance[-1] + 1]):
+    for range_end in (list(node_first_occurrence[1:]) + [node_first_occurrence[-1] + 1]):
         # connected_edges[node_index] = sorted_point_segment_ids[range_start:range_end]
         for point in point_xy_T[range_start:range_end, :]:
             edge_index = sorted_point_segment_ids[i]
@@ -517,3 +517,23 @@ def efficient_node_insertion(n_node_gdf: GeoDataFrame, n_edge_gdf: GeoDataFrame,
         geometry=pd.Series(point_on_nearest_edge, fastpath=True, index=index)
     )
     return node_gdf
+
+
+def _chain_offsets(weights_to_end, segment_weights, sequences=0):
+    """
+    Position of inserted nodes along their edge, as a distance from the edge's end node. `sequences` is the position
+    of each node among the nodes inserted on its edge.
+    """
+    #a small epsilon perturbation is added to each node when its weight is 0, or subtracted if the weight is segment_weight (this happens when nodes snap to an end of a segment. This epsilon error ensure the node is inside the chain.) The epsilon grows with the node's sequence, so nodes snapped to the same end keep distinct offsets.
+    epsilons = 0.0000001 * (np.asarray(sequences) + 1)
+    weights_to_end = np.where(weights_to_end == 0, epsilons, weights_to_end)
+    return np.where(weights_to_end == segment_weights, segment_weights - epsilons, weights_to_end)
+
+
+def _fragment_weights(weights, segment_weights):
+    """
+    Weights of the fragments an edge is split into by inserted nodes, never negative. Fragments of a closed edge
+    (an infinite `segment_weights`) are infinite, so no search goes through them.
+    """
+    ##avoiding small negative numbers due to numerical error when two nodes are superimposed.
+    return np.where(np.isfinite(segment_weights), np.maximum(weights, 0), np.inf)
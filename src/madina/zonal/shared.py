@@ -0,0 +1,428 @@
+import os
+import concurrent.futures
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from multiprocessing.shared_memory import SharedMemory
+
+from .graph import CSRGraph, OverlayGraph
+from .layer import Layer, Layers
+from .network import Network
+
+
+# node and edge columns read by UNA workers. Columns that workers write results to are left out, workers add them
+# to their own copy of the node table.
+WORKER_NODE_COLUMNS = ["source_layer", "source_id", "type", "weight", "degree", "nearest_edge_id", "edge_start_node", "weight_to_start", "edge_end_node", "weight_to_end"]
+WORKER_EDGE_COLUMNS = ["length", "weight", "parent_street_id", "start", "end"]
+
+
+class SharedArrays:
+    """
+    NumPy arrays copied once into a single `multiprocessing.shared_memory` block. Pickling a `SharedArrays` only sends
+    the name of the block and the layout of the arrays, unpickling it (in a worker process) attaches to the block,
+    and `arrays` are views into it, so no array is ever copied into workers. Views are read-only, unless
+    `writeable=True`, for state that workers update (under a lock of their own).
+
+    The process that created the block owns it: `close()` there frees the block, once workers are done.
+    """
+
+    def __init__(self, arrays: dict, writeable: bool = False):
+        self.layout = []
+        size = 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            # 64 byte aligned, the alignment NumPy uses for its own buffers.
+            size = (size + 63) // 64 * 64
+            self.layout.append((name, array.dtype.str, array.shape, size))
+            size += array.nbytes
+
+        self.memory = SharedMemory(create=True, size=max(size, 1))
+        self.owner = True
+        self.writeable = writeable
+        self.arrays = self._views(writeable=True)
+        for name, array in arrays.items():
+            self.arrays[name][...] = array
+            self.arrays[name].flags.writeable = writeable
+        return
+
+    def _views(self, writeable):
+        views = {}
+        for (name, dtype, shape, offset) in self.layout:
+            view = np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=offset)
+            view.flags.writeable = writeable
+            views[name] = view
+        return views
+
+    @classmethod
+    def attach(cls, name: str, layout: list, writeable: bool = False):
+        """
+        Attaches to the block `name` created by another `SharedArrays`, with views of its arrays.
+        """
+        shared_arrays = cls.__new__(cls)
+        shared_arrays.layout = layout
+        shared_arrays.memory = SharedMemory(name=name)
+        shared_arrays.owner = False
+        shared_arrays.writeable = writeable
+        shared_arrays.arrays = shared_arrays._views(writeable)
+        return shared_arrays
+
+    def __reduce__(self):
+        return (SharedArrays.attach, (self.memory.name, self.layout, self.writeable))
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return any(array_name == name for array_name, _, _, _ in self.layout)
+
+    @property
+    def nbytes(self):
+        return self.memory.size
+
+    def close(self):
+        """
+        Closes the block, and frees it if this process created it.
+        """
+        if self.owner:
+            # views handed out by `__getitem__` must be released by then.
+            self.arrays = None
+            self.memory.close()
+            self.memory.unlink()
+        return
+
+
+# locks handed to worker processes when they start, by name: tasks can't carry locks, they refer to them by name.
+_worker_locks = {}
+
+# street networks attached in this worker process, by shared block name.
+_attached_street_networks = {}
+
+
+def register_worker_lock(name: str, lock):
+    """
+    Registers `lock` under `name` in this process. Pass it as `initializer` to executors, with `(name, lock)` as
+    `initargs`, so tasks running in workers can find the lock with `worker_lock(name)`.
+    """
+    _worker_locks[name] = lock
+    return
+
+
+def worker_lock(name: str):
+    """
+    Returns the lock registered under `name` in this process by `register_worker_lock()`.
+    """
+    if name not in _worker_locks:
+        raise RuntimeError(f"No lock named {name} in this process, pass `initializer=register_worker_lock` to the executor.")
+    return _worker_locks[name]
+
+
+def _share_columns(arrays, categories, prefix, frame, columns):
+    shared_columns = []
+    for column in columns:
+        if column not in frame.columns:
+            continue
+        values = frame[column]
+        if values.dtype.kind in "biuf":
+            arrays[f"{prefix}:{column}"] = values.values
+        else:
+            # strings (layer names, node types) are shared as category codes.
+            categorical = pd.Categorical(values)
+            arrays[f"{prefix}:{column}"] = categorical.codes
+            categories[f"{prefix}:{column}"] = list(categorical.categories)
+        shared_columns.append(column)
+    return shared_columns
+
+
+def _share_graph(arrays, prefix, graph: CSRGraph):
+    arrays[f"{prefix}_offsets"] = graph.offsets
+    arrays[f"{prefix}_neighbors"] = graph.neighbors_array
+    arrays[f"{prefix}_weights"] = graph.weights
+    arrays[f"{prefix}_edge_ids"] = graph.edge_ids
+    return
+
+
+def _attach_graph(arrays, prefix):
+    return CSRGraph(arrays[f"{prefix}_offsets"], arrays[f"{prefix}_neighbors"], arrays[f"{prefix}_weights"], arrays[f"{prefix}_edge_ids"])
+
+
+def _frame(arrays, categories, prefix, columns, index, index_name):
+    frame_columns = {}
+    for column in columns:
+        key = f"{prefix}:{column}"
+        if key in categories:
+            frame_columns[column] = pd.Categorical.from_codes(arrays[key], categories=categories[key])
+        else:
+            frame_columns[column] = arrays[key]
+    return pd.DataFrame(frame_columns, index=pd.Index(index, name=index_name), copy=False)
+
+
+def _share_nodes(arrays, state, node_gdf):
+    arrays["node_index"] = node_gdf.index.values.astype(np.int64)
+    arrays["node_x"] = node_gdf.geometry.x.values
+    arrays["node_y"] = node_gdf.geometry.y.values
+    state["node_columns"] = _share_columns(arrays, state["categories"], "node", node_gdf, WORKER_NODE_COLUMNS)
+    return
+
+
+def _attach_nodes(arrays, state, crs, index_name):
+    node_frame = _frame(arrays, state["categories"], "node", state["node_columns"], arrays["node_index"], index_name)
+    return gpd.GeoDataFrame(node_frame, geometry=gpd.points_from_xy(arrays["node_x"], arrays["node_y"]), crs=crs)
+
+
+class SharedStreetNetwork:
+    """
+    The street part of a network in shared memory: street nodes, edges and the street graph (the base of an
+    `OverlayGraph` `d_graph`), that stay the same when origins and destinations are inserted. A worker builds its
+    street network once, and keeps it for every task that refers to the same block, so a `ComputePool` only
+    publishes a street network again when it changes.
+    """
+
+    def __init__(self, network: Network):
+        arrays, self.state = self._street_arrays(network)
+        self.arrays = SharedArrays(arrays)
+        return
+
+    @staticmethod
+    def _street_arrays(network: Network):
+        arrays = {}
+        state = {"categories": {}}
+
+        node_gdf = network.nodes
+        _share_nodes(arrays, state, node_gdf[node_gdf["type"] == "street_node"])
+        state["crs"] = node_gdf.crs
+        state["index_names"] = (node_gdf.index.name, network.edges.index.name)
+
+        edge_gdf = network.edges
+        arrays["edge_index"] = edge_gdf.index.values.astype(np.int64)
+        state["edge_columns"] = _share_columns(arrays, state["categories"], "edge", edge_gdf, WORKER_EDGE_COLUMNS)
+
+        graph = network.d_graph
+        if isinstance(graph, OverlayGraph):
+            _share_graph(arrays, "base", graph.base)
+        elif isinstance(graph, CSRGraph):
+            # no inserted destinations, the d_graph is the street graph.
+            _share_graph(arrays, "base", graph)
+        return arrays, state
+
+    def matches(self, network: Network):
+        """
+        Returns True if `network` has the same street nodes, edges and street graph as this street network.
+        """
+        arrays, state = self._street_arrays(network)
+        return (state == self.state) and (list(arrays.keys()) == [name for name, _, _, _ in self.arrays.layout]) and all(
+            np.array_equal(array, self.arrays[name]) for name, array in arrays.items()
+        )
+
+    @staticmethod
+    def attach(name: str, layout: list, state: dict):
+        """
+        Builds the worker side street network on views of the shared block `name`, or returns the one this worker
+        already built. Only the latest street network is kept.
+        """
+        if name not in _attached_street_networks:
+            _attached_street_networks.clear()
+            street_network = SharedStreetNetwork.__new__(SharedStreetNetwork)
+            street_network.arrays = SharedArrays.attach(name, layout)
+            street_network.state = state
+            street_network.nodes = _attach_nodes(street_network.arrays, state, state["crs"], state["index_names"][0])
+            street_network.edges = _frame(street_network.arrays, state["categories"], "edge", state["edge_columns"], street_network.arrays["edge_index"], state["index_names"][1])
+            street_network.graph = _attach_graph(street_network.arrays, "base") if "base_offsets" in street_network.arrays else None
+            _attached_street_networks[name] = street_network
+        return _attached_street_networks[name]
+
+    def __reduce__(self):
+        return (SharedStreetNetwork.attach, (self.arrays.memory.name, self.arrays.layout, self.state))
+
+    def close(self):
+        """
+        Frees the shared block, call once workers are done.
+        """
+        self.arrays.close()
+        return
+
+
+class SharedZonal:
+    """
+    A read-only copy of a `Zonal` for UNA worker processes, that holds the network's arrays in shared memory: the
+    `d_graph` arrays, the node and edge columns workers read (`WORKER_NODE_COLUMNS`, `WORKER_EDGE_COLUMNS`) and node
+    coordinates. Handing a `SharedZonal` to a worker (e.g. `executor.submit(..., self=shared_zonal)`) only pickles
+    the name of the shared blocks and small state: unpickling it in the worker gives a `Zonal` whose network is
+    built on views of the shared arrays, with no copy.
+
+    The street part of the network is a `SharedStreetNetwork`, created for this `SharedZonal` unless one is given
+    (by a `ComputePool`, that keeps it across calls), this `SharedZonal` then only holds inserted origins and
+    destinations and their graph layer. Only the layer columns listed in `layer_columns`
+    ({layer_name: [column, ...]}) are sent to workers, without geometry. A `NetworkXGraph` `d_graph` cannot be
+    shared, it is pickled as is.
+
+    :Example:
+        >>> with SharedZonal(zonal) as shared_zonal:
+        >>>     executor.submit(one_access, self=shared_zonal, ...)
+    """
+
+    def __init__(self, zonal, layer_columns: dict = None, street_network: SharedStreetNetwork = None):
+        network = zonal.network
+        self.owns_street_network = street_network is None
+        self.street_network = SharedStreetNetwork(network) if street_network is None else street_network
+        arrays = {}
+        state = {"categories": {}}
+
+        node_gdf = network.nodes
+        _share_nodes(arrays, state, node_gdf[node_gdf["type"] != "street_node"])
+
+        graph = network.d_graph
+        state["d_graph"] = None
+        state["patches"] = None
+        if isinstance(graph, OverlayGraph):
+            if graph.layer is not None:
+                _share_graph(arrays, "layer", graph.layer)
+                arrays["layer_nodes"] = graph.layer_nodes
+            state["patches"] = graph.patches
+        elif not isinstance(graph, CSRGraph):
+            state["d_graph"] = graph
+        arrays["added_nodes"] = np.asarray(graph.graph.get("added_nodes", []), dtype=np.int64)
+
+        # scalars and parameters set on the network (turn parameters, knn weights, ...), graphs and tables are rebuilt.
+        state["network_attributes"] = {
+            key: value for key, value in vars(network).items()
+            if key not in ["nodes", "edges", "light_graph", "d_graph", "od_graph", "street_node_ids", "destination_ids", "turn_cost_table", "chain_offset_table"]
+        }
+        state["layers"] = {
+            layer_name: pd.DataFrame(zonal[layer_name].gdf[columns])
+            for layer_name, columns in ({} if layer_columns is None else layer_columns).items()
+        }
+
+        self.arrays = SharedArrays(arrays)
+        self.state = state
+        return
+
+    @staticmethod
+    def attach(street_network: SharedStreetNetwork, arrays: SharedArrays, state: dict):
+        """
+        Builds the worker side `Zonal` on views of the shared `arrays`, and the worker's street network.
+        """
+        from .zonal import Zonal
+
+        street_state = street_network.state
+        inserted_nodes = _attach_nodes(arrays, state, street_state["crs"], street_state["index_names"][0])
+        nodes = pd.concat([street_network.nodes, inserted_nodes])
+        # a shallow copy, columns workers add don't outlive the task.
+        edges = street_network.edges.copy(deep=False)
+
+        network = Network(nodes, edges, None, None)
+        for key, value in state["network_attributes"].items():
+            setattr(network, key, value)
+
+        if state["d_graph"] is None:
+            layer = None
+            layer_nodes = None
+            if "layer_offsets" in arrays:
+                layer = _attach_graph(arrays, "layer")
+                layer_nodes = arrays["layer_nodes"]
+            graph = OverlayGraph(street_network.graph, layer, layer_nodes)
+            if state["patches"] is not None:
+                graph.patches = state["patches"]
+        else:
+            graph = state["d_graph"]
+        graph.graph["added_nodes"] = arrays["added_nodes"].tolist()
+        network.d_graph = graph
+        network.street_node_ids = set(nodes.index[nodes["type"] == "street_node"])
+        network.destination_ids = set(nodes.index[nodes["type"] == "destination"])
+        # keeps the shared blocks attached as long as the network uses them.
+        network.shared_arrays = (street_network.arrays, arrays)
+
+        zonal = Zonal()
+        zonal.network = network
+        zonal.layers = Layers([
+            Layer(layer_name, layer_frame, show=False, original_crs=None, file_path=None)
+            for layer_name, layer_frame in state["layers"].items()
+        ])
+        return zonal
+
+    def __reduce__(self):
+        return (SharedZonal.attach, (self.street_network, self.arrays, self.state))
+
+    def close(self):
+        """
+        Frees the shared blocks this `SharedZonal` created, call once workers are done.
+        """
+        self.arrays.close()
+        if self.owns_street_network:
+            self.street_network.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class ComputePool:
+    """
+    Worker processes kept alive across UNA calls, with the street network resident in them. The street network is
+    published to workers once, each call then only publishes what changed: inserted origins and destinations, their
+    graph layer, and network parameters. The street network is published again only when it changes (e.g. when
+    `create_street_network()` is called with another weight attribute).
+
+    Create it with `Zonal.compute_pool()`, and pass it to `betweenness()` or `accessibility()` as `pool`.
+
+    :Example:
+        >>> with shaqra.compute_pool(num_cores=16) as pool:
+        >>>     for ...:
+        >>>         shaqra.insert_node(...)
+        >>>         shaqra.create_graph()
+        >>>         betweenness(shaqra, ..., pool=pool)
+    """
+
+    def __init__(self, zonal, num_cores: int = 4):
+        self.zonal = zonal
+        self.num_cores = num_cores
+        # schedulers of every call share this lock, workers get it when they start.
+        self.lock = mp.Lock()
+        self.lock_name = f"compute_pool_{os.getpid()}_{id(self)}"
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_cores, initializer=register_worker_lock, initargs=(self.lock_name, self.lock))
+        self.street_network = None
+        return
+
+    def share(self, layer_columns: dict = None) -> SharedZonal:
+        """
+        Returns a `SharedZonal` of the zonal's current state on the resident street network, publishing the street
+        network again if it changed.
+        """
+        network = self.zonal.network
+        if (self.street_network is None) or (not self.street_network.matches(network)):
+            if self.street_network is not None:
+                self.street_network.close()
+            self.street_network = SharedStreetNetwork(network)
+        return SharedZonal(self.zonal, layer_columns=layer_columns, street_network=self.street_network)
+
+    def restart(self):
+        """
+        Starts new workers after one of them died, which breaks the executor. The street network stays published,
+        and the lock is replaced as a dead worker could have held it.
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.lock = mp.Lock()
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_cores, initializer=register_worker_lock, initargs=(self.lock_name, self.lock))
+        return
+
+    def close(self):
+        """
+        Stops the workers, and frees the street network.
+        """
+        self.executor.shutdown()
+        if self.street_network is not None:
+            self.street_network.close()
+            self.street_network = None
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
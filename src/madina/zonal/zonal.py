@@ -1,4 +1,5 @@
 # this lets geopandas exclusively use shapely (not pygeos) silences a warning about depreciating pygeos out of geopandas. This is not needed when geopandas 1.0 is released in the future
+from __future__ import annotations
 import os
 os.environ['USE_PYGEOS'] = '0'      ## This needs to be done before importing geopandas to prevent warnings
 import random
@@ -12,6 +13,7 @@ from .network import Network
 from .network_utils import node_edge_builder, _discard_redundant_edges, _split_redundant_edges, efficient_node_insertion
 from .utils import prepare_geometry, color_gdf, create_deckGL_map, DEFAULT_COLORS
 from .layer import Layer, Layers
+from .shared import ComputePool
 
 
 VERSION = '0.0.15'
@@ -244,6 +246,8 @@ class Zonal:
 
         self.network.turn_threshold_degree = turn_threshold_degree
         self.network.turn_penalty_amount = turn_penalty_amount
+        # cached turn costs were computed with the previous parameters
+        self.network.turn_cost_table = None
         
         return 
         
@@ -319,9 +323,10 @@ class Zonal:
             self,
             light_graph: bool=True,
             d_graph: bool=True,
-            od_graph:bool =False
+            od_graph:bool =False,
+            engine: str = "csr"
         ) -> None:
-        """After creating a street network, adding origin nodes, and destination nodes, this function must be called to construct a NetworkX object internally. This is needed to run UNA tools. 
+        """After creating a street network, adding origin nodes, and destination nodes, this function must be called to construct a graph object internally. This is needed to run UNA tools. 
 
         :param light_graph: contains only network nodes and edges, defaults to True
         :type light_graph: bool, optional
@@ -329,6 +334,8 @@ class Zonal:
         :type d_graph: bool, optional
         :param od_graph: contains all origin, destination, network, etc. nodes, defaults to False
         :type od_graph: bool, optional
+        :param engine: The graph backend used by UNA tools. "csr" stores the graph in compact NumPy arrays, "networkx" builds NetworkX graphs. defaults to "csr"
+        :type engine: str, optional
         :Example:
             >>> shaqra = Zonal()  # Create a Zonal object.
             >>> shaqra.load_layer('streets', 'streets.geojson') # load streets layer
@@ -350,8 +357,39 @@ class Zonal:
         if not isinstance(od_graph, bool):
             raise TypeError(f"Parameter 'od_graph' must either be a boolean True or False, {type(od_graph)} was given.")
 
+        if engine not in ['csr', 'networkx']:
+            if not isinstance(engine, str):
+                raise TypeError(f"Parameter 'engine' must be a string. {type(engine)} was given.")
+            else: 
+                raise ValueError(f"Parameter 'engine': must be one of ['csr', 'networkx']. engine={engine} was given.")
+
+
+        self.network.create_graph(light_graph, d_graph, od_graph, engine=engine)
+
+    def compute_pool(self, num_cores: int = 4) -> ComputePool:
+        """Starts a pool of worker processes for UNA tools, that stays alive across calls. The street network is sent to workers once, and each call to a UNA tool that uses the pool only sends what changed since: inserted origins and destinations, and parameters. Useful when running many analyses on the same network, like the rows of a pairing table. Use it as a context manager so workers are stopped when done.
+
+        :param num_cores: The number of worker processes, defaults to 4
+        :type num_cores: int, optional
+        :raises TypeError: if parameter `num_cores` is not an int
+        :raises ValueError: if parameter `num_cores` is less than 1
+        :return: a pool to pass to UNA tools as their `pool` parameter.
+        :rtype: ComputePool
+        :Example:
+            >>> with shaqra.compute_pool(num_cores=16) as pool:
+            >>>     for layer_name in ['schools', 'parks']:
+            >>>         shaqra.clear_nodes()
+            >>>         shaqra.insert_node('homes', label="origin")
+            >>>         shaqra.insert_node(layer_name, label="destination")
+            >>>         shaqra.create_graph()
+            >>>         betweenness(shaqra, search_radius=800, save_betweenness_as=layer_name, pool=pool)
+        """
+        if not isinstance(num_cores, int):
+            raise TypeError(f"Parameter 'num_cores' must be {int}. {type(num_cores)} was given.")
+        elif num_cores < 1:
+            raise ValueError(f"Parameter 'num_cores': Cannot be less than 1. num_cores={num_cores} was given.")
 
-        self.network.create_graph(light_graph, d_graph, od_graph)
+        return ComputePool(self, num_cores=num_cores)
 
     def describe(self) -> None:
         """prints a textual representation of the zonal objecgt, listing and describing layers
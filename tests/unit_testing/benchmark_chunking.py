@@ -0,0 +1,34 @@
+if __name__ == '__main__':
+    import time
+
+    from benchmark_utils import synthetic_grid_zonal, cambridge_zonal
+    from madina.una.tools import betweenness
+
+    print (f"{'network':>10s} | {'chunking':>10s} | {'budget_mb':>9s} | {'time_s':>7s} | {'chunks':>6s} | {'max_chunk_path_mb':>17s}")
+    cases = [
+        ("cambridge", lambda: cambridge_zonal(), 800, 1.15),
+        ("grid_30", lambda: synthetic_grid_zonal(30, origin_count=50, destination_count=3_000), 1000, 1.1),
+    ]
+    for network_name, create_zonal, search_radius, detour_ratio in cases:
+        zonal = create_zonal()
+        zonal.create_graph()
+        for chunking_method in ["concentric", "random", "pizza", "none"]:
+            for worker_memory_budget in ([1, 16, 512] if chunking_method != "none" else [512]):
+                start = time.time()
+                betweenness(
+                    zonal,
+                    search_radius=search_radius,
+                    detour_ratio=detour_ratio,
+                    closest_destination=False,
+                    save_betweenness_as="betweenness",
+                    save_reach_as="reach",
+                    keep_diagnostics=True,
+                    chunking_method=chunking_method,
+                    worker_memory_budget=worker_memory_budget,
+                )
+                elapsed = time.time() - start
+
+                origin_gdf = zonal[zonal.network.nodes[zonal.network.nodes["type"] == "origin"].iloc[0]["source_layer"]].gdf
+                chunk_count = origin_gdf["betweenness_chunks"].sum()
+                max_chunk_memory = origin_gdf["betweenness_path_memory"].max()
+                print (f"{network_name:>10s} | {chunking_method:>10s} | {worker_memory_budget:9d} | {elapsed:7.2f} | {chunk_count:6.0f} | {max_chunk_memory / 1024 ** 2:17.2f}")
@@ -0,0 +1,38 @@
+if __name__ == '__main__':
+    import time
+    import networkx as nx
+
+    from benchmark_utils import synthetic_grid_zonal
+
+    def legacy_create_graph(network):
+        # per-edge graph construction with .at lookups, followed by per-edge destination insertion.
+        light_graph = nx.Graph()
+        for idx in network.edges.index:
+            light_graph.add_edge(
+                int(network.edges.at[idx, "start"]),
+                int(network.edges.at[idx, "end"]),
+                weight=max(network.edges.at[idx, "weight"], 0),
+                id=idx
+            )
+        graph = light_graph.copy()
+        network.update_light_graph(graph, add_nodes=list(network.nodes[network.nodes["type"] == "destination"].index))
+        return graph
+
+    print (f"{'blocks':>6s} | {'edges':>8s} | {'destinations':>12s} | {'legacy_s':>9s} | {'networkx_s':>10s} | {'csr_s':>8s}")
+    for blocks, destination_count in [(10, 100), (25, 1_000), (50, 5_000), (100, 20_000)]:
+        zonal = synthetic_grid_zonal(blocks, origin_count=10, destination_count=destination_count)
+        network = zonal.network
+
+        start = time.time()
+        legacy_create_graph(network)
+        legacy_time = time.time() - start
+
+        start = time.time()
+        zonal.create_graph(engine='networkx')
+        networkx_time = time.time() - start
+
+        start = time.time()
+        zonal.create_graph(engine='csr')
+        csr_time = time.time() - start
+
+        print (f"{blocks:6d} | {network.edges.shape[0]:8,d} | {destination_count:12,d} | {legacy_time:9.3f} | {networkx_time:10.3f} | {csr_time:8.3f}")
@@ -0,0 +1,57 @@
+if __name__ == '__main__':
+    import time
+    import numpy as np
+
+    from benchmark_utils import synthetic_grid_zonal
+
+    def legacy_add_node_to_graph(network, graph, node_idx):
+        # linear scan over all added nodes with a pandas .at per node, then a rebuild of the whole chain.
+        node_gdf = network.nodes
+        graph.graph["added_nodes"].append(node_idx)
+        edge_id = int(node_gdf.at[node_idx, "nearest_edge_id"])
+        neigoboring_nodes = [graph_node for graph_node in graph.graph["added_nodes"] if node_gdf.at[graph_node, 'nearest_edge_id'] == edge_id]
+        if len(neigoboring_nodes) == 1:
+            graph.add_edge(int(node_gdf.at[node_idx, "edge_end_node"]), node_idx, weight=max(node_gdf.at[node_idx, "weight_to_end"], 0), id=edge_id)
+            graph.add_edge(node_idx, int(node_gdf.at[node_idx, "edge_start_node"]), weight=max(node_gdf.at[node_idx, 'weight_to_start'], 0), id=edge_id)
+            graph.remove_edge(int(node_gdf.at[node_idx, "edge_end_node"]), int(node_gdf.at[node_idx, "edge_start_node"]))
+            return
+        segment_weight = network.edges.at[edge_id, "weight"]
+        chain_nodes = np.array([node_gdf.at[node_idx, "edge_end_node"]] + neigoboring_nodes + [node_gdf.at[node_idx, "edge_start_node"]])
+        chain_distances = np.array([0] + [node_gdf.at[node, "weight_to_end"] for node in neigoboring_nodes] + [segment_weight])
+        sorting_index = np.argsort(chain_distances, kind="stable")
+        chain_nodes = chain_nodes[sorting_index]
+        chain_distances = chain_distances[sorting_index]
+        neigoboring_nodes.remove(node_idx)
+        for node in neigoboring_nodes:
+            graph.remove_node(node)
+        for seq in range(len(chain_nodes) - 1):
+            graph.add_edge(int(chain_nodes[seq]), int(chain_nodes[seq + 1]), weight=max(chain_distances[seq + 1] - chain_distances[seq], 0), id=edge_id)
+
+    print (f"{'blocks':>6s} | {'destinations':>12s} | {'legacy_add_ms':>13s} | {'add_ms':>7s} | {'remove_ms':>9s}")
+    for blocks, destination_count in [(20, 1_000), (20, 10_000), (20, 50_000)]:
+        zonal = synthetic_grid_zonal(blocks, origin_count=200, destination_count=destination_count)
+        network = zonal.network
+        origins = list(network.nodes[network.nodes["type"] == "origin"].index)
+
+        zonal.create_graph()
+        legacy_graph = network.d_graph.copy()
+        start = time.time()
+        for origin_idx in origins:
+            legacy_add_node_to_graph(network, legacy_graph, origin_idx)
+        legacy_time = (time.time() - start) / len(origins) * 1000
+
+        # the first call builds the edge chain index of the graph, done once per graph.
+        network._edge_chain_index(network.d_graph)
+
+        add_time = 0
+        remove_time = 0
+        for origin_idx in origins:
+            start = time.time()
+            network.add_node_to_graph(network.d_graph, origin_idx)
+            add_time += time.time() - start
+
+            start = time.time()
+            network.remove_node_to_graph(network.d_graph, origin_idx)
+            remove_time += time.time() - start
+
+        print (f"{blocks:6d} | {destination_count:12,d} | {legacy_time:13.3f} | {add_time / len(origins) * 1000:7.3f} | {remove_time / len(origins) * 1000:9.3f}")
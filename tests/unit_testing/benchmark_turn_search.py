@@ -0,0 +1,48 @@
+if __name__ == '__main__':
+    import time
+
+    from benchmark_utils import synthetic_grid_zonal, cambridge_zonal
+    from madina.una.paths import turn_o_scope
+
+    print (f"{'network':>10s} | {'radius':>6s} | {'node_ms':>8s} | {'edge_ms':>8s} | {'node_scope':>10s} | {'edge_scope':>10s} | {'overestimated_%':>15s} | {'max_error':>9s}")
+    cases = [
+        ("cambridge", lambda: cambridge_zonal(), 800),
+        ("grid_20", lambda: synthetic_grid_zonal(20, origin_count=50, destination_count=2_000), 800),
+        ("grid_40", lambda: synthetic_grid_zonal(40, origin_count=50, destination_count=2_000), 1500),
+        ("grid_60", lambda: synthetic_grid_zonal(60, origin_count=50, destination_count=2_000), 2500),
+    ]
+    for network_name, create_zonal, search_radius in cases:
+        zonal = create_zonal()
+        zonal.create_graph()
+        network = zonal.network
+        network.turn_costs()
+        origins = list(network.nodes[network.nodes["type"] == "origin"].index)
+
+        node_time = 0
+        edge_time = 0
+        node_scope_size = 0
+        edge_scope_size = 0
+        overestimated = 0
+        max_error = 0
+        for origin_idx in origins:
+            o_graph = network.virtual_node_graph(network.d_graph, origin_idx)
+
+            start = time.time()
+            _, node_scope, _ = turn_o_scope(network, origin_idx, search_radius, 1.15, turn_penalty=True, o_graph=o_graph, return_paths=True, edge_states=False)
+            node_time += time.time() - start
+
+            start = time.time()
+            _, edge_scope, _ = turn_o_scope(network, origin_idx, search_radius, 1.15, turn_penalty=True, o_graph=o_graph, return_paths=True, edge_states=True)
+            edge_time += time.time() - start
+
+            node_scope_size += len(node_scope)
+            edge_scope_size += len(edge_scope)
+            for node, weight in node_scope.items():
+                if weight > edge_scope[node] + 0.00001:
+                    overestimated += 1
+                    max_error = max(max_error, weight - edge_scope[node])
+
+        print (
+            f"{network_name:>10s} | {search_radius:6d} | {node_time / len(origins) * 1000:8.2f} | {edge_time / len(origins) * 1000:8.2f} | "
+            f"{node_scope_size / len(origins):10.0f} | {edge_scope_size / len(origins):10.0f} | {overestimated / node_scope_size * 100:15.2f} | {max_error:9.2f}"
+        )
@@ -0,0 +1,82 @@
+import numpy as np
+import geopandas as gpd
+import shapely.geometry as geo
+
+
+def synthetic_grid_zonal(blocks: int, block_size: float = 100.0, origin_count: int = 100, destination_count: int = 100, seed: int = 0):
+    """
+    Creates a Zonal object with a `blocks` x `blocks` street grid, and randomly scattered origins and destinations
+    inserted as nodes. Graphs are not created, call `create_graph()` on the returned zonal.
+    """
+    from madina.zonal.zonal import Zonal
+
+    rng = np.random.default_rng(seed)
+    extent = blocks * block_size
+
+    streets = []
+    for i in range(blocks + 1):
+        for j in range(blocks):
+            streets.append(geo.LineString([(j * block_size, i * block_size), ((j + 1) * block_size, i * block_size)]))
+            streets.append(geo.LineString([(i * block_size, j * block_size), (i * block_size, (j + 1) * block_size)]))
+
+    def scattered_points(count):
+        return gpd.GeoDataFrame(
+            {"weight": rng.integers(1, 10, count)},
+            geometry=gpd.points_from_xy(rng.uniform(0, extent, count), rng.uniform(0, extent, count)),
+            crs="EPSG:3857"
+        )
+
+    zonal = Zonal()
+    zonal.load_layer('streets', gpd.GeoDataFrame(geometry=streets, crs="EPSG:3857"))
+    zonal.load_layer('origins', scattered_points(origin_count))
+    zonal.load_layer('destinations', scattered_points(destination_count))
+    zonal.create_street_network('streets', node_snapping_tolerance=0.1)
+    zonal.insert_node('origins', label='origin', weight_attribute='weight')
+    zonal.insert_node('destinations', label='destination', weight_attribute='weight')
+    return zonal
+
+
+def cambridge_zonal(turn_threshold_degree: float = 45, turn_penalty_amount: float = 30):
+    """
+    Creates a Zonal object from the Cambridge sample data in the docs: sidewalks as the network, building entrances
+    as both origins and destinations. Graphs are not created, call `create_graph()` on the returned zonal.
+    """
+    import os
+    from madina.zonal.zonal import Zonal
+
+    data_folder = os.path.join(os.path.dirname(__file__), "..", "..", "docs", "source", "notebooks", "Cities", "Cambridge", "Data")
+    zonal = Zonal()
+    zonal.load_layer('sidewalks', os.path.join(data_folder, 'sidewalks.geojson'))
+    zonal.load_layer('building_entrances', os.path.join(data_folder, 'building_entrances.geojson'))
+    zonal.load_layer('destinations', os.path.join(data_folder, 'building_entrances.geojson'))
+    zonal.create_street_network('sidewalks', node_snapping_tolerance=0.1, turn_threshold_degree=turn_threshold_degree, turn_penalty_amount=turn_penalty_amount)
+    zonal.insert_node('building_entrances', label='origin', weight_attribute='people')
+    zonal.insert_node('destinations', label='destination')
+    return zonal
+
+
+def networkx_reference_graph(network, inserted_nodes: list = []):
+    """
+    Builds the graph of `network` the way it was built before graph engines: a `NetworkXGraph` filled edge by edge,
+    with `inserted_nodes` added through `update_light_graph`. Graphs of other engines are compared to it in tests.
+    """
+    from madina.zonal.graph import NetworkXGraph
+
+    graph = NetworkXGraph()
+    for edge_id, start, end, weight in zip(network.edges.index, network.edges["start"], network.edges["end"], network.edges["weight"]):
+        graph.add_edge(int(start), int(end), weight=max(float(weight), 0), id=int(edge_id))
+    graph.graph["added_nodes"] = []
+    if len(inserted_nodes) > 0:
+        network.update_light_graph(graph, add_nodes=[int(node) for node in inserted_nodes])
+    return graph
+
+
+def assert_same_adjacency(graph, reference, nodes):
+    """
+    Asserts that `nodes` have the same neighbors, edge weights and edge ids in `graph` and `reference`.
+    """
+    for node in nodes:
+        edges = sorted((int(neighbor), int(edge_id), float(weight)) for neighbor, weight, edge_id in graph.neighbor_edges(node))
+        reference_edges = sorted((int(neighbor), int(edge_id), float(weight)) for neighbor, weight, edge_id in reference.neighbor_edges(node))
+        assert [edge[:2] for edge in edges] == [edge[:2] for edge in reference_edges], f"{node = }"
+        assert np.allclose([edge[2] for edge in edges], [edge[2] for edge in reference_edges], atol=1e-4), f"{node = }"
@@ -0,0 +1,340 @@
+import os
+import pickle
+import signal
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark_utils import synthetic_grid_zonal
+from madina.una.contributions import ContributionMatrix
+from madina.una.instrumentation import Instrumentation
+from madina.una.tools import betweenness, betweenness_update, betweenness_sweep
+
+
+def grid_zonal(seed=0):
+    zonal = synthetic_grid_zonal(6, origin_count=30, destination_count=30, seed=seed)
+    zonal.create_graph()
+    return zonal
+
+
+@pytest.mark.parametrize("path_exposure_attribute, save_path_exposure_as", [
+    ("noise", "noise_exposure"),
+    (["noise", "heat"], ["noise_exposure", "heat_exposure"]),
+])
+def test_path_exposure_is_saved_by_itself(path_exposure_attribute, save_path_exposure_as):
+    zonal = grid_zonal()
+    streets = zonal['streets'].gdf
+    rng = np.random.default_rng(0)
+    streets["noise"] = rng.uniform(0, 1, streets.shape[0])
+    streets["heat"] = rng.uniform(0, 1, streets.shape[0])
+
+    betweenness(zonal, search_radius=300, detour_ratio=1.1, num_cores=1, path_exposure_attribute=path_exposure_attribute, save_path_exposure_as=save_path_exposure_as)
+
+    saved_names = [save_path_exposure_as] if isinstance(save_path_exposure_as, str) else save_path_exposure_as
+    origins = zonal['origins'].gdf
+    for name in saved_names:
+        assert name in origins.columns
+        assert (origins[name].fillna(0) > 0).any()
+
+
+def test_betweenness_update_with_closed_edges_matches_a_full_run(tmp_path):
+    zonal = grid_zonal()
+    parameters = dict(search_radius=300, detour_ratio=1.1, decay=True, closest_destination=False, num_cores=1)
+    betweenness(zonal, **parameters, contribution_matrix_file=str(tmp_path / "contributions.npz"))
+
+    # close edges with origins and destinations on them, and one without.
+    nodes = zonal.network.nodes
+    edges = zonal.network.edges
+    origin_edges = nodes.loc[nodes["type"] == "origin", "nearest_edge_id"].unique()[:2]
+    destination_edges = nodes.loc[nodes["type"] == "destination", "nearest_edge_id"].unique()[:2]
+    empty_edges = edges.index[~edges.index.isin(nodes.loc[nodes["type"] != "street_node", "nearest_edge_id"])][:1]
+    closed_edge_ids = [int(edge_id) for edge_id in np.concatenate([origin_edges, destination_edges, empty_edges])]
+    edges.loc[closed_edge_ids, "weight"] = np.inf
+
+    betweenness_update(zonal, str(tmp_path / "contributions.npz"), closed_edge_ids, save_betweenness_as="updated_betweenness")
+    betweenness(zonal, **parameters, save_betweenness_as="rerun_betweenness")
+
+    streets = zonal['streets'].gdf
+    assert np.isfinite(streets["updated_betweenness"]).all()
+    assert np.allclose(streets["updated_betweenness"], streets["rerun_betweenness"])
+    assert np.allclose(zonal.network.edges.loc[closed_edge_ids, "betweenness"], 0)
+
+
+def test_edge_changes_only_affect_origins_that_reach_them(tmp_path):
+    zonal = grid_zonal()
+    betweenness(zonal, search_radius=200, detour_ratio=1.1, closest_destination=False, num_cores=1, contribution_matrix_file=str(tmp_path / "contributions.npz"))
+    contribution_matrix = ContributionMatrix.load(str(tmp_path / "contributions.npz"))
+
+    # a street at a corner of the grid, without origins or destinations on it.
+    nodes = zonal.network.nodes
+    edges = zonal.network.edges
+    origins = nodes[nodes["type"] == "origin"]
+    empty_edges = edges[~edges.index.isin(nodes.loc[nodes["type"] != "street_node", "nearest_edge_id"])]
+    corner_edge_id = int(empty_edges.geometry.centroid.x.add(empty_edges.geometry.centroid.y).idxmin())
+
+    # origins too far to reach the edge are never affected
+    far_origins = origins.index[origins.distance(edges.at[corner_edge_id, "geometry"]) > 200 * 1.1]
+    assert len(far_origins) > 0
+
+    # closing it only affects origins whose trips used it
+    edge_position = int(np.flatnonzero(contribution_matrix.edge_ids == corner_edge_id)[0])
+    entry_rows = np.repeat(np.arange(contribution_matrix.origin_ids.shape[0]), np.diff(contribution_matrix.indptr))
+    using_origins = contribution_matrix.origin_ids[np.unique(entry_rows[contribution_matrix.indices == edge_position])]
+    edges.at[corner_edge_id, "weight"] = np.inf
+    affected_origins = contribution_matrix.affected_origins([corner_edge_id], edges, nodes)
+    assert np.array_equal(np.sort(affected_origins), np.sort(using_origins))
+
+    # shortening it can give new paths to origins that reach it
+    edges.at[corner_edge_id, "weight"] = contribution_matrix.edge_weights[edge_position] / 2
+    affected_origins = contribution_matrix.affected_origins([corner_edge_id], edges, nodes)
+    assert 0 < affected_origins.shape[0] < origins.shape[0]
+    assert np.isin(using_origins, affected_origins).all()
+    assert not np.isin(far_origins, affected_origins).any()
+
+
+def test_resuming_from_a_checkpoint_matches_an_uninterrupted_run(tmp_path):
+    zonal = grid_zonal()
+    parameters = dict(search_radius=300, detour_ratio=1.1, closest_destination=False, num_cores=1)
+    betweenness(zonal, **parameters, save_betweenness_as="full_betweenness", save_reach_as="full_reach")
+
+    checkpoint_directory = str(tmp_path / "checkpoint")
+    betweenness(zonal, **parameters, checkpoint_directory=checkpoint_directory, checkpoint_interval=0)
+    # an interrupted run only saved some of its parts
+    part_files = sorted(file_name for file_name in os.listdir(checkpoint_directory) if file_name.endswith(".pkl"))
+    assert len(part_files) > 1
+    # parts only keep what their origins add to edges, and origin statistics, no node frames
+    parts = [pickle.load(open(os.path.join(checkpoint_directory, file_name), "rb")) for file_name in part_files]
+    assert all(part["edge_betweenness"]["positions"].shape[0] < zonal.network.edges.shape[0] for part in parts)
+    assert any(part["edge_betweenness"]["positions"].shape[0] > 0 for part in parts)
+    assert all(isinstance(values, np.ndarray) for part in parts for values in part["origins"].values())
+    for file_name in part_files[::2]:
+        os.remove(os.path.join(checkpoint_directory, file_name))
+
+    betweenness(zonal, **parameters, checkpoint_directory=checkpoint_directory, checkpoint_interval=0, save_betweenness_as="resumed_betweenness", save_reach_as="resumed_reach")
+    streets = zonal['streets'].gdf
+    origins = zonal['origins'].gdf
+    assert np.allclose(streets["resumed_betweenness"], streets["full_betweenness"])
+    assert np.array_equal(origins["resumed_reach"].fillna(0), origins["full_reach"].fillna(0))
+
+    with pytest.raises(ValueError):
+        betweenness(zonal, search_radius=400, detour_ratio=1.1, closest_destination=False, num_cores=1, checkpoint_directory=checkpoint_directory)
+
+
+def assert_sweep_matches_direct_runs(zonal, search_radius, detour_ratio, parameter_sets):
+    names = [f"sweep_{set_index}" for set_index in range(len(parameter_sets))]
+    betweenness_sweep(zonal, search_radius=search_radius, detour_ratio=detour_ratio, parameter_sets=parameter_sets, save_betweenness_as=names)
+    streets = zonal['streets'].gdf
+    for name, parameter_set in zip(names, parameter_sets):
+        parameters = {"search_radius": search_radius, "detour_ratio": detour_ratio, **parameter_set}
+        betweenness(zonal, **parameters, num_cores=1, save_betweenness_as="direct_betweenness")
+        assert streets[name].sum() > 0
+        assert np.allclose(streets[name], streets["direct_betweenness"]), f"{parameter_set = }"
+
+
+def test_betweenness_sweep_matches_direct_runs():
+    assert_sweep_matches_direct_runs(grid_zonal(), search_radius=300, detour_ratio=1.1, parameter_sets=[
+        {"beta": 0.001, "closest_destination": False},
+        {"beta": 0.004, "closest_destination": False, "decay": True},
+        {"beta": 0.002, "closest_destination": True, "decay": True, "decay_method": "power"},
+    ])
+
+
+def test_betweenness_sweep_of_radius_and_detour_matches_direct_runs():
+    assert_sweep_matches_direct_runs(grid_zonal(), search_radius=300, detour_ratio=1.1, parameter_sets=[
+        {"search_radius": 200, "closest_destination": False},
+        {"detour_ratio": 1.05, "closest_destination": False, "decay": True},
+        {"search_radius": 250, "detour_ratio": 1, "closest_destination": False},
+        {"search_radius": 150, "closest_destination": True},
+    ])
+
+
+def test_resuming_a_sweep_from_a_checkpoint_matches_an_uninterrupted_sweep(tmp_path):
+    zonal = grid_zonal()
+    parameters = dict(search_radius=300, detour_ratio=1.1, parameter_sets=[{"beta": 0.001, "closest_destination": False}, {"search_radius": 200, "closest_destination": False}])
+    betweenness_sweep(zonal, **parameters, save_betweenness_as=["full_0", "full_1"])
+
+    checkpoint_directory = str(tmp_path / "checkpoint")
+    betweenness_sweep(zonal, **parameters, checkpoint_directory=checkpoint_directory, checkpoint_interval=0)
+    part_files = sorted(file_name for file_name in os.listdir(checkpoint_directory) if file_name.endswith(".pkl"))
+    assert len(part_files) > 1
+    # parts only keep the edges their origins add to, with a value for every parameter set
+    deltas = [pickle.load(open(os.path.join(checkpoint_directory, file_name), "rb"))["edge_betweenness"] for file_name in part_files]
+    assert all(delta["positions"].shape[0] < zonal.network.edges.shape[0] for delta in deltas)
+    assert any(delta["positions"].shape[0] > 0 for delta in deltas)
+    assert all(delta["values"].shape == (delta["positions"].shape[0], 2) for delta in deltas)
+    for file_name in part_files[::2]:
+        os.remove(os.path.join(checkpoint_directory, file_name))
+
+    betweenness_sweep(zonal, **parameters, checkpoint_directory=checkpoint_directory, checkpoint_interval=0, save_betweenness_as=["resumed_0", "resumed_1"])
+    streets = zonal['streets'].gdf
+    assert np.allclose(streets["resumed_0"], streets["full_0"])
+    assert np.allclose(streets["resumed_1"], streets["full_1"])
+
+
+def test_contribution_matrix_reweighs_origins_like_a_full_run(tmp_path):
+    zonal = grid_zonal()
+    parameters = dict(search_radius=300, detour_ratio=1.1, closest_destination=False, decay=True, num_cores=1)
+    betweenness(zonal, **parameters, save_betweenness_as="full_betweenness", contribution_matrix_file=str(tmp_path / "contributions.npz"))
+    contribution_matrix = ContributionMatrix.load(str(tmp_path / "contributions.npz"))
+    network = zonal.network
+    assert np.allclose(contribution_matrix.flows(), network.edges["betweenness"].reindex(contribution_matrix.edge_ids))
+
+    # new origin weights, some of them 0
+    origins = network.nodes[network.nodes["type"] == "origin"]
+    new_weights = np.random.default_rng(1).integers(0, 5, origins.shape[0]).astype(float)
+    reweighed_flows = contribution_matrix.flows(pd.Series(new_weights, index=origins["source_id"].values))
+
+    network.nodes.loc[origins.index, "weight"] = new_weights
+    betweenness(zonal, **parameters)
+    assert np.allclose(reweighed_flows, network.edges["betweenness"].reindex(contribution_matrix.edge_ids))
+
+    loaded_edge_id = int(contribution_matrix.edge_ids[np.argmax(reweighed_flows)])
+    assert contribution_matrix.origin_loads(loaded_edge_id, pd.Series(new_weights, index=origins["source_id"].values)).sum() == pytest.approx(reweighed_flows.max())
+
+
+def dense_contributions(contribution_matrix):
+    dense = np.zeros(contribution_matrix.shape)
+    dense[np.repeat(np.arange(contribution_matrix.shape[0]), np.diff(contribution_matrix.indptr)), contribution_matrix.indices] = contribution_matrix.data
+    return dense
+
+
+def test_betweenness_update_with_changed_weights_matches_a_full_run(tmp_path):
+    zonal = grid_zonal()
+    parameters = dict(search_radius=300, detour_ratio=1.1, closest_destination=False, num_cores=1)
+    betweenness(zonal, **parameters, contribution_matrix_file=str(tmp_path / "contributions.npz"))
+
+    # shorter and longer edges, with and without origins and destinations on them.
+    nodes = zonal.network.nodes
+    edges = zonal.network.edges
+    inserted_edges = nodes.loc[nodes["type"] != "street_node", "nearest_edge_id"].unique()
+    empty_edges = edges.index[~edges.index.isin(inserted_edges)]
+    shorter_edge_ids = [int(inserted_edges[0]), int(empty_edges[0])]
+    longer_edge_ids = [int(inserted_edges[1]), int(empty_edges[1])]
+    edges.loc[shorter_edge_ids, "weight"] = edges.loc[shorter_edge_ids, "weight"] / 2
+    edges.loc[longer_edge_ids, "weight"] = edges.loc[longer_edge_ids, "weight"] * 2
+
+    instrumentation = Instrumentation()
+    contribution_matrix = betweenness_update(zonal, str(tmp_path / "contributions.npz"), shorter_edge_ids + longer_edge_ids, save_betweenness_as="updated_betweenness", instrumentation=instrumentation)
+    betweenness(zonal, **parameters, save_betweenness_as="rerun_betweenness", contribution_matrix_file=str(tmp_path / "rerun_contributions.npz"))
+
+    streets = zonal['streets'].gdf
+    assert np.allclose(streets["updated_betweenness"], streets["rerun_betweenness"])
+    rerun_matrix = ContributionMatrix.load(str(tmp_path / "rerun_contributions.npz"))
+    assert np.array_equal(contribution_matrix.edge_ids, rerun_matrix.edge_ids)
+    assert np.allclose(dense_contributions(contribution_matrix), dense_contributions(rerun_matrix))
+    # only origins affected by the change are recomputed, one row each
+    recomputed_origins = instrumentation.origin_table().index
+    assert 0 < len(recomputed_origins) < (nodes["type"] == "origin").sum()
+    assert recomputed_origins.is_unique
+
+
+@pytest.mark.parametrize("closest_destination, decay", [(False, False), (False, True), (True, True)])
+def test_shortest_path_fast_path_matches_path_enumeration(closest_destination, decay):
+    zonal = grid_zonal()
+    streets = zonal['streets'].gdf
+    streets["noise"] = 1.0
+    parameters = dict(search_radius=300, detour_ratio=1, closest_destination=closest_destination, decay=decay, num_cores=1)
+
+    betweenness(zonal, **parameters, save_betweenness_as="fast_betweenness")
+    # path exposure needs every path, so paths are enumerated.
+    betweenness(zonal, **parameters, path_exposure_attribute="noise", save_betweenness_as="enumerated_betweenness")
+
+    assert streets["fast_betweenness"].sum() > 0
+    assert np.allclose(streets["fast_betweenness"], streets["enumerated_betweenness"])
+
+
+@pytest.mark.parametrize("turn_penalty, path_exposure_attribute", [(False, None), (True, None), (True, "noise")])
+def test_streamed_paths_match_kept_paths(turn_penalty, path_exposure_attribute):
+    zonal = grid_zonal()
+    streets = zonal['streets'].gdf
+    streets["noise"] = np.random.default_rng(0).uniform(0, 1, streets.shape[0])
+    parameters = dict(search_radius=300, detour_ratio=1.15, closest_destination=False, decay=True, turn_penalty=turn_penalty, num_cores=1, path_exposure_attribute=path_exposure_attribute)
+
+    betweenness(zonal, **parameters, save_betweenness_as="kept_betweenness", save_path_exposure_as="kept_exposure" if path_exposure_attribute else None)
+    # paths are still kept when exposure needs them.
+    betweenness(zonal, **parameters, stream_paths=True, save_betweenness_as="streamed_betweenness", save_path_exposure_as="streamed_exposure" if path_exposure_attribute else None)
+
+    assert streets["kept_betweenness"].sum() > 0
+    assert np.allclose(streets["kept_betweenness"], streets["streamed_betweenness"])
+    if path_exposure_attribute is not None:
+        origins = zonal['origins'].gdf
+        assert np.allclose(origins["kept_exposure"], origins["streamed_exposure"], equal_nan=True)
+
+
+def test_edge_betweenness_total_matches_dict_accumulation():
+    # the total the original per-edge dict accumulation gave for these parameters.
+    zonal = grid_zonal()
+    betweenness(zonal, search_radius=300, detour_ratio=1.15, closest_destination=False, decay=True, num_cores=1, save_betweenness_as="betweenness")
+    assert zonal['streets'].gdf["betweenness"].sum() == pytest.approx(351.3988189814973, rel=1e-9)
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="shared memory blocks are listed in /dev/shm")
+def test_pool_runs_match_a_single_core_run_and_free_shared_memory():
+    zonal = grid_zonal()
+    parameters = dict(search_radius=300, detour_ratio=1.15, closest_destination=False, decay=True)
+    betweenness(zonal, **parameters, num_cores=1, save_betweenness_as="single_core_betweenness")
+    shared_blocks = set(os.listdir("/dev/shm"))
+
+    betweenness(zonal, **parameters, num_cores=2, save_betweenness_as="two_core_betweenness")
+    with zonal.compute_pool(num_cores=2) as pool:
+        betweenness(zonal, **parameters, pool=pool, save_betweenness_as="first_betweenness")
+        betweenness(zonal, **parameters, pool=pool, save_betweenness_as="second_betweenness")
+        # a worker that dies while the pool is idle is replaced on the next call.
+        os.kill(next(iter(pool.executor._processes)), signal.SIGKILL)
+        time.sleep(0.5)
+        betweenness(zonal, **parameters, pool=pool, save_betweenness_as="restarted_betweenness")
+
+    streets = zonal['streets'].gdf
+    for name in ["two_core_betweenness", "first_betweenness", "second_betweenness", "restarted_betweenness"]:
+        assert np.allclose(streets[name], streets["single_core_betweenness"])
+    # the street network the pool kept, and blocks of every call, are freed.
+    assert set(os.listdir("/dev/shm")) == shared_blocks
+
+
+@pytest.mark.parametrize("chunking_method", ["concentric", "random", "pizza"])
+def test_a_tiny_memory_budget_chunks_destinations_without_changing_betweenness(chunking_method):
+    zonal = grid_zonal()
+    parameters = dict(search_radius=300, detour_ratio=1.15, closest_destination=False, decay=True, num_cores=1)
+    betweenness(zonal, **parameters, chunking_method="none", save_betweenness_as="unchunked_betweenness")
+
+    instrumentation = Instrumentation()
+    # a kilobyte fits a few destinations per chunk.
+    betweenness(zonal, **parameters, chunking_method=chunking_method, worker_memory_budget=0.001, save_betweenness_as="chunked_betweenness", instrumentation=instrumentation)
+
+    origin_table = instrumentation.origin_table()
+    assert (origin_table["chunks"] > 1).any()
+    assert (origin_table["chunks"] <= origin_table["eligible_destinations"]).all()
+    streets = zonal['streets'].gdf
+    assert np.allclose(streets["chunked_betweenness"], streets["unchunked_betweenness"])
+
+
+@pytest.mark.parametrize("num_cores", [1, 2])
+def test_instrumentation_counts_every_origin_and_diagnostics_join_the_origin_layer(num_cores):
+    zonal = grid_zonal()
+    instrumentation = Instrumentation()
+    betweenness(zonal, search_radius=300, detour_ratio=1.15, closest_destination=False, num_cores=num_cores, save_betweenness_as="flow", keep_diagnostics=True, instrumentation=instrumentation)
+
+    nodes = zonal.network.nodes
+    origin_table = instrumentation.origin_table()
+    assert sorted(origin_table.index) == sorted(nodes.index[nodes["type"] == "origin"])
+    reached = origin_table["eligible_destinations"] > 0
+    assert reached.any()
+    assert (origin_table["scope_nodes"] > 0).all()
+    assert (origin_table["heap_pushes"] > 0).all()
+    assert (origin_table["reachable_destinations"] >= origin_table["eligible_destinations"]).all()
+    # every reached destination has a path.
+    assert (origin_table.loc[reached, "chunks"] >= 1).all()
+    assert (origin_table["paths"] >= origin_table["eligible_destinations"]).all()
+    assert (origin_table["path_segments"] >= origin_table["paths"]).all()
+    assert (origin_table.loc[reached, "path_memory"] > 0).all()
+    assert (origin_table[Instrumentation.timers] >= 0).all().all()
+    assert origin_table[Instrumentation.timers].to_numpy().sum() > 0
+    assert instrumentation.summary().loc["paths", "total"] == origin_table["paths"].sum()
+
+    # the same counters are kept in the origin layer, for each origin.
+    origins = zonal['origins'].gdf
+    source_ids = nodes.loc[origin_table.index, "source_id"].values
+    for counter in Instrumentation.counters:
+        assert np.array_equal(origins.loc[source_ids, f"flow_{counter}"].values, origin_table[counter].values), counter
@@ -0,0 +1,54 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from madina.una.checkpoint import Checkpoint, sparse_delta, add_sparse_delta
+
+
+def test_completed_origins_are_read_without_loading_parts(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path), parameters={"search_radius": 300}, interval=0)
+    checkpoint.save({"origin_ids": [3, 5], "edge_betweenness": sparse_delta(np.array([0.0, 1.5, 0.0]))})
+    checkpoint.save({"origin_ids": [8], "edge_betweenness": sparse_delta(np.array([2.0, 0.0, 0.0]))})
+
+    # parts that can't be unpickled don't matter, only their origin ids are read.
+    for file_name in os.listdir(tmp_path):
+        if file_name.endswith(".pkl"):
+            with open(tmp_path / file_name, "wb") as part_file:
+                part_file.write(b"not a part")
+    assert checkpoint.completed_origins() == {3, 5, 8}
+
+    # origin ids of a part that was never renamed in place are ignored.
+    np.save(tmp_path / "part_unfinished.npy", np.array([13]))
+    assert checkpoint.completed_origins() == {3, 5, 8}
+
+    with pytest.raises(ValueError):
+        Checkpoint(str(tmp_path), parameters={"search_radius": 400})
+
+
+def test_parts_are_sparse_and_add_up(tmp_path):
+    edge_betweenness = np.zeros((6, 2))
+    edge_betweenness[[1, 4]] = [[1.0, 0.0], [0.5, 2.0]]
+    delta = sparse_delta(edge_betweenness)
+    assert delta["positions"].tolist() == [1, 4]
+
+    checkpoint = Checkpoint(str(tmp_path), interval=0)
+    checkpoint.save({"origin_ids": [1], "edge_betweenness": delta})
+    checkpoint.save({"origin_ids": [2], "edge_betweenness": delta})
+    total = np.zeros((6, 2))
+    for part in checkpoint.parts():
+        add_sparse_delta(total, part["edge_betweenness"])
+    assert np.array_equal(total, 2 * edge_betweenness)
+
+
+def test_without_a_directory_nothing_is_written(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with Checkpoint(interval=0) as checkpoint:
+        # workers never save, parts the run saves are kept in memory, and not sent to workers.
+        assert not checkpoint.due()
+        checkpoint.save({"origin_ids": [4, 7]})
+        assert checkpoint.completed_origins() == {4, 7}
+        assert [part["origin_ids"] for part in checkpoint.parts()] == [[4, 7]]
+        assert pickle.loads(pickle.dumps(checkpoint)).completed_origins() == set()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from benchmark_utils import synthetic_grid_zonal, networkx_reference_graph, assert_same_adjacency
+from madina.zonal.graph import CSRGraph, NetworkXGraph, OverlayGraph
+
+
+def small_graphs():
+    starts, ends, weights, edge_ids = [0, 1, 1, 3], [1, 2, 3, 4], [1.0, 2.0, 3.0, 4.0], [10, 11, 12, 13]
+    # node 5 is in the id space but has no edges.
+    csr_graph = CSRGraph.from_edges(starts, ends, weights, edge_ids, node_count=6)
+    nx_graph = NetworkXGraph()
+    for start, end, weight, edge_id in zip(starts, ends, weights, edge_ids):
+        nx_graph.add_edge(start, end, weight=weight, id=edge_id)
+    return csr_graph, nx_graph
+
+
+@pytest.mark.parametrize("node", [-1, 5, 6, 100])
+def test_csr_graph_rejects_nodes_not_in_graph(node):
+    csr_graph, nx_graph = small_graphs()
+    for graph in [csr_graph, csr_graph.overlay(), nx_graph]:
+        with pytest.raises(KeyError):
+            graph.neighbor_edges(node)
+        with pytest.raises(KeyError):
+            graph.neighbor_count(node)
+
+
+def test_overlay_graph_rejects_removed_nodes():
+    csr_graph, nx_graph = small_graphs()
+    overlay = csr_graph.overlay()
+    overlay.remove_node(3)
+    nx_graph.remove_node(3)
+    for graph in [overlay, nx_graph]:
+        assert 3 not in graph
+        with pytest.raises(KeyError):
+            graph.neighbor_edges(3)
+        with pytest.raises(KeyError):
+            graph.neighbor_count(3)
+        assert sorted(graph.neighbor_edges(1)) == [(0, 1.0, 10), (2, 2.0, 11)]
+
+
+def test_csr_light_graph_matches_networkx():
+    zonal = synthetic_grid_zonal(4, origin_count=10, destination_count=10)
+    zonal.create_graph(engine="csr")
+    network = zonal.network
+    street_nodes = network.nodes.index[network.nodes["type"] == "street_node"]
+
+    assert isinstance(network.light_graph, CSRGraph)
+    assert_same_adjacency(network.light_graph, networkx_reference_graph(network), street_nodes)
+    assert_same_adjacency(network.light_graph.to_networkx(), networkx_reference_graph(network), street_nodes)
+
+
+def test_vectorized_networkx_graphs_match_edge_by_edge_build():
+    zonal = synthetic_grid_zonal(4, origin_count=10, destination_count=10)
+    zonal.create_graph(od_graph=True, engine="networkx")
+    network = zonal.network
+    nodes = network.nodes
+    destinations = list(nodes.index[nodes["type"] == "destination"])
+    origins_and_destinations = list(nodes.index[nodes["type"] != "street_node"])
+
+    assert_same_adjacency(network.light_graph, networkx_reference_graph(network), nodes.index[nodes["type"] == "street_node"])
+    assert_same_adjacency(network.d_graph, networkx_reference_graph(network, destinations), network.d_graph.nodes)
+    assert_same_adjacency(network.od_graph, networkx_reference_graph(network, origins_and_destinations), network.od_graph.nodes)
+
+
+def test_overlay_graphs_match_networkx_and_copy_on_write():
+    zonal = synthetic_grid_zonal(4, origin_count=10, destination_count=10)
+    zonal.create_graph(od_graph=True, engine="csr")
+    network = zonal.network
+    nodes = network.nodes
+    destinations = list(nodes.index[nodes["type"] == "destination"])
+    origins_and_destinations = list(nodes.index[nodes["type"] != "street_node"])
+
+    d_graph_reference = networkx_reference_graph(network, destinations)
+    assert isinstance(network.d_graph, OverlayGraph)
+    assert set(network.d_graph.nodes().tolist()) == set(d_graph_reference.nodes)
+    assert_same_adjacency(network.d_graph, d_graph_reference, d_graph_reference.nodes)
+    assert_same_adjacency(network.od_graph, networkx_reference_graph(network, origins_and_destinations), network.od_graph.nodes())
+
+    # edits to a copy are the same as edits to networkx, and leave the shared graphs as they were.
+    overlay = network.d_graph.copy()
+    reference = d_graph_reference.copy()
+    removed = destinations[0]
+    neighbor, _, edge_id = network.d_graph.neighbor_edges(removed)[0]
+    for graph in [overlay, reference]:
+        graph.remove_node(removed)
+        graph.add_edge(neighbor, destinations[1], weight=1.5, id=edge_id)
+    assert removed not in overlay
+    assert set(overlay.nodes().tolist()) == set(reference.nodes)
+    assert_same_adjacency(overlay, reference, reference.nodes)
+    assert_same_adjacency(network.d_graph, d_graph_reference, d_graph_reference.nodes)
+    assert_same_adjacency(network.light_graph, networkx_reference_graph(network), nodes.index[nodes["type"] == "street_node"])
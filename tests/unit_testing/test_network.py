@@ -0,0 +1,121 @@
+import numpy as np
+import geopandas as gpd
+import pytest
+import shapely.geometry as geo
+
+from benchmark_utils import cambridge_zonal, synthetic_grid_zonal, networkx_reference_graph, assert_same_adjacency
+from madina.una.paths import angle_deviation_between_two_lines
+from madina.zonal.graph import copy_graph_attributes
+from madina.zonal.zonal import Zonal
+
+
+def test_nodes_snapped_to_an_edge_end_keep_distinct_offsets():
+    streets = [
+        geo.LineString([(0, 0), (100, 0)]),
+        geo.LineString([(100, 0), (200, 0)]),
+        geo.LineString([(100, 0), (100, 100)]),
+    ]
+    zonal = Zonal()
+    zonal.load_layer('streets', gpd.GeoDataFrame(geometry=streets, crs="EPSG:3857"))
+    # three destinations on the same street end, and one halfway along the edge.
+    zonal.load_layer('destinations', gpd.GeoDataFrame({"weight": [1, 1, 1, 1]}, geometry=gpd.points_from_xy([100, 100, 100, 50], [0, 0, 0, 0]), crs="EPSG:3857"))
+    zonal.create_street_network('streets', node_snapping_tolerance=0.1)
+    zonal.insert_node('destinations', label='destination', weight_attribute='weight')
+    zonal.create_graph()
+
+    network = zonal.network
+    destinations = network.nodes.index[network.nodes["type"] == "destination"]
+    offsets = network.chain_offsets(destinations)
+    assert np.unique(offsets).shape[0] == offsets.shape[0]
+    for destination in destinations:
+        assert all(weight > 0 for _, weight, _ in network.d_graph.neighbor_edges(destination))
+
+
+@pytest.mark.parametrize("engine", ["csr", "networkx"])
+def test_adding_and_removing_nodes_matches_networkx(engine):
+    # few streets for many nodes, so most edges hold a chain of several nodes.
+    zonal = synthetic_grid_zonal(2, origin_count=20, destination_count=20)
+    zonal.create_graph(engine=engine)
+    network = zonal.network
+    nodes = network.nodes
+    destinations = list(nodes.index[nodes["type"] == "destination"])
+    origins = list(nodes.index[nodes["type"] == "origin"])
+
+    graph = network.d_graph.copy()
+    graph.graph = copy_graph_attributes(network.d_graph.graph)
+    for origin in origins:
+        network.add_node_to_graph(graph, origin)
+    reference = networkx_reference_graph(network, destinations + origins)
+    assert_same_adjacency(graph, reference, reference.nodes)
+
+    chains = graph.graph["edge_chains"]
+    for edge_id, (offsets, chain_nodes) in chains.chains.items():
+        assert offsets == sorted(offsets)
+        assert set(chain_nodes) == set(nodes.index[(nodes["type"] != "street_node") & (nodes["nearest_edge_id"] == edge_id)])
+
+    for origin in np.random.default_rng(0).permutation(origins).tolist():
+        network.remove_node_to_graph(graph, origin)
+    reference = networkx_reference_graph(network, destinations)
+    assert all(origin not in graph for origin in origins)
+    assert_same_adjacency(graph, reference, reference.nodes)
+
+
+def test_virtual_node_graph_matches_inserting_the_node():
+    zonal = synthetic_grid_zonal(2, origin_count=20, destination_count=20)
+    zonal.create_graph(engine="csr")
+    network = zonal.network
+    nodes = network.nodes
+    destinations = list(nodes.index[nodes["type"] == "destination"])
+    d_graph_reference = networkx_reference_graph(network, destinations)
+
+    for origin in nodes.index[nodes["type"] == "origin"]:
+        view = network.virtual_node_graph(network.d_graph, origin)
+        reference = networkx_reference_graph(network, destinations + [origin])
+        assert origin in view
+        assert_same_adjacency(view, reference, reference.nodes)
+        # the viewed graph is never edited
+        assert origin not in network.d_graph
+        assert_same_adjacency(network.d_graph, d_graph_reference, d_graph_reference.nodes)
+
+
+def turn_penalty_from_geometries(network, previous_node, current_node, next_node):
+    # turn penalties as they were computed on every call, from node geometries.
+    geometries = network.nodes.geometry
+    angle = angle_deviation_between_two_lines([geometries[previous_node], geometries[current_node], geometries[next_node]])
+    angle = min(angle, abs(angle - 180))
+    return network.turn_penalty_amount if angle > network.turn_threshold_degree else 0
+
+
+def assert_turn_costs_match_geometries(network):
+    table = network.turn_costs()
+    turns = 0
+    for node in network.d_graph.nodes().tolist():
+        neighbors = network.d_graph.neighbors(node)
+        for previous_node in neighbors:
+            for next_node in neighbors:
+                assert table.penalty(previous_node, node, next_node) == turn_penalty_from_geometries(network, previous_node, node, next_node)
+                turns += table.penalty(previous_node, node, next_node) > 0
+    assert turns > 0
+
+
+def test_cached_turn_costs_match_per_call_computation():
+    zonal = cambridge_zonal()
+    zonal.create_graph()
+    network = zonal.network
+    # street turns are precomputed, turns through inserted destinations are computed on first use.
+    assert len(network.turn_costs().costs) > 0
+    assert_turn_costs_match_geometries(network)
+    assert network.turn_costs() is network.turn_costs()
+
+
+def test_set_turn_parameters_drops_cached_turn_costs():
+    zonal = cambridge_zonal(turn_threshold_degree=45, turn_penalty_amount=30)
+    zonal.create_graph()
+    network = zonal.network
+    table = network.turn_costs()
+
+    zonal.set_turn_parameters(turn_threshold_degree=20, turn_penalty_amount=10)
+    assert network.turn_cost_table is None
+    assert network.turn_costs() is not table
+    assert (network.turn_costs().turn_threshold_degree, network.turn_costs().turn_penalty_amount) == (20, 10)
+    assert_turn_costs_match_geometries(network)
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+from benchmark_utils import synthetic_grid_zonal
+from madina.una.tools import betweenness
+from madina.una.path_records import read_path_records
+
+pytest.importorskip("pyarrow")
+
+
+def grid_zonal():
+    zonal = synthetic_grid_zonal(6, origin_count=30, destination_count=30, seed=0)
+    zonal.create_graph()
+    return zonal
+
+
+def test_path_records_round_trip_through_read_path_records(tmp_path):
+    zonal = grid_zonal()
+    record_directory = str(tmp_path / "paths")
+    betweenness(zonal, search_radius=300, detour_ratio=1.1, closest_destination=False, num_cores=1, path_record_directory=record_directory)
+    edges = zonal.network.edges
+
+    path_records = read_path_records(record_directory)
+    assert path_records.shape[0] > 0
+    # the betweenness of every path, on every edge it uses, adds up to edge betweenness.
+    edge_positions = zonal.network.edge_positions()
+    edge_counts = path_records["edge_ids"].map(len).values
+    flat_edge_ids = np.concatenate(path_records["edge_ids"].values)
+    record_betweenness = np.bincount(edge_positions[flat_edge_ids], weights=np.repeat(path_records["path_betweenness"].values, edge_counts), minlength=edges.shape[0])
+    assert np.allclose(record_betweenness, edges["betweenness"].values)
+    # trips of an origin are split among its destinations and their paths.
+    assert np.allclose(path_records.groupby(["origin_id", "destination_id"])["path_probability"].sum(), 1)
+
+    origin_id = path_records["origin_id"].iloc[0]
+    origin_paths = read_path_records(record_directory, zonal, filters=[("origin_id", "==", origin_id)])
+    assert origin_paths.shape[0] == (path_records["origin_id"] == origin_id).sum()
+    # geometries are whole edges, paths start and end along edges
+    assert (origin_paths.geometry.length >= origin_paths["path_weight"] - 1e-6).all()
+
+
+def test_path_records_of_another_run_are_not_removed(tmp_path):
+    zonal = grid_zonal()
+    parameters = dict(search_radius=300, detour_ratio=1.1, closest_destination=False, num_cores=1)
+    record_directory = tmp_path / "paths"
+    record_directory.mkdir()
+    (record_directory / "notes.txt").write_text("kept")
+
+    checkpoint_directory = str(tmp_path / "checkpoint")
+    betweenness(zonal, **parameters, path_record_directory=str(record_directory), checkpoint_directory=checkpoint_directory, checkpoint_interval=0)
+    record_files = sorted(os.listdir(record_directory))
+    assert "notes.txt" in record_files
+
+    # another run can't write to the same directory, the run can be resumed in it.
+    with pytest.raises(ValueError):
+        betweenness(zonal, **parameters, path_record_directory=str(record_directory))
+    betweenness(zonal, **parameters, path_record_directory=str(record_directory), checkpoint_directory=checkpoint_directory, checkpoint_interval=0)
+    assert sorted(os.listdir(record_directory)) == record_files
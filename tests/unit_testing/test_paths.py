@@ -0,0 +1,253 @@
+from collections import deque
+from heapq import heappush, heappop
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from benchmark_utils import cambridge_zonal, synthetic_grid_zonal, networkx_reference_graph
+from madina.una.paths import turn_o_scope, bfs_subgraph_generation, wandering_messenger, angle_deviation_between_two_lines
+
+
+@pytest.fixture(scope="module")
+def cambridge():
+    zonal = cambridge_zonal()
+    zonal.create_graph()
+    return zonal
+
+
+@pytest.fixture(scope="module")
+def grid():
+    zonal = synthetic_grid_zonal(4, origin_count=10, destination_count=20)
+    zonal.create_graph()
+    return zonal
+
+
+def test_scope_search_matches_networkx_dijkstra(grid):
+    network = grid.network
+    nodes = network.nodes
+    destinations = list(nodes.index[nodes["type"] == "destination"])
+    for origin_idx in nodes.index[nodes["type"] == "origin"]:
+        d_idxs, o_scope, o_scope_paths = turn_o_scope(network, origin_idx, search_radius=300, detour_ratio=1.2, turn_penalty=False)
+        reference = networkx_reference_graph(network, destinations + [origin_idx])
+        # the grid has no dead ends, every node within the scope limit is in scope
+        distances = nx.single_source_dijkstra_path_length(reference, origin_idx, cutoff=300 * 1.2)
+
+        assert set(o_scope) == set(distances)
+        assert all(o_scope[node] == pytest.approx(distance, abs=1e-4) for node, distance in distances.items())
+        assert set(d_idxs) == {node for node in destinations if distances.get(node, float("inf")) <= 300}
+        for node in o_scope_paths.keys():
+            path = o_scope_paths[node]
+            assert path[0] == origin_idx
+            assert nx.path_weight(reference, path, "weight") == pytest.approx(o_scope[node], abs=1e-4)
+
+
+def edge_state_distances(network, graph, origin_idx, scope_limit):
+    """
+    Turn-penalized distances from `origin_idx` in a networkx graph, by Dijkstra over a line graph of (node,
+    previous node) states, with turn penalties computed from node geometries.
+    """
+    geometries = network.nodes.geometry
+
+    def turn_penalty(previous_node, node, next_node):
+        angle = angle_deviation_between_two_lines([geometries[previous_node], geometries[node], geometries[next_node]])
+        angle = min(angle, abs(angle - 180))
+        return network.turn_penalty_amount if angle > network.turn_threshold_degree else 0
+
+    states = nx.DiGraph()
+    for neighbor in graph.neighbors(origin_idx):
+        states.add_edge((origin_idx, -1), (neighbor, origin_idx), weight=graph[origin_idx][neighbor]["weight"])
+    for previous_node, node in graph.to_directed().edges:
+        for next_node in graph.neighbors(node):
+            if next_node not in [previous_node, origin_idx]:
+                states.add_edge((node, previous_node), (next_node, node), weight=graph[node][next_node]["weight"] + turn_penalty(previous_node, node, next_node))
+
+    distances = {}
+    for (node, _), distance in nx.single_source_dijkstra_path_length(states, (origin_idx, -1), cutoff=scope_limit).items():
+        distances[node] = min(distance, distances.get(node, float("inf")))
+    return distances
+
+
+def test_edge_state_turn_search_matches_networkx_line_graph(grid):
+    network = grid.network
+    nodes = network.nodes
+    destinations = list(nodes.index[nodes["type"] == "destination"])
+    for origin_idx in nodes.index[nodes["type"] == "origin"]:
+        d_idxs, o_scope, o_scope_paths = turn_o_scope(network, origin_idx, search_radius=300, detour_ratio=1.2, turn_penalty=True)
+        reference = networkx_reference_graph(network, destinations + [origin_idx])
+        distances = edge_state_distances(network, reference, origin_idx, 300 * 1.2)
+
+        assert set(o_scope) == set(distances)
+        assert all(o_scope[node] == pytest.approx(distance, abs=1e-4) for node, distance in distances.items())
+        assert set(d_idxs) == {node for node in destinations if distances.get(node, float("inf")) <= 300}
+
+
+def test_every_reachable_destination_has_a_shortest_path(cambridge):
+    # with detour_ratio=1, paths are only kept within a small tolerance of the shortest distance. the reverse
+    # searches must keep every node on a shortest path, whatever order destinations are searched in.
+    network = cambridge.network
+    origins = network.nodes.index[network.nodes["type"] == "origin"][:100]
+    for origin_idx in origins:
+        o_graph = network.virtual_node_graph(network.d_graph, origin_idx)
+        d_idxs, o_scope, o_scope_paths = turn_o_scope(network, origin_idx, search_radius=600, detour_ratio=1, turn_penalty=False, o_graph=o_graph)
+        d_idxs = dict(sorted(d_idxs.items(), key=lambda item: item[1]))
+        scope_nodes, distance_matrix, _ = bfs_subgraph_generation(origin_idx, detour_ratio=1, o_graph=o_graph, d_idxs=d_idxs, o_scope=o_scope, o_scope_paths=o_scope_paths)
+        path_trie = wandering_messenger(network, o_graph, origin_idx, d_idxs, distance_matrix=distance_matrix, od_scope=scope_nodes)
+        for d_idx in d_idxs:
+            assert len(path_trie.paths(d_idx)) > 0, f"no path from {origin_idx} to {d_idx}"
+
+
+def trailblazer_distances(o_idx, detour_ratio, o_graph, d_idxs, o_scope, o_scope_paths):
+    """
+    Node to destination distances of the original reverse searches, one Dijkstra search per destination, where
+    trailblazing marks the nodes on the origin's shortest path to each reached node with a placeholder distance.
+    Two of its quirks are fixed: a destination's row isn't reset when its search starts, and improving a placeholder
+    doesn't continue the search past the origin. Returns {node: {destination: distance}}, and the placeholder.
+    """
+    distance_matrix = {node: {} for node in o_scope}
+    placeholder = max(d_idxs.values()) + 1
+
+    def trailblaze(d_idx, source):
+        for node in o_scope_paths[source][-2::-1]:
+            if d_idx in distance_matrix[node]:
+                break
+            distance_matrix[node][d_idx] = placeholder
+
+    queue = []
+    for d_idx in d_idxs:
+        distance_matrix[d_idx][d_idx] = 0
+        trailblaze(d_idx, d_idx)
+        heappush(queue, (0, d_idx))
+        while queue:
+            weight, node = heappop(queue)
+            for neighbor, edge_weight, _ in o_graph.neighbor_edges(node):
+                if neighbor not in o_scope:
+                    continue
+                spent_weight = edge_weight + weight
+                if d_idx in distance_matrix[neighbor]:
+                    if spent_weight < distance_matrix[neighbor][d_idx]:
+                        distance_matrix[neighbor][d_idx] = spent_weight
+                        if neighbor != o_idx:
+                            heappush(queue, (spent_weight, neighbor))
+                    continue
+                if spent_weight + o_scope[neighbor] > o_scope[d_idx] * detour_ratio:
+                    continue
+                if o_graph.neighbor_count(neighbor) == 1:
+                    continue
+                distance_matrix[neighbor][d_idx] = spent_weight
+                if neighbor == o_idx:
+                    continue
+                trailblaze(d_idx, neighbor)
+                heappush(queue, (spent_weight, neighbor))
+    return distance_matrix, placeholder
+
+
+@pytest.mark.parametrize("zonal_name, search_radius, detour_ratio", [("grid", 300, 1.2), ("cambridge", 600, 1.15)])
+def test_reverse_searches_match_trailblazer_distances(request, zonal_name, search_radius, detour_ratio):
+    # every distance the original searches found is kept, unchanged. they also leave placeholders where the distance
+    # is above the placeholder, and miss pairs trailblazing stopped the search at, which are found here instead.
+    network = request.getfixturevalue(zonal_name).network
+    origins = network.nodes.index[network.nodes["type"] == "origin"][:30]
+    for origin_idx in origins:
+        o_graph = network.virtual_node_graph(network.d_graph, origin_idx)
+        d_idxs, o_scope, o_scope_paths = turn_o_scope(network, origin_idx, search_radius=search_radius, detour_ratio=detour_ratio, turn_penalty=False, o_graph=o_graph)
+        if len(d_idxs) == 0:
+            continue
+        d_idxs = dict(sorted(d_idxs.items(), key=lambda item: item[1]))
+        scope_nodes, distance_matrix, _ = bfs_subgraph_generation(origin_idx, detour_ratio=detour_ratio, o_graph=o_graph, d_idxs=d_idxs, o_scope=o_scope, o_scope_paths=o_scope_paths)
+        reference, placeholder = trailblazer_distances(origin_idx, detour_ratio, o_graph, d_idxs, o_scope, o_scope_paths)
+
+        reference_pairs = {(node, d_idx): distance for node, row in reference.items() for d_idx, distance in row.items() if distance != placeholder}
+        assert len(reference_pairs) > 0
+        for (node, d_idx), distance in reference_pairs.items():
+            assert node in scope_nodes
+            assert distance_matrix[node][d_idx] == pytest.approx(distance, abs=1e-9), f"{origin_idx = }, {node = }, {d_idx = }"
+        # a placeholder is only left where the distance isn't shorter than it
+        for node in scope_nodes:
+            for d_idx, distance in distance_matrix[node].items():
+                if reference[node].get(d_idx) == placeholder:
+                    assert distance >= placeholder
+
+
+def listed_paths(network, o_graph, o_idx, d_idxs, distance_matrix, turn_penalty, od_scope):
+    """
+    Paths of the original `wandering_messenger`, as lists of edge ids and weights per destination, with a path
+    diary page that copies the nodes, targets and edges visited on the way to it.
+    """
+    graph_dict = {node: {neighbor: (weight, edge_id) for neighbor, weight, edge_id in o_graph.neighbor_edges(node) if neighbor in od_scope} for node in od_scope}
+    turn_cost_value = network.turn_costs().penalty if turn_penalty else None
+    path_edges = {d_idx: [] for d_idx in d_idxs}
+    distances = {d_idx: [] for d_idx in d_idxs}
+
+    path_diary = [(o_idx, [], [], [], 0)]
+    path_tree = deque([(o_neighbor, 0) for o_neighbor in graph_dict[o_idx]])
+    while path_tree:
+        node, source_diary_page = path_tree.pop()
+        source, source_visited, source_visited_targets, source_visited_edges, source_weight = path_diary[source_diary_page]
+        turn_cost = turn_cost_value(source_visited[-1], source, node) if (turn_penalty and len(source_visited) > 0) else 0
+        edge_weight, edge_id = graph_dict[source][node]
+        node_weight = source_weight + edge_weight + turn_cost
+        node_visited_edges = source_visited_edges if edge_id in source_visited_edges else source_visited_edges + [edge_id]
+
+        if (node in d_idxs) and (node_weight - d_idxs[node] <= 0.00001):
+            path_edges[node].append(node_visited_edges)
+            distances[node].append(node_weight)
+            node_visited_targets = source_visited_targets + [node]
+        else:
+            node_visited_targets = source_visited_targets
+
+        for target in distance_matrix[node]:
+            if (target not in node_visited_targets) and (distance_matrix[node][target] + node_weight - d_idxs[target] <= 0.00001):
+                node_visited = source_visited + [source]
+                path_diary = path_diary[:source_diary_page + 1] + [(node, node_visited, node_visited_targets, node_visited_edges, node_weight)]
+                for neighbor in graph_dict[node]:
+                    if neighbor not in node_visited:
+                        path_tree.append((neighbor, source_diary_page + 1))
+                break
+    return path_edges, distances
+
+
+@pytest.mark.parametrize("turn_penalty", [False, True])
+def test_path_trie_holds_the_listed_paths(grid, turn_penalty):
+    network = grid.network
+    for origin_idx in network.nodes.index[network.nodes["type"] == "origin"]:
+        o_graph = network.virtual_node_graph(network.d_graph, origin_idx)
+        d_idxs, o_scope, o_scope_paths = turn_o_scope(network, origin_idx, search_radius=300, detour_ratio=1.2, turn_penalty=turn_penalty, o_graph=o_graph)
+        d_idxs = dict(sorted(d_idxs.items(), key=lambda item: item[1]))
+        scope_nodes, distance_matrix, _ = bfs_subgraph_generation(origin_idx, detour_ratio=1.2, o_graph=o_graph, d_idxs=d_idxs, o_scope=o_scope, o_scope_paths=o_scope_paths)
+        path_trie = wandering_messenger(network, o_graph, origin_idx, d_idxs, distance_matrix=distance_matrix, turn_penalty=turn_penalty, od_scope=scope_nodes)
+        path_edges, distances = listed_paths(network, o_graph, origin_idx, d_idxs, distance_matrix, turn_penalty, scope_nodes)
+
+        assert len(path_trie) == sum(len(d_paths) for d_paths in path_edges.values())
+        for d_idx in d_idxs:
+            listed = sorted((tuple(edges), round(distance, 6)) for edges, distance in zip(path_edges[d_idx], distances[d_idx]))
+            expanded = sorted((tuple(path_trie[path]), round(float(weight), 6)) for path, weight in zip(path_trie.paths(d_idx), path_trie.weights(d_idx)))
+            assert expanded == listed, f"{origin_idx = }, {d_idx = }"
+        # expanding all paths at once gives the same edges
+        offsets, edge_ids = path_trie.edge_lists(range(len(path_trie)))
+        assert all(edge_ids[offsets[path]:offsets[path + 1]].tolist() == path_trie[path] for path in range(len(path_trie)))
+
+
+def test_trie_edge_sums_match_dict_accumulation(grid):
+    network = grid.network
+    edge_positions = network.edge_positions()
+    rng = np.random.default_rng(0)
+    for origin_idx in network.nodes.index[network.nodes["type"] == "origin"]:
+        o_graph = network.virtual_node_graph(network.d_graph, origin_idx)
+        d_idxs, o_scope, o_scope_paths = turn_o_scope(network, origin_idx, search_radius=300, detour_ratio=1.2, turn_penalty=False, o_graph=o_graph)
+        d_idxs = dict(sorted(d_idxs.items(), key=lambda item: item[1]))
+        scope_nodes, distance_matrix, _ = bfs_subgraph_generation(origin_idx, detour_ratio=1.2, o_graph=o_graph, d_idxs=d_idxs, o_scope=o_scope, o_scope_paths=o_scope_paths)
+        path_trie = wandering_messenger(network, o_graph, origin_idx, d_idxs, distance_matrix=distance_matrix, od_scope=scope_nodes)
+        path_values = rng.uniform(0, 1, len(path_trie))
+
+        edge_totals = {}
+        for path, path_value in enumerate(path_values):
+            for edge_id in path_trie[path]:
+                edge_totals[edge_id] = edge_totals.get(edge_id, 0.0) + path_value
+        expected = np.zeros(network.edges.shape[0])
+        for edge_id, edge_total in edge_totals.items():
+            expected[edge_positions[edge_id]] = edge_total
+
+        edge_ids, node_sums = path_trie.edge_sums(path_values)
+        accumulated = np.bincount(edge_positions[edge_ids], weights=node_sums, minlength=network.edges.shape[0])
+        assert np.allclose(accumulated, expected)
@@ -0,0 +1,57 @@
+import pickle
+
+import numpy as np
+
+from madina.una.scheduler import OriginScheduler
+
+
+def worker_handles(scheduler, count):
+    # workers get the scheduler pickled, and share its queues.
+    scheduler.initialize_worker()
+    return [pickle.loads(pickle.dumps(scheduler)) for _ in range(count)]
+
+
+def test_origins_are_dealt_longest_first_to_the_least_loaded_worker():
+    rng = np.random.default_rng(0)
+    origin_ids = np.arange(100, 160)
+    costs = rng.uniform(1, 100, origin_ids.shape[0])
+    with OriginScheduler(origin_ids, costs=costs, num_workers=4) as scheduler:
+        origins = scheduler.shared["origins"]
+        deques = scheduler.shared["deques"]
+        origin_costs = dict(zip(origin_ids.tolist(), costs.tolist()))
+
+        worker_costs = []
+        for head, tail in deques.tolist():
+            queue_costs = [origin_costs[origin] for origin in origins[head:tail].tolist()]
+            # each worker starts with its most expensive origins
+            assert queue_costs == sorted(queue_costs, reverse=True)
+            worker_costs.append(sum(queue_costs))
+
+        assert sorted(origins.tolist()) == origin_ids.tolist()
+        # longest processing time first is within 4/3 of the best possible balance
+        assert max(worker_costs) <= (4 / 3) * max(costs.sum() / 4, costs.max())
+        assert max(worker_costs) - min(worker_costs) <= costs.max()
+
+
+def test_idle_workers_steal_and_every_origin_is_handed_out_once():
+    origin_ids = np.arange(40)
+    costs = np.ones(40)
+    with OriginScheduler(origin_ids, costs=costs, num_workers=2) as scheduler:
+        fast, slow = worker_handles(scheduler, 2)
+        slow_origins = [slow.get()]
+        victim_queue = scheduler.shared["origins"][slice(*scheduler.shared["deques"][slow.slot])].tolist()
+
+        # the fast worker runs through its own queue, then steals from the tail of the slow worker's queue.
+        fast_origins = [fast.get() for _ in range(21)]
+        assert set(fast_origins[:20]).isdisjoint(victim_queue)
+        assert fast_origins[20] in victim_queue[len(victim_queue) // 2 - 1:]
+
+        while (origin_idx := slow.get()) != "done":
+            slow_origins.append(origin_idx)
+        while (origin_idx := fast.get()) != "done":
+            fast_origins.append(origin_idx)
+
+        assert len(slow_origins) < 20
+        handed_out = slow_origins + fast_origins
+        assert sorted(handed_out) == origin_ids.tolist()
+        assert scheduler.done_count == origin_ids.shape[0]
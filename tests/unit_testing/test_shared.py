@@ -0,0 +1,31 @@
+import pickle
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+from benchmark_utils import synthetic_grid_zonal
+from madina.zonal.shared import SharedZonal, WORKER_NODE_COLUMNS, WORKER_EDGE_COLUMNS
+
+
+def test_shared_zonal_round_trip_and_blocks_are_freed():
+    zonal = synthetic_grid_zonal(4, origin_count=10, destination_count=20)
+    zonal.create_graph()
+    network = zonal.network
+
+    with SharedZonal(zonal) as shared_zonal:
+        block_names = [shared_zonal.arrays.memory.name, shared_zonal.street_network.arrays.memory.name]
+        # what a worker gets: the same network, built on the shared blocks.
+        worker_network = pickle.loads(pickle.dumps(shared_zonal)).network
+        worker_nodes = worker_network.nodes.loc[network.nodes.index]
+        for column in WORKER_NODE_COLUMNS:
+            assert worker_nodes[column].tolist() == network.nodes[column].tolist(), column
+        assert np.array_equal(worker_network.edges.loc[network.edges.index, WORKER_EDGE_COLUMNS].values, network.edges[WORKER_EDGE_COLUMNS].values)
+        graph_nodes = [node for node in network.nodes.index if node in network.d_graph]
+        assert len(graph_nodes) > 0
+        for node in graph_nodes:
+            assert sorted(worker_network.d_graph.neighbor_edges(node)) == sorted(network.d_graph.neighbor_edges(node))
+
+    for block_name in block_names:
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=block_name)